@@ -24,13 +24,17 @@ requirements = [
     "mpld3",
     "numpy",
     "pandas",
-    "scipy",
+    "scipy>=1.4,<2",
 ]
 
 test_requirements = [
     "pytest",
 ]
 
+extras_requirements = {
+    "jit": ["numba"],
+}
+
 
 setup(
     name="waterpy",
@@ -49,6 +53,7 @@ setup(
     entry_points={"console_scripts": ["waterpy = waterpy.cli:main"]},
     include_package_data=True,
     install_requires=requirements,
+    extras_require=extras_requirements,
     license=license,
     zip_safe=False,
     keywords="waterpy",
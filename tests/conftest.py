@@ -0,0 +1,85 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+INPUT_DIR = Path(__file__).resolve().parent.parent / "example" / "input"
+
+
+@pytest.fixture
+def make_configfile(tmp_path):
+    """Return a function writing a model config file of the example basin,
+    with the first num_days of the timeseries and the given options."""
+    def make(num_days=450, **options):
+        timeseries_file = tmp_path / "timeseries.csv"
+        pd.read_csv(INPUT_DIR / "timeseries_litmill.csv").head(num_days).to_csv(
+            timeseries_file, index=False
+        )
+
+        config_options = {
+            "option_pet": "hamon",
+            "option_snowmelt": "no",
+            "option_channel_routing": "yes",
+            "option_karst": "no",
+            "option_randomize_daily_to_hourly": "no",
+            "option_hourly_streaming": "no",
+            "option_write_output_matrices": "no",
+            "option_max_min": "no",
+            "option_distribution_record": "no",
+            "option_dist_file": "",
+            "option_forecast": "no",
+            "option_engine": "python",
+        }
+        config_options.update(options)
+
+        lines = [
+            "[Inputs]",
+            "input_dir = {}".format(INPUT_DIR),
+            "characteristics_basin_file = ${Inputs:input_dir}/characteristics_basin_litmill.csv",
+            "parameters_land_type_file = ${Inputs:input_dir}/parameters_forest_Litmill.csv",
+            "timeseries_file = {}".format(timeseries_file),
+            "twi_file = ${Inputs:input_dir}/twi_Litmill.csv",
+            "state_file =",
+            "data_dir = {}".format(INPUT_DIR),
+            "",
+            "[Outputs]",
+            "output_dir = {}".format(tmp_path),
+            "output_filename = output.csv",
+            "",
+            "[Options]",
+        ]
+        lines += ["{} = {}".format(name, value) for name, value in config_options.items()]
+
+        configfile = tmp_path / "modelconfig.ini"
+        configfile.write_text("\n".join(lines) + "\n")
+
+        return str(configfile)
+
+    return make
+
+
+@pytest.fixture
+def boundsfile(tmp_path):
+    """Calibration bounds file of parameters that are not preprocessed."""
+    filepath = tmp_path / "bounds.csv"
+    filepath.write_text(
+        "name,minimum,maximum\n"
+        "rooting_depth_factor,0.1,0.5\n"
+        "saturated_hydraulic_conductivity,500,5000\n"
+    )
+
+    return str(filepath)
+
+
+@pytest.fixture
+def rain_file(tmp_path):
+    """Rain distribution file of 5 patterns of 24 hourly fractions."""
+    rng = np.random.default_rng(5)
+    fractions = rng.random((24, 5))
+    filepath = tmp_path / "rain_distribution.csv"
+    np.savetxt(filepath, fractions / fractions.sum(axis=0), delimiter=",",
+               header=",".join("pattern_{}".format(k) for k in range(5)), comments="")
+
+    return str(filepath)
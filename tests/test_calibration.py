@@ -0,0 +1,126 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from waterpy import calibration
+from waterpy import kernel
+from waterpy import metrics
+from waterpy import parametersfile
+
+
+VALUES = np.array([0.25, 2263.5])
+
+MODES = {
+    "daily": {},
+    "hourly": {"option_randomize_daily_to_hourly": "yes"},
+    "hourly_streaming": {"option_randomize_daily_to_hourly": "yes", "option_hourly_streaming": "yes"},
+}
+
+
+@pytest.fixture(params=["python", "vectorized", "jit"])
+def engine(request, monkeypatch):
+    """Engine of the runs. Without Numba, the jit engine runs the kernel
+    functions uncompiled, so the kernel is still tested."""
+    if request.param == "jit":
+        monkeypatch.setattr(kernel, "NUMBA_AVAILABLE", True)
+
+    return request.param
+
+
+@pytest.mark.parametrize("mode", sorted(MODES))
+def test_run_trial_aborts_only_if_threshold_can_not_be_beaten(make_configfile, boundsfile, engine, mode):
+    if engine != "python" and mode == "hourly_streaming":
+        pytest.skip("Hourly streaming runs the same days with every engine")
+    configfile = make_configfile(option_engine=engine, **MODES[mode])
+    calibration.initialize_worker(configfile, boundsfile, "nash_sutcliffe")
+
+    flow_predicted, observed, _ = calibration.run_trial(VALUES)
+    assert len(flow_predicted) == len(observed)
+    nash_sutcliffe = metrics.goodness_of_fit(observed, flow_predicted)["nash_sutcliffe"][0]
+    sum_squared_error = np.nansum((observed - flow_predicted)**2)
+
+    # Threshold just below the finished efficiency, the run is not stopped
+    # and the bound has the squared errors of every output day
+    flow_bounded, _, objective_bound = calibration.run_trial(VALUES, nash_sutcliffe - 1e-9)
+    assert not objective_bound.exceeded
+    np.testing.assert_allclose(flow_bounded, flow_predicted)
+    assert objective_bound.sum_squared_error == pytest.approx(sum_squared_error, rel=1e-10)
+    assert objective_bound.nash_sutcliffe_max == pytest.approx(nash_sutcliffe, rel=1e-10)
+
+    # Threshold just above the finished efficiency, the run is stopped
+    _, _, objective_bound = calibration.run_trial(VALUES, nash_sutcliffe + 1e-9)
+    assert objective_bound.exceeded
+    assert objective_bound.nash_sutcliffe_max >= nash_sutcliffe - 1e-9
+
+    # Threshold far above, the run is stopped before the last day
+    _, _, objective_bound = calibration.run_trial(VALUES, 0.99)
+    assert objective_bound.exceeded
+    assert objective_bound.sum_squared_error < sum_squared_error
+    assert objective_bound.nash_sutcliffe_max >= nash_sutcliffe
+
+
+def test_evaluate_trial_aborted_is_inf(make_configfile, boundsfile):
+    calibration.initialize_worker(make_configfile(), boundsfile, "nash_sutcliffe")
+
+    value, aborted = calibration.evaluate_trial(VALUES)
+    assert not aborted
+    assert np.isfinite(value)
+    value_bounded, aborted = calibration.evaluate_trial(VALUES, -value - 1e-9)
+    assert not aborted
+    assert value_bounded == pytest.approx(value)
+    assert calibration.evaluate_trial(VALUES, -value + 1e-9) == (np.inf, True)
+
+
+def test_calibrate_same_with_early_termination(make_configfile, boundsfile):
+    configfile = make_configfile(num_days=400)
+    options = dict(population_size=5, max_generations=6, seed=4)
+
+    result = calibration.calibrate(configfile, boundsfile, early_termination=False, **options)
+    result_early = calibration.calibrate(configfile, boundsfile, **options)
+
+    assert result["num_aborted"] == 0
+    assert result_early["num_aborted"] > 0
+    assert result_early["parameters"] == result["parameters"]
+    assert result_early["objective_value"] == result["objective_value"]
+    assert result_early["num_trials"] == result["num_trials"]
+
+
+def test_calibrate_without_solver_runs_every_trial(make_configfile, boundsfile, monkeypatch):
+    configfile = make_configfile(num_days=400)
+    options = dict(population_size=5, max_generations=3, seed=4)
+    result = calibration.calibrate(configfile, boundsfile, early_termination=False, **options)
+
+    monkeypatch.setattr(calibration, "DifferentialEvolutionSolver", None)
+    with pytest.warns(UserWarning, match="Early termination"):
+        result_fallback = calibration.calibrate(configfile, boundsfile, **options)
+
+    assert result_fallback["num_aborted"] == 0
+    assert result_fallback["parameters"] == result["parameters"]
+    assert result_fallback["num_trials"] == result["num_trials"]
+
+
+def test_trial_map_without_population_energies(make_configfile, boundsfile):
+    calibration.initialize_worker(make_configfile(), boundsfile, "nash_sutcliffe")
+    trials = calibration.TrialMap(map, early_termination=True)
+    trials.solver = object()
+
+    values = trials(calibration.evaluate, [VALUES, VALUES])
+
+    assert trials.num_aborted == 0
+    np.testing.assert_array_equal(values, [calibration.evaluate(VALUES)] * 2)
+
+
+def test_read_sample_bounds():
+    data_dir = Path(__file__).resolve().parent.parent / "data" / "inputs"
+    parameters = {
+        "basin": parametersfile.read(str(data_dir / "parameters_basin.csv")),
+        "land_type": parametersfile.read(str(data_dir / "parameters_forest.csv")),
+    }
+
+    bounds = calibration.read_bounds(str(data_dir / "calibration_bounds.csv"), parameters)
+
+    assert bounds == {
+        "rooting_depth_factor": ("land_type", 0.1, 1.0),
+        "saturated_hydraulic_conductivity": ("basin", 50.0, 5000.0),
+    }
@@ -0,0 +1,185 @@
+import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from waterpy import hydrocalcs
+
+
+INPUT_DIR = Path(__file__).resolve().parent.parent / "example" / "input"
+
+
+def pet_hamon_loop(dates, temperatures, latitude, calib_coeff=1.2):
+    """Potential evapotranspiration of each date in turn, the original
+    implementation of hydrocalcs.pet_hamon."""
+    DEG2RAD = np.pi/180
+    RAD2DEG = 180/np.pi
+
+    pet = []
+    for date, temperature in zip(dates, temperatures):
+        day_num = date.timetuple().tm_yday
+        angle = 360 * ((284 + day_num) / 365) * DEG2RAD
+        declination = (23.45 * DEG2RAD) * np.sin(angle)
+        sunset_hour_angle = (
+            np.arccos(-1 * np.tan(declination) * np.tan(latitude * DEG2RAD))
+            * RAD2DEG
+        )
+        daytime_length = abs((sunset_hour_angle / 15) * 2) / 12
+        saturated_vapor_pressure = (
+            6.108 * np.exp((17.26939 * temperature) / (temperature + 237.3))
+        )
+        saturated_vapor_density = (
+            (216.7 * saturated_vapor_pressure) / (temperature + 273.3)
+        )
+        if temperature <= 0:
+            pet.append(0)
+        else:
+            pet.append(0.1651 * daytime_length * saturated_vapor_density * calib_coeff)
+
+    return np.array(pet)
+
+
+def flow_duration_rankdata(values):
+    """Exceedance probabilities of one series with scipy.stats.rankdata, the
+    original implementation of hydrocalcs.flow_duration."""
+    values_sorted = np.sort(values)
+    ranks = stats.rankdata(values_sorted, method="average")[::-1]
+    probabilities = ranks / (len(values_sorted) + 1) * 100
+
+    return probabilities, values_sorted
+
+
+@pytest.fixture
+def flows():
+    """Flows of several series with many tied values."""
+    rng = np.random.default_rng(2)
+
+    return np.round(rng.gamma(0.8, 2.0, (4, 365)), 1)
+
+
+def test_flow_duration_matches_rankdata(flows):
+    probabilities, values_sorted = hydrocalcs.flow_duration(flows[0])
+    expected_probabilities, expected_sorted = flow_duration_rankdata(flows[0])
+
+    assert len(np.unique(flows[0])) < len(flows[0])
+    np.testing.assert_array_equal(values_sorted, expected_sorted)
+    np.testing.assert_allclose(probabilities, expected_probabilities, rtol=1e-12)
+
+
+def test_flow_duration_matrix(flows):
+    probabilities, values_sorted = hydrocalcs.flow_duration(flows)
+
+    assert probabilities.shape == flows.shape
+    for row, (row_probabilities, row_sorted) in enumerate(zip(probabilities, values_sorted)):
+        expected_probabilities, expected_sorted = flow_duration_rankdata(flows[row])
+        np.testing.assert_array_equal(row_sorted, expected_sorted)
+        np.testing.assert_allclose(row_probabilities, expected_probabilities, rtol=1e-12)
+
+
+@pytest.mark.parametrize("values", [
+    np.full(5, 1.5),
+    np.array([3.0, 1.0, 2.0]),
+    np.array([0.0, 0.0, 1.0, 1.0, 1.0, 2.0]),
+])
+def test_flow_duration_edge_cases(values):
+    probabilities, values_sorted = hydrocalcs.flow_duration(values)
+    expected_probabilities, expected_sorted = flow_duration_rankdata(values)
+
+    np.testing.assert_array_equal(values_sorted, expected_sorted)
+    np.testing.assert_allclose(probabilities, expected_probabilities, rtol=1e-12)
+
+
+def test_flow_duration_quantiles(flows):
+    probabilities = np.array([1, 10, 50, 90, 99])
+    result = hydrocalcs.flow_duration_quantiles(flows, probabilities)
+
+    assert result.shape == (len(flows), len(probabilities))
+    np.testing.assert_allclose(
+        result[1], np.quantile(flows[1], 1 - probabilities / 100)
+    )
+
+
+def test_rain_pattern_columns_match_create_rain_array(tmp_path):
+    rng = np.random.default_rng(6)
+    fractions = rng.random((24, 4))
+    rain_file = tmp_path / "rain_distribution.csv"
+    np.savetxt(rain_file, fractions / fractions.sum(axis=0), delimiter=",",
+               header="a,b,c,d", comments="")
+    precip = np.ones(30)
+
+    columns = hydrocalcs.rain_pattern_columns(str(rain_file), precip, seed=3)
+    rain_array = hydrocalcs.create_rain_array(str(rain_file), precip, seed=3)
+
+    assert columns.shape == (31,)
+    np.testing.assert_array_equal(
+        hydrocalcs.read_rain_distribution(str(rain_file))[columns].ravel(), rain_array
+    )
+
+
+@pytest.fixture
+def weather():
+    """Dates over a leap year and temperatures, in degrees Celsius, of the
+    example basin."""
+    timeseries = pd.read_csv(INPUT_DIR / "timeseries_litmill.csv", nrows=1100)
+    dates = np.array([
+        datetime.datetime.strptime(date, "%m/%d/%Y") for date in timeseries.iloc[:, 0]
+    ])
+    temperatures = timeseries.iloc[:, 1].to_numpy(dtype=float)
+    precipitation = timeseries.iloc[:, 2].to_numpy(dtype=float)
+
+    return dates, temperatures, precipitation
+
+
+@pytest.mark.parametrize("latitude", [36.1, np.float64(36.1), np.array(36.1), -12.5])
+def test_pet_hamon_matches_loop(weather, latitude):
+    dates, temperatures, _ = weather
+    expected = pet_hamon_loop(dates, temperatures, float(latitude), calib_coeff=1.1)
+
+    assert np.any(temperatures <= 0)
+    assert any(date.month == 2 and date.day == 29 for date in dates)
+    np.testing.assert_allclose(
+        hydrocalcs.pet_hamon(dates, temperatures, latitude, calib_coeff=1.1), expected, rtol=1e-12
+    )
+
+
+def test_snowmelt_batch_matches_snowmelt(weather):
+    _, temperatures, precipitation = weather
+    # Temperatures in degrees Fahrenheit, with snowpacks building and melting
+    temperatures_fahrenheit = temperatures * 9 / 5 + 32
+    coefficients = {
+        "temperature_cutoff": np.array([32.0, 34.0, 30.0]),
+        "snowmelt_rate_coeff_with_rain": np.array([0.007, 0.01, 0.005]),
+        "snowmelt_rate_coeff": np.array([0.04, 0.06, 0.02]),
+    }
+
+    result = hydrocalcs.snowmelt_batch(
+        precipitation, temperatures_fahrenheit, timestep_daily_fraction=1.0, **coefficients
+    )
+
+    for member in range(3):
+        expected = hydrocalcs.snowmelt(
+            precipitation, temperatures_fahrenheit, timestep_daily_fraction=1.0,
+            **{name: values[member] for name, values in coefficients.items()}
+        )
+        assert np.any(expected[2] > 0)
+        for values, expected_values in zip(result, expected):
+            np.testing.assert_allclose(values[member], expected_values, rtol=1e-12, atol=1e-12)
+
+
+def test_seed_sequences_reproducible_and_distinct():
+    seeds = hydrocalcs.seed_sequences(10, 3)
+    draws = [np.random.default_rng(seed).random(5) for seed in seeds]
+
+    # Child k does not depend on the number of seeds spawned, and a seed
+    # creates the same stream every time it is used
+    for seed, more_seed, values in zip(seeds, hydrocalcs.seed_sequences(10, 5), draws):
+        np.testing.assert_array_equal(np.random.default_rng(more_seed).random(5), values)
+        np.testing.assert_array_equal(np.random.default_rng(seed).random(5), values)
+    assert len({tuple(values) for values in draws}) == 3
+    assert not np.array_equal(np.random.default_rng(10).random(5), draws[0])
+    assert not np.array_equal(
+        np.random.default_rng(hydrocalcs.seed_sequences(11, 1)[0]).random(5), draws[0]
+    )
@@ -0,0 +1,134 @@
+import math
+
+import numpy as np
+import pytest
+
+from waterpy import infiltration
+from waterpy import kernel
+
+
+# Arguments of the series in the infiltration solver, cd * m and f * m
+VALUES = np.geomspace(1e-4, 20, 500)
+
+
+def series_loop(x):
+    """The series of the original infiltration solver, summed term by term."""
+    total = 0
+    fact = 1
+    for j in range(1, 11):
+        fact = fact * j
+        total += math.pow(x, j) / (j * fact)
+
+    return total
+
+
+@pytest.mark.parametrize("x", VALUES[::25].tolist() + [20.0])
+def test_exponential_series_scalar(x):
+    assert infiltration.exponential_series(x) == pytest.approx(series_loop(x), rel=1e-12)
+
+
+def test_exponential_series_array():
+    expected = np.array([series_loop(x) for x in VALUES])
+
+    np.testing.assert_allclose(infiltration.exponential_series(VALUES), expected, rtol=1e-12)
+
+
+def test_exponential_series_kernel():
+    expected = np.array([series_loop(x) for x in VALUES])
+    result = np.array([kernel.exponential_series(x) for x in VALUES])
+
+    np.testing.assert_allclose(result, expected, rtol=1e-12)
+
+
+# Hydraulic conductivity zones and parameters of the example basin
+K_DIST = np.geomspace(9.58578363e-06, 927.92153, 9)
+AK_ZONES = np.array([2.33e-4, 5.978e-3, 6.0597e-2, 0.24173, 0.382924, 0.24173,
+                     6.0597e-2, 5.978e-3, 2.33e-4])
+CAPILLARY_DRIVE = 0.036
+SCALING_FACTOR = 9.124666449756921
+
+
+def solve(time, ppt, solver=infiltration.infiltration_zones):
+    statics = infiltration.InfiltrationState((len(K_DIST),))
+    zone_infiltration = solver(time, 1, ppt, K_DIST, AK_ZONES, CAPILLARY_DRIVE,
+                               SCALING_FACTOR, statics)
+
+    return zone_infiltration, statics
+
+
+@pytest.mark.parametrize("tolerance", [1e-5, 5e-5, 1e-4])
+def test_cache_within_tolerance_of_solver(tolerance):
+    cache = infiltration.InfiltrationCache(maxsize=10000, tolerance=tolerance)
+    ppts = np.linspace(1e-6, 0.05, 2001)
+
+    for time, ppt in enumerate(np.concatenate((ppts, ppts[::-1])), start=1):
+        statics = infiltration.InfiltrationState((len(K_DIST),))
+        result = cache.infiltration_zones(
+            infiltration.infiltration_zones, time, 1, ppt, K_DIST, AK_ZONES,
+            CAPILLARY_DRIVE, SCALING_FACTOR, statics
+        )
+        expected, _ = solve(time, ppt)
+
+        assert abs(result - expected) <= tolerance / 2 + 1e-15
+        assert result <= ppt
+        # Ponding times of a hit are moved to the time of the timestep
+        ponded = statics.pond != 0
+        assert np.all((statics.tp[ponded] >= time - 1) & (statics.tp[ponded] <= time))
+
+    assert cache.misses == len(np.unique(ppts // tolerance))
+    assert cache.hits == 2 * len(ppts) - cache.misses
+
+
+def test_cache_counts_and_maxsize():
+    cache = infiltration.InfiltrationCache(maxsize=2, tolerance=1e-4)
+
+    def lookup(time, ppt):
+        return cache.infiltration_zones(infiltration.infiltration_zones, time, ppt=ppt, dt=1,
+                                        k_dist=K_DIST, ak_zones=AK_ZONES, cd=CAPILLARY_DRIVE,
+                                        m=SCALING_FACTOR,
+                                        statics=infiltration.InfiltrationState((len(K_DIST),)))
+
+    lookup(1, 0.01002)
+    lookup(2, 0.01008)
+    assert (cache.hits, cache.misses) == (1, 1)
+    lookup(3, 0.01012)
+    lookup(4, 0.02022)
+    assert (cache.hits, cache.misses, len(cache)) == (1, 3, 2)
+    # The least recently used result was removed
+    lookup(5, 0.01005)
+    assert (cache.hits, cache.misses) == (1, 4)
+
+    # Timesteps of a ponding state that is not reset are not cached
+    statics = solve(1, 0.02)[1]
+    cache.infiltration_zones(infiltration.infiltration_zones, 2, 1, 0.02, K_DIST, AK_ZONES,
+                             CAPILLARY_DRIVE, SCALING_FACTOR, statics)
+    assert (cache.hits, cache.misses) == (1, 4)
+
+    cache.clear()
+    assert (cache.hits, cache.misses, len(cache)) == (0, 0, 0)
+    with pytest.raises(ValueError):
+        infiltration.InfiltrationCache(tolerance=-1e-5)
+
+
+def test_infiltration_series_kernel():
+    rng = np.random.default_rng(8)
+    precip_available = np.where(rng.random(200) < 0.4, rng.gamma(0.8, 10.0, 200), -1.0)
+    parameters = np.zeros(kernel.NUM_PARAMETERS)
+    parameters[kernel.DT] = 1
+    parameters[kernel.CAPILLARY_DRIVE] = CAPILLARY_DRIVE
+    parameters[kernel.SCALING_FACTOR] = SCALING_FACTOR
+    ponding = np.zeros((len(infiltration.FIELDS), len(K_DIST)))
+
+    result = kernel.infiltration_series(parameters, K_DIST, AK_ZONES, precip_available, 10, ponding)
+
+    statics = infiltration.InfiltrationState((len(K_DIST),))
+    for i, value in enumerate(precip_available):
+        if value <= 0:
+            statics.reset()
+            assert result[i] == 0
+        else:
+            expected = infiltration.infiltration_zones(
+                11 + i, 1, value / 1000, K_DIST, AK_ZONES, CAPILLARY_DRIVE, SCALING_FACTOR, statics
+            )
+            assert result[i] == pytest.approx(1000 * expected, rel=1e-12)
+    np.testing.assert_allclose(ponding, statics.values, rtol=1e-12)
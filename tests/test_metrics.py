@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from waterpy import hydrocalcs
+from waterpy import metrics
+
+
+EPSILON = 0.05
+
+
+@pytest.fixture
+def series():
+    """Observed series and a matrix of modeled series with NaN gaps."""
+    rng = np.random.default_rng(1)
+    observed = rng.gamma(2.0, 1.5, 200)
+    modeled = observed * rng.uniform(0.5, 1.5, (5, 1)) + rng.normal(0, 0.5, (5, 200))
+    modeled = np.abs(modeled)
+    observed[[3, 50, 51]] = np.nan
+    modeled[0, 10:20] = np.nan
+    modeled[2, [0, 199]] = np.nan
+    modeled[4, ::7] = np.nan
+
+    return observed, modeled
+
+
+def per_pair(observed, modeled):
+    """Metrics of one member from the hydrocalcs functions of one pair of
+    series, without the missing timesteps."""
+    valid = np.isfinite(observed) & np.isfinite(modeled)
+    o = observed[valid]
+    m = modeled[valid]
+    r = np.corrcoef(o, m)[0, 1]
+
+    return {
+        "nash_sutcliffe": hydrocalcs.nash_sutcliffe(o, m),
+        "log_nash_sutcliffe": hydrocalcs.nash_sutcliffe(np.log(o + EPSILON), np.log(m + EPSILON)),
+        "kling_gupta": 1 - np.sqrt(
+            (r - 1)**2 + (np.std(m) / np.std(o) - 1)**2 + (np.mean(m) / np.mean(o) - 1)**2
+        ),
+        "percent_bias": 100 * np.sum(hydrocalcs.absolute_error(o, m)) / np.sum(o),
+        "root_mean_squared_error": np.sqrt(hydrocalcs.mean_squared_error(o, m)),
+        "correlation": r,
+    }
+
+
+def test_goodness_of_fit_matches_per_pair(series):
+    observed, modeled = series
+    result = metrics.goodness_of_fit(observed, modeled, epsilon=EPSILON)
+
+    for i, row in enumerate(modeled):
+        expected = per_pair(observed, row)
+        for name in metrics.METRICS:
+            assert result[name][i] == pytest.approx(expected[name], rel=1e-10), name
+        assert result["correlation"][i]**2 == pytest.approx(
+            hydrocalcs.r_squared(observed[np.isfinite(observed) & np.isfinite(row)],
+                                 row[np.isfinite(observed) & np.isfinite(row)]),
+            rel=1e-10,
+        )
+
+
+def test_goodness_of_fit_single_series(series):
+    observed, modeled = series
+    result = metrics.goodness_of_fit(observed, modeled[1])
+
+    assert result["nash_sutcliffe"].shape == (1,)
+    assert result["nash_sutcliffe"][0] == pytest.approx(
+        metrics.goodness_of_fit(observed, modeled)["nash_sutcliffe"][1]
+    )
+
+
+def test_goodness_of_fit_no_observed_variance():
+    observed = np.full(10, 2.0)
+    modeled = np.vstack((np.linspace(1, 3, 10), np.full(10, 2.0)))
+    result = metrics.goodness_of_fit(observed, modeled)
+
+    for name in ("nash_sutcliffe", "log_nash_sutcliffe", "kling_gupta", "correlation"):
+        assert np.isnan(result[name]).all(), name
+    assert np.isfinite(result["percent_bias"]).all()
+    assert np.isfinite(result["root_mean_squared_error"]).all()
+
+
+def test_goodness_of_fit_no_modeled_variance(series):
+    observed, _ = series
+    modeled = np.full_like(observed, 3.0)
+    result = metrics.goodness_of_fit(observed, modeled)
+
+    assert np.isnan(result["kling_gupta"][0])
+    assert np.isnan(result["correlation"][0])
+    assert np.isfinite(result["nash_sutcliffe"][0])
+
+
+def test_goodness_of_fit_too_few_values(series):
+    observed, modeled = series
+    modeled[3, 1:] = np.nan
+    result = metrics.goodness_of_fit(observed, modeled)
+
+    for name in metrics.METRICS:
+        assert np.isnan(result[name][3]), name
+        assert np.isfinite(result[name][[0, 1, 2, 4]]).all(), name
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from waterpy.sketch import QuantileSketch
+
+
+# The number of values is prime, so that quantile * number of values is
+# never a whole number and the sketch estimates the same order statistic as
+# numpy.quantile with the inverted_cdf method
+NUM_VALUES = 997
+QUANTILES = np.array([0.0, 0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99, 1.0])
+
+
+@pytest.fixture
+def flows():
+    """Flows of three series, with some zero flows and a gap."""
+    rng = np.random.default_rng(3)
+    values = rng.lognormal(0.0, 2.0, (3, NUM_VALUES))
+    values[1, :20] = 0.0
+
+    return values
+
+
+def assert_within_accuracy(sketch, values):
+    expected = np.quantile(values, QUANTILES, axis=-1, method="inverted_cdf").T
+    result = sketch.quantiles(QUANTILES)
+
+    np.testing.assert_array_less(
+        np.abs(result - expected), sketch.relative_accuracy * expected + 1e-12
+    )
+
+
+@pytest.mark.parametrize("relative_accuracy", [0.01, 0.05])
+def test_quantiles_within_relative_accuracy(flows, relative_accuracy):
+    sketch = QuantileSketch(num_series=3, relative_accuracy=relative_accuracy)
+    sketch.update(flows)
+
+    assert_within_accuracy(sketch, flows)
+
+
+def test_quantiles_single_series(flows):
+    sketch = QuantileSketch()
+    sketch.update(flows[0])
+
+    assert sketch.quantiles(QUANTILES).shape == (1, len(QUANTILES))
+    assert_within_accuracy(sketch, flows[:1])
+
+
+def test_quantiles_unchanged_after_merge(flows):
+    sketch = QuantileSketch(num_series=3)
+    sketch.update(flows)
+
+    merged = QuantileSketch(num_series=3)
+    for chunk in np.array_split(flows, 7, axis=1):
+        chunk_sketch = QuantileSketch(num_series=3)
+        chunk_sketch.update(chunk)
+        merged.merge(chunk_sketch)
+
+    np.testing.assert_array_equal(merged.counts, sketch.counts)
+    np.testing.assert_array_equal(merged.quantiles(QUANTILES), sketch.quantiles(QUANTILES))
+    np.testing.assert_array_equal(
+        merged.flow_duration([1, 50, 99]), sketch.flow_duration([1, 50, 99])
+    )
+
+
+def test_merge_different_buckets():
+    with pytest.raises(ValueError):
+        QuantileSketch(relative_accuracy=0.01).merge(QuantileSketch(relative_accuracy=0.02))
+
+
+def test_nan_values_not_counted(flows):
+    sketch = QuantileSketch()
+    values = flows[0].copy()
+    values[::10] = np.nan
+    sketch.update(values)
+
+    assert sketch.count[0] == np.isfinite(values).sum()
+    expected = np.quantile(values[np.isfinite(values)], 0.5, method="inverted_cdf")
+    assert abs(sketch.quantiles(0.5)[0, 0] - expected) <= sketch.relative_accuracy * expected
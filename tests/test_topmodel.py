@@ -0,0 +1,180 @@
+import numpy as np
+import pytest
+
+from waterpy import kernel
+from waterpy import main
+from waterpy import modelconfigfile
+from waterpy import statefile
+from waterpy.ensemble import TopmodelEnsemble
+from waterpy.topmodel import SERIES, Topmodel
+
+
+MODES = {
+    "daily": {},
+    "hourly": {"option_randomize_daily_to_hourly": True},
+    "hourly_streaming": {"option_randomize_daily_to_hourly": True, "option_hourly_streaming": True},
+}
+
+# Output series compared between runs
+OUTPUTS = sorted(set(SERIES.values()) - {"precip_for_evaporation"})
+
+
+def get_arguments(configfile):
+    """Topmodel arguments of a model config file, without recorded matrices."""
+    config_data = modelconfigfile.read(configfile)
+    parameters, timeseries, twi, _ = main.read_input_files(config_data)
+    preprocessed_data = main.preprocess(config_data, parameters, timeseries, twi)
+    arguments = main.get_topmodel_arguments(
+        config_data, parameters, timeseries, twi, preprocessed_data
+    )
+    arguments["record"] = {}
+
+    return arguments
+
+
+def assert_outputs_close(topmodel, expected, rtol=1e-9, atol=1e-12):
+    for name in OUTPUTS:
+        np.testing.assert_allclose(
+            getattr(topmodel, name), getattr(expected, name), rtol=rtol, atol=atol, err_msg=name
+        )
+
+
+@pytest.fixture
+def arguments(make_configfile):
+    """Topmodel arguments without the infiltration cache, which is not used
+    by the jit engine."""
+    return dict(get_arguments(make_configfile(num_days=400)), infiltration_cache_size=0)
+
+
+@pytest.mark.parametrize("mode", sorted(MODES))
+@pytest.mark.parametrize("engine", ["vectorized", "jit"])
+def test_engines_match_python(arguments, monkeypatch, engine, mode):
+    # Without Numba, the jit engine runs the kernel functions uncompiled
+    monkeypatch.setattr(kernel, "NUMBA_AVAILABLE", True)
+    expected = Topmodel(**dict(arguments, engine="python", **MODES[mode]))
+    expected.run()
+    topmodel = Topmodel(**dict(arguments, engine=engine, **MODES[mode]))
+    topmodel.run()
+
+    assert topmodel.engine == engine
+    assert_outputs_close(topmodel, expected)
+
+
+@pytest.mark.parametrize("engine, cache_size", [("python", 0), ("python", 256), ("jit", 0)])
+def test_restart_from_state_file_matches_continuous_run(arguments, monkeypatch, tmp_path, engine,
+                                                        cache_size):
+    monkeypatch.setattr(kernel, "NUMBA_AVAILABLE", True)
+    arguments = dict(arguments, engine=engine, infiltration_cache_size=cache_size)
+    forcing = ("precip_available", "precip", "temperatures", "pet_hamon")
+    split = 250
+
+    continuous = Topmodel(**arguments)
+    continuous.run()
+
+    first = Topmodel(**dict(arguments, **{name: np.asarray(arguments[name])[:split] for name in forcing}))
+    first.run()
+    statefile.write(tmp_path / "state.npz", first.get_state())
+
+    second = Topmodel(**dict(
+        arguments,
+        initial_state=statefile.read(tmp_path / "state.npz"),
+        **{name: np.asarray(arguments[name])[split:] for name in forcing}
+    ))
+    second.run()
+
+    for name in OUTPUTS:
+        np.testing.assert_allclose(
+            np.concatenate((getattr(first, name), getattr(second, name))),
+            getattr(continuous, name), rtol=1e-12, atol=1e-12, err_msg=name,
+        )
+
+
+@pytest.mark.parametrize("mode", ["daily", "hourly"])
+def test_ensemble_members_match_single_runs(arguments, mode):
+    member_values = {
+        "rooting_depth_factor": np.array([0.15, 0.25, 0.4]),
+        "saturated_hydraulic_conductivity": np.array([800.0, 2263.5, 4000.0]),
+    }
+    ensemble_arguments = dict(arguments, **MODES[mode], **member_values)
+    for name in ("engine", "record", "initial_state", "option_spin_up",
+                 "spin_up_tolerance", "spin_up_max_cycles", "option_hourly_streaming"):
+        ensemble_arguments.pop(name, None)
+    ensemble = TopmodelEnsemble(**ensemble_arguments)
+    ensemble.run()
+
+    for member in range(3):
+        topmodel = Topmodel(**dict(
+            arguments, **MODES[mode],
+            **{name: values[member] for name, values in member_values.items()}
+        ))
+        topmodel.run()
+        np.testing.assert_allclose(ensemble.flow_predicted[member], topmodel.flow_predicted, rtol=1e-9)
+        np.testing.assert_allclose(
+            ensemble.saturation_deficit_avgs[member], topmodel.saturation_deficit_avgs, rtol=1e-9
+        )
+
+
+@pytest.mark.parametrize("engine", ["python", "vectorized"])
+def test_steps_match_run(arguments, engine):
+    expected = Topmodel(**dict(arguments, engine=engine))
+    expected.run()
+
+    topmodel = Topmodel(**dict(arguments, engine=engine))
+    fluxes = list(topmodel.steps(
+        arguments["precip_available"], arguments["temperatures"],
+        arguments["pet_hamon"], arguments["precip"],
+    ))
+
+    for name, attribute in SERIES.items():
+        np.testing.assert_allclose(
+            [values[name] for values in fluxes], getattr(expected, attribute),
+            rtol=1e-12, atol=1e-12, err_msg=name,
+        )
+    np.testing.assert_allclose(topmodel.get_state()["root_zone_storage"], expected.root_zone_storage)
+    assert topmodel.current_timestep == expected.current_timestep
+
+
+def test_streaming_rain_distribution_matches_hourly(arguments, rain_file):
+    arguments = dict(arguments, option_distribution=True, rain_file=rain_file, seed=7)
+    expected = Topmodel(**dict(arguments, **MODES["hourly"]))
+    expected.run()
+    topmodel = Topmodel(**dict(arguments, **MODES["hourly_streaming"]))
+
+    assert topmodel.rain_array is None
+    assert len(topmodel.rain_columns) == len(arguments["precip"]) + 1
+    topmodel.run()
+    assert_outputs_close(topmodel, expected)
+
+
+def test_infiltration_cache_close_to_solver(arguments):
+    expected = Topmodel(**arguments)
+    expected.run()
+    topmodel = Topmodel(**dict(arguments, infiltration_cache_size=256, infiltration_cache_tolerance=0.01))
+    topmodel.run()
+
+    assert expected.infiltration_cache.hits == 0
+    assert topmodel.infiltration_cache.hits > 0
+    np.testing.assert_allclose(topmodel.flow_predicted, expected.flow_predicted, rtol=0.1, atol=1e-3)
+    assert topmodel.flow_predicted.sum() == pytest.approx(expected.flow_predicted.sum(), rel=1e-3)
+
+
+def test_realizations_have_reproducible_distinct_rain(make_configfile, rain_file):
+    configfile = make_configfile(
+        num_days=60, option_randomize_daily_to_hourly="yes",
+        option_distribution_record="yes", option_dist_file=rain_file,
+    )
+    config_data = modelconfigfile.read(configfile)
+    parameters, timeseries, twi, _ = main.read_input_files(config_data)
+    preprocessed_data = main.preprocess(config_data, parameters, timeseries, twi)
+
+    def rain_array(realization):
+        arguments = main.get_topmodel_arguments(
+            config_data, parameters, timeseries, twi, preprocessed_data, realization=realization
+        )
+        return Topmodel(**dict(arguments, record={})).rain_array
+
+    rain_arrays = [rain_array(realization) for realization in (None, 0, 1, 2)]
+    np.testing.assert_array_equal(rain_array(1), rain_arrays[2])
+    for k, values in enumerate(rain_arrays):
+        for other in rain_arrays[k + 1:]:
+            assert not np.array_equal(values, other)
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+from waterpy import uncertainty
+
+
+def test_uncertainty_bands(make_configfile, boundsfile, tmp_path):
+    behavioral_filename = tmp_path / "behavioral.csv"
+    uncertainty_data = uncertainty.uncertainty(
+        make_configfile(), boundsfile, num_samples=6, threshold=-100.0,
+        batch_size=4, seed=3, behavioral_filename=str(behavioral_filename),
+    )
+
+    assert uncertainty_data["num_behavioral"] == 6
+    bands = uncertainty_data["bands"]
+    assert bands.shape == (3, len(uncertainty_data["dates"]))
+    assert np.all(bands[0] <= bands[1]) and np.all(bands[1] <= bands[2])
+    behavioral = pd.read_csv(behavioral_filename)
+    assert len(behavioral) == 6
+    assert behavioral["realization"].isna().all()
+
+
+def test_uncertainty_realizations(make_configfile, boundsfile, rain_file, tmp_path):
+    configfile = make_configfile(
+        num_days=400, option_randomize_daily_to_hourly="yes",
+        option_distribution_record="yes", option_dist_file=rain_file,
+    )
+    behavioral_filename = tmp_path / "behavioral.csv"
+    options = dict(num_samples=3, threshold=-100.0, seed=3, num_realizations=2)
+
+    uncertainty_data = uncertainty.uncertainty(
+        configfile, boundsfile, behavioral_filename=str(behavioral_filename), **options
+    )
+    repeated = uncertainty.uncertainty(configfile, boundsfile, **options)
+
+    np.testing.assert_array_equal(repeated["bands"], uncertainty_data["bands"])
+    behavioral = pd.read_csv(behavioral_filename)
+    assert behavioral["realization"].tolist() == [0, 1, 0]
+
+
+def test_latin_hypercube_one_value_per_interval():
+    samples = uncertainty.latin_hypercube(np.random.default_rng(1), 10, 3)
+
+    for column in samples.T:
+        np.testing.assert_array_equal(np.sort(np.floor(column * 10)), np.arange(10))
@@ -0,0 +1,422 @@
+"""Calibration of the basin characteristics and land type parameters.
+
+The parameters listed in a calibration bounds file (*.csv) with the columns
+name, minimum and maximum are calibrated against the observed flow of the
+timeseries file with differential evolution, a population based global
+optimizer, see scipy.optimize.differential_evolution. The objective is one
+of the efficiencies of metrics.goodness_of_fit, by default the
+Nash-Sutcliffe efficiency, same as hydrocalcs.nash_sutcliffe.
+
+Each process of the pool reads the input files and preprocesses the
+forcing once, and only runs Topmodel for each trial parameter set, so the
+number of trials is limited by the model run instead of by process startup
+and reading files. Preprocessing is only repeated for trials of parameters
+used by main.preprocess, see PREPROCESS_PARAMETERS.
+
+With the Nash-Sutcliffe objective, each trial of a generation after the
+first is run with a metrics.NashSutcliffeBound of the efficiency of the
+member of the population it competes with, and is stopped as soon as it
+can no longer beat it, see Topmodel.run. Such a trial would not replace
+the member, so it is given an objective value of inf, the calibration is
+the same, and the aborted trials are counted separately. Early termination
+uses the DifferentialEvolutionSolver of scipy, which is not part of its
+public interface. If it is not available, the calibration falls back to
+scipy.optimize.differential_evolution and runs every trial to the end.
+
+:authors: 2019 by Alexander Headman, Jeremiah Lant, see AUTHORS
+:license: CC0 1.0, see LICENSE file for details
+"""
+
+import csv
+import inspect
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import PurePath
+
+import numpy as np
+import scipy
+from scipy import optimize
+
+try:
+    from scipy.optimize._differentialevolution import DifferentialEvolutionSolver
+except ImportError:
+    DifferentialEvolutionSolver = None
+
+from . import main
+from . import metrics
+from . import modelconfigfile
+from .exceptions import (CalibrationBoundsFileErrorInvalidParameter,
+                         CalibrationBoundsFileErrorInvalidBounds)
+from .topmodel import Topmodel
+
+
+OBJECTIVES = ("nash_sutcliffe", "log_nash_sutcliffe", "kling_gupta")
+
+# Parameters used by main.preprocess, trials of these are preprocessed again
+PREPROCESS_PARAMETERS = (
+    "scaling_parameter",
+    "spatial_coeff",
+    "twi_adj",
+    "latitude",
+    "pet_calib_coeff",
+    "snowmelt_temperature_cutoff",
+    "snowmelt_rate_coeff_with_rain",
+    "snowmelt_rate_coeff",
+    "basin_area_total",
+)
+
+# Keyword of the seed of the optimizer, renamed rng in newer scipy versions
+_SEED_KEYWORD = (
+    "rng" if "rng" in inspect.signature(optimize.differential_evolution).parameters else "seed"
+)
+
+# Inputs of the calibration process, set once per process by
+# initialize_worker
+_worker = {}
+
+
+def calibrate(configfile,
+              boundsfile,
+              objective="nash_sutcliffe",
+              population_size=15,
+              max_generations=100,
+              workers=1,
+              seed=None,
+              early_termination=True,
+              realization=None):
+    """Calibrate the parameters of the bounds file.
+
+    :param configfile: The file path to the model config file
+    :type configfile: string
+    :param boundsfile: The file path to the calibration bounds file
+    :type boundsfile: string
+    :param objective: Efficiency maximized, see OBJECTIVES
+    :type objective: string
+    :param population_size: Number of trials of each generation per
+                            calibrated parameter
+    :type population_size: int
+    :param max_generations: Maximum number of generations
+    :type max_generations: int
+    :param workers: Number of processes running trials in parallel
+    :type workers: int
+    :param seed: Seed of the optimizer, by default the random_seed option
+    :type seed: int
+    :param early_termination: Stop trials that can not replace their
+                              member of the population, only used with the
+                              nash_sutcliffe objective
+    :type early_termination: bool
+    :param realization: Realization of the rain distribution of every trial,
+                        see main.get_topmodel_arguments
+    :type realization: int
+    :return calibration_data: A dict of the calibrated parameters, bounds,
+                              objective value and number of trials
+    :rtype: dict
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(
+            "Incorrect objective: {}\n"
+            "Objective must be one of: {}".format(objective, ", ".join(OBJECTIVES))
+        )
+
+    inputs = initialize_worker(configfile, boundsfile, objective, realization)
+    bounds = inputs["bounds"]
+    config_data = inputs["config_data"]
+    if seed is None:
+        seed = config_data["Options"].getint("random_seed", fallback=10)
+
+    options = dict(
+        bounds=[(minimum, maximum) for _, minimum, maximum in bounds.values()],
+        popsize=population_size,
+        maxiter=max_generations,
+        **{_SEED_KEYWORD: np.random.default_rng(seed)},
+        polish=False,
+        updating="deferred",
+    )
+    early_termination = early_termination and objective == "nash_sutcliffe"
+    if early_termination and not _solver_available():
+        warnings.warn(
+            "Early termination of trials is not supported with scipy {}, "
+            "every trial is run to the end.".format(scipy.__version__)
+        )
+        early_termination = False
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=initialize_worker,
+                                 initargs=(configfile, boundsfile, objective, realization)) as pool:
+            trials = TrialMap(pool.map, early_termination=early_termination)
+            result = _solve(trials, options)
+    else:
+        trials = TrialMap(map, early_termination=early_termination)
+        result = _solve(trials, options)
+
+    calibration_data = {
+        "parameters": dict(zip(bounds, result.x)),
+        "bounds": {name: (minimum, maximum) for name, (_, minimum, maximum) in bounds.items()},
+        "objective": objective,
+        "objective_value": -result.fun,
+        "num_trials": result.nfev,
+        "num_aborted": trials.num_aborted,
+        "num_generations": result.nit,
+    }
+
+    return calibration_data
+
+
+def read_bounds(filepath, parameters):
+    """Read the calibration bounds file.
+
+    :param filepath: File path of the bounds file.
+    :type filepath: string
+    :param parameters: The parameters for the model.
+    :type parameters: dict
+    :return bounds: A dict of parameter names to a tuple of the parameters
+                    group (basin or land_type), minimum and maximum
+    :rtype: dict
+    """
+    bounds = {}
+    with open(filepath) as f:
+        for row in csv.DictReader(f):
+            name = row["name"].lower().strip()
+            minimum = float(row["minimum"])
+            maximum = float(row["maximum"])
+            groups = [group for group in ("basin", "land_type") if name in parameters[group]]
+            if not groups:
+                raise CalibrationBoundsFileErrorInvalidParameter(name)
+            if not minimum < maximum:
+                raise CalibrationBoundsFileErrorInvalidBounds(name, minimum, maximum)
+            bounds[name] = (groups[0], minimum, maximum)
+
+    return bounds
+
+
+def write_calibration_csv(calibration_data, filename):
+    """Write the calibrated parameters and their bounds to a csv file.
+
+    :param calibration_data: A dict of calibration results from calibrate
+    :type calibration_data: dict
+    :param filename: The file path of the csv file
+    :type filename: string
+    """
+    with open(filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "value", "minimum", "maximum"])
+        for name, value in calibration_data["parameters"].items():
+            writer.writerow([name, value, *calibration_data["bounds"][name]])
+        writer.writerow([calibration_data["objective"], calibration_data["objective_value"], "", ""])
+
+
+class TrialMap:
+    """Class that represents the map of the trials of each generation of
+    the optimizer, see the workers keyword of
+    scipy.optimize.differential_evolution.
+
+    With early_termination, each trial is run with the efficiency of the
+    member of the population it competes with as threshold, see
+    evaluate_trial. With deferred updating, trial i of a generation
+    replaces member i of the population_energies of the solver if its
+    objective value is not greater, so the threshold is read from the
+    solver before the generation. The trials are run with evaluate_trial
+    instead of the function given by the optimizer, evaluate, which gives
+    the same values.
+    """
+    def __init__(self, mapper, early_termination=False):
+        self.mapper = mapper
+        self.early_termination = early_termination
+        self.solver = None
+        self.num_aborted = 0
+
+    def __call__(self, func, trials):
+        trials = list(trials)
+        thresholds = [None] * len(trials)
+        energies = getattr(self.solver, "population_energies", None)
+        if self.early_termination and energies is not None:
+            # Just below the efficiency of the member, so that a trial
+            # which would tie the member and replace it is not stopped.
+            # The energies of the initial population are inf until the
+            # first call returns.
+            energies = energies[:len(trials)]
+            thresholds = [
+                np.nextafter(-energy, -np.inf) if np.isfinite(energy) else None
+                for energy in energies
+            ]
+
+        results = list(self.mapper(evaluate_trial, trials, thresholds))
+        self.num_aborted += sum(aborted for _, aborted in results)
+
+        return np.array([value for value, _ in results])
+
+
+def evaluate(values):
+    """Run Topmodel with a trial parameter set and return the negative
+    objective, minimized by the optimizer. Runs in a process initialized
+    with initialize_worker.
+
+    :param values: Values of the calibrated parameters, in the order of the
+                   bounds file
+    :type values: numpy.ndarray
+    :return: Negative objective value, inf if it can not be calculated
+    :rtype: float
+    """
+    return evaluate_trial(values)[0]
+
+
+def evaluate_trial(values, threshold=None):
+    """Run Topmodel with a trial parameter set and return the negative
+    objective, stopping the run once its Nash-Sutcliffe efficiency can not
+    exceed the threshold.
+
+    :param values: Values of the calibrated parameters, in the order of the
+                   bounds file
+    :type values: numpy.ndarray
+    :param threshold: Nash-Sutcliffe efficiency the trial must exceed, only
+                      used with the nash_sutcliffe objective
+    :type threshold: float
+    :return: Tuple of the negative objective value, inf if it can not be
+             calculated or the trial was aborted, and whether the trial was
+             aborted
+    :rtype: tuple
+    """
+    flow_predicted, observed, objective_bound = run_trial(values, threshold)
+    if objective_bound is not None and objective_bound.exceeded:
+        return np.inf, True
+
+    value = metrics.goodness_of_fit(observed, flow_predicted)[_worker["objective"]][0]
+
+    return (-value if np.isfinite(value) else np.inf), False
+
+
+def _solve(trials, options):
+    """Run differential evolution with the trials map, see
+    scipy.optimize.differential_evolution, giving the map the solver so
+    that it can read the energies of the population. Without early
+    termination, or if the solver is not available, the public
+    differential_evolution is used."""
+    if not (trials.early_termination and _solver_available()):
+        return optimize.differential_evolution(evaluate, workers=trials, **options)
+
+    with DifferentialEvolutionSolver(evaluate, workers=trials, **options) as solver:
+        trials.solver = solver
+        return solver.solve()
+
+
+def _solver_available():
+    """Return whether the DifferentialEvolutionSolver of scipy, used for
+    early termination, is available and takes the same keywords as
+    scipy.optimize.differential_evolution."""
+    if DifferentialEvolutionSolver is None:
+        return False
+    try:
+        parameters = inspect.signature(DifferentialEvolutionSolver).parameters
+    except (TypeError, ValueError):
+        return False
+
+    return all(name in parameters for name in (_SEED_KEYWORD, "workers", "updating"))
+
+
+def run_trial(values, threshold=None, realization=None):
+    """Run Topmodel with a trial parameter set without recording matrices.
+    Runs in a process initialized with initialize_worker, shared by the
+    calibration and the uncertainty module.
+
+    :param values: Values of the calibrated parameters, in the order of the
+                   bounds file
+    :type values: numpy.ndarray
+    :param threshold: Nash-Sutcliffe efficiency the run must exceed to not
+                      be stopped early, see Topmodel.run
+    :type threshold: float
+    :param realization: Realization of the rain distribution, by default
+                        the realization of initialize_worker
+    :type realization: int
+    :return: Tuple of the daily flow predicted, the observed flow of the
+             same days, and the objective bound of the run or None
+    :rtype: tuple
+    """
+    config_data = _worker["config_data"]
+    timeseries = _worker["timeseries"]
+    twi = _worker["twi"]
+    parameters = {group: dict(values_) for group, values_ in _worker["parameters"].items()}
+    for (name, (group, _, _)), value in zip(_worker["bounds"].items(), values):
+        parameters[group][name] = dict(parameters[group][name], value=float(value))
+
+    # Only preprocess again if a preprocessing parameter is calibrated
+    if _worker["preprocess"]:
+        preprocessed_data = main.preprocess(config_data, parameters, timeseries, twi)
+    else:
+        preprocessed_data = _worker["preprocessed_data"]
+
+    if realization is None:
+        realization = _worker["realization"]
+    topmodel_arguments = main.get_topmodel_arguments(
+        config_data, parameters, timeseries, twi, preprocessed_data, realization=realization
+    )
+    topmodel_arguments["record"] = {}
+    topmodel = Topmodel(**topmodel_arguments)
+
+    # Observed flow of the output days, the first year is dropped in
+    # hourly mode
+    spin_up_days = topmodel.drop_first // 24 if topmodel.option_randomize_daily_to_hourly else 0
+    observed = timeseries["flow_observed"].to_numpy()[spin_up_days:]
+
+    objective_bound = None
+    if threshold is not None and _worker["objective"] == "nash_sutcliffe":
+        objective_bound = metrics.NashSutcliffeBound(observed, threshold)
+    topmodel.run(objective_bound=objective_bound)
+
+    # Total flow with option_max_min, see main.get_output_dataframe
+    flow_predicted = topmodel.flow_predicted
+    if type(flow_predicted) == tuple:
+        flow_predicted = flow_predicted[0]
+
+    return flow_predicted, observed, objective_bound
+
+
+def initialize_worker(configfile, boundsfile, objective, realization=None):
+    """Read the input files and preprocess the forcing once per process,
+    for the trials run with run_trial. Used as the initializer of the
+    process pools of calibrate and uncertainty.uncertainty, and called in
+    the main process before trials are run there.
+
+    :param configfile: The file path to the model config file
+    :type configfile: string
+    :param boundsfile: The file path to the calibration bounds file
+    :type boundsfile: string
+    :param objective: Efficiency of the trials, see OBJECTIVES
+    :type objective: string
+    :param realization: Realization of the rain distribution of the trials,
+                        see main.get_topmodel_arguments
+    :type realization: int
+    :return inputs: A dict of the inputs of the process, the config_data,
+                    parameters, timeseries, twi, bounds, see read_bounds,
+                    objective and realization
+    :rtype: dict
+    """
+    config_data = modelconfigfile.read(configfile)
+    parameters, timeseries, twi, _ = main.read_input_files(config_data)
+    bounds = read_bounds(boundsfile, parameters)
+
+    _worker.update(
+        config_data=config_data,
+        parameters=parameters,
+        timeseries=timeseries,
+        twi=twi,
+        bounds=bounds,
+        objective=objective,
+        realization=realization,
+        preprocess=any(name in PREPROCESS_PARAMETERS for name in bounds),
+        preprocessed_data=main.preprocess(config_data, parameters, timeseries, twi),
+    )
+
+    return dict(_worker)
+
+
+def get_calibration_filename(config_data):
+    """Get the file path of the calibration output file.
+
+    :param config_data: A ConfigParser object that behaves much like a dictionary.
+    :type config_data: ConfigParser
+    :rtype: PurePath
+    """
+    return PurePath(
+        config_data["Outputs"]["output_dir"],
+        config_data["Outputs"].get("output_filename_calibration", fallback="calibration.csv"),
+    )
@@ -5,6 +5,7 @@ import click
 import sys, warnings
 import traceback
 
+from waterpy import calibration, modelconfigfile, uncertainty as glue
 from waterpy.main import waterpy
 
 
@@ -55,3 +56,118 @@ def run(options, configfile):
         click.echo("Verbose on")
     if options.show:
         click.echo("Show on")
+
+
+@main.command()
+@click.argument("configfile", type=click.Path(exists=True))
+@click.argument("boundsfile", type=click.Path(exists=True))
+@click.option("--objective", type=click.Choice(calibration.OBJECTIVES),
+              default="nash_sutcliffe", show_default=True,
+              help="Efficiency maximized.")
+@click.option("--population", default=15, show_default=True,
+              help="Trials of each generation per calibrated parameter.")
+@click.option("--generations", default=100, show_default=True,
+              help="Maximum number of generations.")
+@click.option("--workers", default=1, show_default=True,
+              help="Number of processes running trials in parallel.")
+@click.option("--seed", type=int, default=None,
+              help="Seed of the optimizer, by default the random_seed option.")
+@click.option("--realization", type=int, default=None,
+              help="Realization of the rain distribution, by default the "
+                   "random_seed option.")
+@pass_options
+def calibrate(options, configfile, boundsfile, objective, population,
+              generations, workers, seed, realization):
+    """Calibrate waterpy parameters with a model configuration file and
+    a calibration bounds file.
+
+    The calibration bounds file (*.csv) contains the name, minimum and
+    maximum of each basin characteristics or land type parameter to
+    calibrate against the observed flow. The calibrated parameters are saved
+    in the output directory of the model configuration file.
+    """
+    try:
+        click.echo("Calibrating model...")
+        calibration_data = calibration.calibrate(
+            configfile,
+            boundsfile,
+            objective=objective,
+            population_size=population,
+            max_generations=generations,
+            workers=workers,
+            seed=seed,
+            realization=realization,
+        )
+        filename = calibration.get_calibration_filename(modelconfigfile.read(configfile))
+        calibration.write_calibration_csv(calibration_data, filename)
+        click.echo("Finished!")
+        click.echo("{}: {}".format(objective, calibration_data["objective_value"]))
+        click.echo("Calibrated parameters saved as {}".format(filename))
+    except Exception as err:
+        click.echo(err, traceback.print_exc())
+        sys.exit(1)
+
+    if options.verbose:
+        click.echo("Trials: {}".format(calibration_data["num_trials"]))
+        click.echo("Aborted trials: {}".format(calibration_data["num_aborted"]))
+        click.echo("Generations: {}".format(calibration_data["num_generations"]))
+
+
+@main.command()
+@click.argument("configfile", type=click.Path(exists=True))
+@click.argument("boundsfile", type=click.Path(exists=True))
+@click.option("--samples", default=10000, show_default=True,
+              help="Number of parameter sets drawn.")
+@click.option("--threshold", default=0.5, show_default=True,
+              help="Nash-Sutcliffe efficiency of behavioral parameter sets.")
+@click.option("--batch-size", default=1000, show_default=True,
+              help="Number of parameter sets drawn at a time.")
+@click.option("--workers", default=1, show_default=True,
+              help="Number of processes running parameter sets in parallel.")
+@click.option("--seed", type=int, default=None,
+              help="Seed of the samples, by default the random_seed option.")
+@click.option("--realizations", default=1, show_default=True,
+              help="Number of realizations of the rain distribution the "
+                   "samples are spread over.")
+@pass_options
+def uncertainty(options, configfile, boundsfile, samples, threshold,
+                batch_size, workers, seed, realizations):
+    """Estimate the uncertainty of the flow predicted with a model
+    configuration file and a calibration bounds file.
+
+    Parameter sets within the bounds of the calibration bounds file (*.csv)
+    are drawn with Latin hypercube sampling, and the 5th, 50th and 95th
+    percentile bands of the flow predicted of the behavioral parameter sets
+    and the behavioral parameter sets are saved in the output directory of
+    the model configuration file.
+    """
+    try:
+        click.echo("Running uncertainty analysis...")
+        bands_filename, behavioral_filename = glue.get_uncertainty_filenames(
+            modelconfigfile.read(configfile)
+        )
+        uncertainty_data = glue.uncertainty(
+            configfile,
+            boundsfile,
+            num_samples=samples,
+            threshold=threshold,
+            batch_size=batch_size,
+            workers=workers,
+            seed=seed,
+            behavioral_filename=behavioral_filename,
+            num_realizations=realizations,
+        )
+        click.echo("Finished!")
+        click.echo("Behavioral parameter sets: {} of {}".format(
+            uncertainty_data["num_behavioral"], uncertainty_data["num_samples"]))
+        if uncertainty_data["bands"] is None:
+            click.echo("No behavioral parameter sets, no bands saved.")
+        else:
+            glue.write_uncertainty_csv(uncertainty_data, bands_filename)
+            click.echo("Percentile bands saved as {}".format(bands_filename))
+    except Exception as err:
+        click.echo(err, traceback.print_exc())
+        sys.exit(1)
+
+    if options.verbose:
+        click.echo("Aborted runs: {}".format(uncertainty_data["num_aborted"]))
@@ -0,0 +1,425 @@
+"""TopmodelEnsemble class
+Class that runs an ensemble of Topmodel parameter sets together over the same
+climate forcing, for example for calibration.
+
+Each soil, evapotranspiration and basin parameter can be given as a single
+value shared by all members or as an array with one value per member. The
+state of all members is stepped together as arrays of shape
+(num_members, num_twi_increments), using the same array calculations as the
+vectorized engine of Topmodel (see topmodel.update_twi_increments), so that
+the timestep loop runs once for the whole ensemble instead of once per
+parameter set.
+
+:authors: 2019 by Alexander Headman, Jeremiah Lant, see AUTHORS
+:license: CC0 1.0, see LICENSE file for details
+"""
+
+import math
+import numpy as np
+
+from . import hydrocalcs
+from . import infiltration
+from . import utils
+from .topmodel import update_twi_increments
+
+
+class TopmodelEnsemble:
+    """Class that represents an ensemble of Topmodel parameter sets that
+    share the twi and climate forcing.
+
+    Takes the same arguments as Topmodel. Parameter arguments may be arrays
+    of length num_members. The results of run() are the flow_predicted and
+    saturation_deficit_avgs arrays of shape (num_members, num_timesteps).
+    """
+    def __init__(self,
+                 scaling_parameter,
+                 raw_scaling_parameter,
+                 saturated_hydraulic_conductivity,
+                 saturated_hydraulic_conductivity_multiplier,
+                 macropore_fraction,
+                 soil_depth_total,
+                 rooting_depth_factor,
+                 field_capacity_fraction,
+                 porosity_fraction,
+                 wilting_point_fraction,
+                 basin_area_total,
+                 impervious_area_fraction,
+                 impervious_curve_number,
+                 twi_values,
+                 twi_saturated_areas,
+                 twi_mean,
+                 precip_available,
+                 precip,
+                 temperatures,
+                 pet_hamon,
+                 flow_initial,
+                 twi_adj,
+                 eff_imp,
+                 et_exp_dorm,
+                 et_exp_grow,
+                 grow_trigger,
+                 riparian_area,
+                 rain_file,
+                 timestep_daily_fraction=1,
+                 option_channel_routing=True,
+                 option_karst=False,
+                 option_randomize_daily_to_hourly=False,
+                 option_min_max=False,
+                 option_distribution=False,
+                 option_forecast=False,
+                 amc_window_days=5,
+                 infiltration_cache_size=256,
+                 infiltration_cache_tolerance=0.01,
+                 seed=10):
+
+        self.lake_delay = 1.5
+        self.lake_fraction = 0
+        self.max_storage = 100000000
+        self.option_min_max = option_min_max
+        self.option_karst = option_karst
+        self.option_randomize_daily_to_hourly = option_randomize_daily_to_hourly
+
+        # Check timestep daily fraction
+        if timestep_daily_fraction > 1:
+            raise ValueError(
+                "Incorrect timestep: {}\n"
+                "Timestep daily fraction must be less than or equal to 1."
+                "".format(timestep_daily_fraction)
+            )
+
+        if option_randomize_daily_to_hourly and timestep_daily_fraction != 1:
+            raise ValueError(
+                "Incorrect timestep: {}\n"
+                "Option to randomize daily to hourly requires a daily "
+                "timestep.".format(timestep_daily_fraction)
+            )
+
+        # Climate forcing, shared by all members
+        if option_randomize_daily_to_hourly:
+            self.pet_hamon = hydrocalcs.chop_daily_to_hourly(pet_hamon)
+            self.temperatures = hydrocalcs.copy_daily_to_hourly(temperatures)
+            self.timestep_daily_fraction = 3600 / 86400
+            if option_distribution:
+                rain_array = hydrocalcs.create_rain_array(rain_file, precip, seed=seed)
+                self.precip_available = hydrocalcs.chop_daily_to_hourly_precip(precip_available, rain_array)
+            else:
+                self.precip_available = hydrocalcs.chop_daily_to_hourly(precip_available)
+        else:
+            self.pet_hamon = np.asarray(pet_hamon, dtype=float)
+            self.temperatures = np.asarray(temperatures, dtype=float)
+            self.timestep_daily_fraction = timestep_daily_fraction
+            self.precip_available = np.asarray(precip_available, dtype=float)
+
+        # Twi, shared by all members
+        self.twi_values = np.asarray(twi_values, dtype=float)
+        self.twi_saturated_areas = np.asarray(twi_saturated_areas, dtype=float)
+        self.num_twi_increments = len(self.twi_values)
+        self.num_timesteps = len(self.precip_available)
+
+        # Parameters, one value per member
+        members = np.broadcast_arrays(
+            *[np.atleast_1d(np.asarray(value, dtype=float)) for value in (
+                scaling_parameter,
+                raw_scaling_parameter,
+                saturated_hydraulic_conductivity,
+                saturated_hydraulic_conductivity_multiplier,
+                macropore_fraction,
+                soil_depth_total,
+                rooting_depth_factor,
+                field_capacity_fraction,
+                porosity_fraction,
+                wilting_point_fraction,
+                basin_area_total,
+                impervious_area_fraction,
+                impervious_curve_number,
+                twi_mean,
+                flow_initial,
+                twi_adj,
+                eff_imp,
+                et_exp_dorm,
+                et_exp_grow,
+                grow_trigger,
+                riparian_area,
+            )]
+        )
+        (self.scaling_parameter,
+         self.raw_scaling_parameter,
+         self.saturated_hydraulic_conductivity,
+         self.saturated_hydraulic_conductivity_multiplier,
+         self.macropore_fraction,
+         self.soil_depth_total,
+         self.rooting_depth_factor,
+         self.field_capacity_fraction,
+         self.porosity_fraction,
+         self.wilting_point_fraction,
+         self.basin_area_total,
+         self.impervious_area_fraction,
+         self.impervious_curve_number,
+         self.twi_mean,
+         self.flow_initial,
+         self.twi_adj,
+         self.eff_imp,
+         self.et_exp_dorm,
+         self.et_exp_grow,
+         self.grow_trigger,
+         self.riparian_area) = [value.copy() for value in members]
+        self.num_members = len(self.scaling_parameter)
+
+        self.percent_riparian = self.riparian_area / self.basin_area_total
+
+        # Antecedent moisture conditions, shared by all members
+        # Note: only depend on the forcing, see Topmodel
+        self.amc_lookback = int(round(amc_window_days / self.timestep_daily_fraction))
+        if self.amc_lookback < 1:
+            raise ValueError(
+                "Incorrect antecedent moisture conditions window: {}\n"
+                "Window must be at least one timestep".format(amc_window_days)
+            )
+        self.moisture_conditions = hydrocalcs.antecedent_moisture(
+            self.precip_available, self.amc_lookback
+        )
+
+        # Infiltration of the first wet timestep after a dry timestep, of all
+        # members together
+        self.infiltration_cache = infiltration.InfiltrationCache(
+            infiltration_cache_size, tolerance=infiltration_cache_tolerance / 1000
+        )
+
+        # Results, one row per member
+        self.flow_predicted = utils.nans((self.num_members, self.num_timesteps))
+        self.saturation_deficit_avgs = utils.nans((self.num_members, self.num_timesteps))
+
+        # Initialize model
+        self._initialize()
+
+    def _initialize(self):
+        """Initialize the soil parameters, storage deficit, soil zone
+        storages and infiltration parameters of each member, same as
+        Topmodel._initialize.
+        """
+        self.flow_initial = self.flow_initial * self.timestep_daily_fraction
+        self.flow_initial = np.where(self.flow_initial < 0.1, 0.1, self.flow_initial)
+
+        # Soil hydraulic parameters
+        self.soil_depth_roots = np.minimum(
+            self.soil_depth_total * self.rooting_depth_factor, self.soil_depth_total
+        )
+        self.vertical_drainage_flux_initial = (
+            self.saturated_hydraulic_conductivity * self.timestep_daily_fraction
+        )
+        self.saturated_hydraulic_conductivity_max = (
+            self.saturated_hydraulic_conductivity
+            * self.saturated_hydraulic_conductivity_multiplier
+        )
+        self.available_water_holding_capacity = (
+            self.field_capacity_fraction - self.wilting_point_fraction
+        )
+        self.gravity_drained_porosity = (
+            self.porosity_fraction - self.field_capacity_fraction
+        )
+        self.f_param = (
+            np.log(self.saturated_hydraulic_conductivity_multiplier)
+            / self.soil_depth_total
+        )
+        self.transmissivity_saturated_max = (
+            self.saturated_hydraulic_conductivity_max / self.f_param
+        )
+        self.scaling_parameter = np.where(
+            self.scaling_parameter < 0,
+            self.gravity_drained_porosity / self.f_param * 1000,
+            self.scaling_parameter
+        )
+        self.flow_subsurface_max = (
+            self.transmissivity_saturated_max * np.exp(-1 * self.twi_mean)
+            * self.timestep_daily_fraction
+        )
+        self.root_zone_storage_max = (
+            self.soil_depth_roots * self.available_water_holding_capacity
+        )
+
+        # Watershed average storage deficit
+        self.saturation_deficit_avg = (
+            -1 * np.log(self.flow_initial / (self.flow_subsurface_max * self.timestep_daily_fraction))
+            * self.scaling_parameter
+        )
+
+        # Local saturation deficit of each twi increment relative to the
+        # watershed average storage deficit, see Topmodel
+        self.twi_offsets = (
+            self.scaling_parameter[:, np.newaxis]
+            * (self.twi_mean[:, np.newaxis] * self.twi_adj[:, np.newaxis] - self.twi_values)
+        )
+
+        # Soil zone storages
+        self.unsaturated_zone_storage = np.zeros((self.num_members, self.num_twi_increments))
+        self.root_zone_storage = (
+            np.ones((self.num_members, self.num_twi_increments))
+            * (self.root_zone_storage_max[:, np.newaxis] * 0.5)
+        )
+        self.riparian_storage = np.zeros(self.num_members)
+
+        # Infiltration parameters
+        self.capillary_drive = 0.036
+        self.k0 = self.saturated_hydraulic_conductivity / 24 / 1000
+        self.k_coef = 14
+        self.k_zones = 9
+        self.e_xk = np.log(self.k0)
+        self.sigma = math.sqrt(math.log(self.k_coef**2 + 1))
+        self.k_dist = np.exp(
+            self.e_xk[:, np.newaxis]
+            + (np.arange(1, self.k_zones + 1) - 5) * self.sigma
+        )
+        self.ak_zones = np.array([2.33000E-04, 5.97800E-03, 6.05970E-02, 2.41730E-01, 3.82924E-01,
+                                  2.41730E-01, 6.05970E-02, 5.97800E-03, 2.33000E-04])
+        self.scaling_factor = 1 / (self.raw_scaling_parameter / 1000)
+        self.dt = 1
+        # Ponding state of each member and hydraulic conductivity zone
+        self.inf_state = infiltration.InfiltrationState((self.num_members, self.k_zones))
+
+    def run(self):
+        """Calculate water fluxes and flow prediction of all members."""
+        # Parameters as columns to broadcast over the twi increments
+        column = {
+            name: getattr(self, name)[:, np.newaxis] for name in (
+                "root_zone_storage_max",
+                "gravity_drained_porosity",
+                "soil_depth_roots",
+                "macropore_fraction",
+                "vertical_drainage_flux_initial",
+            )
+        }
+        impervious_fraction = self.impervious_area_fraction * self.eff_imp
+
+        for i in range(self.num_timesteps):
+            infiltration_excess = np.zeros(self.num_members)
+
+            # Precipitation and infiltration
+            # ==============================
+            if self.precip_available[i] <= 0:
+                precip_for_evaporation = -1 * self.precip_available[i]
+                if self.temperatures[i] <= 0:
+                    precip_for_evaporation = 0
+                precip_for_recharge = np.zeros(self.num_members)
+                self.inf_state.reset()
+            else:
+                precip_for_evaporation = 0
+                ppt = self.precip_available[i] / 1000
+                zone_infiltration = self.infiltration_cache.infiltration_zones(
+                    infiltration.infiltration_zones_vectorized, i + 1, self.dt, ppt, self.k_dist, self.ak_zones,
+                    self.capillary_drive, self.scaling_factor[:, np.newaxis],
+                    self.inf_state
+                )
+                infiltration_array = zone_infiltration * 1000
+                infiltration_excess = np.where(
+                    self.precip_available[i] - infiltration_array < 1.0e-4,
+                    0,
+                    self.precip_available[i] - infiltration_array
+                )
+                precip_for_recharge = self.precip_available[i] - infiltration_excess
+
+            growing = self.temperatures[i] > self.grow_trigger
+            et_exponent = np.where(growing, self.et_exp_grow, self.et_exp_dorm)
+
+            # Twi increments
+            # ==============
+            fluxes = update_twi_increments(
+                saturation_deficit_avg=self.saturation_deficit_avg[:, np.newaxis],
+                root_zone_storage=self.root_zone_storage,
+                unsaturated_zone_storage=self.unsaturated_zone_storage,
+                precip_for_recharge=precip_for_recharge[:, np.newaxis],
+                precip_for_evaporation=precip_for_evaporation,
+                et_exponent=et_exponent[:, np.newaxis],
+                twi_offsets=self.twi_offsets,
+                twi_saturated_areas=self.twi_saturated_areas,
+                **column
+            )
+            self.root_zone_storage = fluxes["root_zone_storage"]
+            self.unsaturated_zone_storage = fluxes["unsaturated_zone_storage"]
+            return_flow = fluxes["return_flow"]
+            flow_predicted_overland = fluxes["flow_predicted_overland"] + infiltration_excess
+
+            # Subsurface flow (base flow)
+            # ===========================
+            subsurface_flow_rate_ratio = self.saturation_deficit_avg / self.scaling_parameter
+            flow_predicted_subsurface = np.where(
+                subsurface_flow_rate_ratio > 100,
+                0,
+                self.flow_subsurface_max
+                * np.exp(-1 * np.minimum(subsurface_flow_rate_ratio, 100))
+            )
+            if self.option_karst:
+                flow_predicted_karst = flow_predicted_subsurface
+                flow_predicted_subsurface = np.zeros(self.num_members)
+            else:
+                flow_predicted_karst = np.zeros(self.num_members)
+
+            self.saturation_deficit_avg = (
+                self.saturation_deficit_avg
+                - fluxes["flow_predicted_vertical_drainage_flux"]
+                + flow_predicted_subsurface
+                + return_flow
+                + fluxes["qroot"]
+            )
+            self.saturation_deficit_avg = np.where(
+                self.saturation_deficit_avg < 0, 0, self.saturation_deficit_avg
+            )
+
+            # Impervious area flow
+            # ====================
+            # The antecedent moisture conditions only depend on the forcing,
+            # the growing season and curve number differ per member
+            flow_predicted_impervious_area = hydrocalcs.runoff_vectorized(
+                grow_season=growing,
+                precipitation=precip_for_recharge,
+                curve_number=self.impervious_curve_number,
+                amc=self.moisture_conditions[i]
+            )
+
+            # Total flow and channel routing
+            # ==============================
+            flow_predicted_total = (
+                flow_predicted_subsurface
+                + flow_predicted_overland
+                + return_flow
+                + flow_predicted_karst
+            )
+            flow_predicted_stream = (
+                flow_predicted_total * (1 - self.percent_riparian - impervious_fraction)
+                + flow_predicted_impervious_area * impervious_fraction
+            )
+            transpiration = (
+                fluxes["transpiration"] * (1 - self.percent_riparian - impervious_fraction)
+            )
+            flow_predicted_stream = np.where(flow_predicted_stream < 0, 0, flow_predicted_stream)
+
+            self.riparian_storage = (
+                self.riparian_storage - transpiration
+                + flow_predicted_stream * self.lake_fraction
+                + self.precip_available[i] * self.percent_riparian
+            )
+            q_riparian = np.where(self.riparian_storage > 0, self.riparian_storage / self.lake_delay, 0)
+            self.riparian_storage = self.riparian_storage - q_riparian
+            overflow = self.riparian_storage > self.max_storage
+            q_riparian = np.where(overflow, q_riparian + self.riparian_storage - self.max_storage, q_riparian)
+            self.riparian_storage = np.where(overflow, self.max_storage, self.riparian_storage)
+
+            self.flow_predicted[:, i] = flow_predicted_stream * (1 - self.lake_fraction) + q_riparian
+            self.saturation_deficit_avgs[:, i] = self.saturation_deficit_avg
+
+        # Post processing
+        # ===============
+        # If option_randomize_daily_to_hourly is True, then convert back from
+        # hourly to daily along the time axis.
+        self.drop_first = 8760
+
+        if self.option_randomize_daily_to_hourly:
+            flow_predicted = hydrocalcs.sum_hourly_to_daily(
+                self.flow_predicted[:, self.drop_first:].T, minmax=self.option_min_max
+            )
+            if self.option_min_max:
+                self.flow_predicted = tuple(values.T for values in flow_predicted)
+            else:
+                self.flow_predicted = flow_predicted.T
+            self.saturation_deficit_avgs = hydrocalcs.bind_hourly_to_daily(
+                self.saturation_deficit_avgs[:, self.drop_first:].T
+            ).T
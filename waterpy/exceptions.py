@@ -355,4 +355,31 @@ class ParameterFileErrorEffImp(TopmodelpyException):
             "Error in basin characteristics.\n"
             "Invalid eff_imp parameter:\n"
             "Value is {}".format(invalid_value)
-        )
\ No newline at end of file
+        )
+
+class CalibrationBoundsFileErrorInvalidParameter(TopmodelpyException):
+    """
+    Raised when a calibration bounds file contains a parameter that is not
+    in the basin characteristics or land type parameters.
+    """
+    def __init__(self, invalid_name):
+        self.message = (
+            "Error in calibration bounds.\n"
+            "Invalid parameter:\n"
+            "  {}\n"
+            "Parameter must be in the basin characteristics or land type "
+            "parameters file.".format(invalid_name)
+        )
+
+
+class CalibrationBoundsFileErrorInvalidBounds(TopmodelpyException):
+    """
+    Raised when the minimum of a calibration parameter is not less than its
+    maximum.
+    """
+    def __init__(self, name, minimum, maximum):
+        self.message = (
+            "Error in calibration bounds.\n"
+            "Invalid bounds of {} parameter:\n"
+            "Minimum {} must be less than maximum {}".format(name, minimum, maximum)
+        )
@@ -14,9 +14,10 @@ Technical Release 55 (TR55), June 1986
 https://www.nrcs.usda.gov/Internet/FSE_DOCUMENTS/stelprdb1044171.pdf
 """
 
+import functools
+import os
 import numpy as np
 import pandas as pd
-from scipy import stats
 
 
 def pet(dates, temperatures, latitude, calib_coeff, method="hamon"):
@@ -41,10 +42,10 @@ def pet_hamon(dates, temperatures, latitude, calib_coeff=1.2):
     """Calculate the amount of potential evapotranspiration in millimeters
     per day using the Hamon equation.
 
-    :param dates: An array of python datetimes
+    :param dates: An array of python datetimes, see day_of_year
     :type dates: numpy.ndarray
-    :param temps: An array of temps, in degrees Celsius
-    :type temps: numpy.ndarray
+    :param temperatures: An array of temperatures, in degrees Celsius
+    :type temperatures: numpy.ndarray
     :param latitude: A latitude, in decimal degrees
     :type latitude: float
     :param calib_coeff: Calibration coefficient (KPEC), dimensionless
@@ -119,55 +120,78 @@ def pet_hamon(dates, temperatures, latitude, calib_coeff=1.2):
             "".format(len(dates), len(temperatures))
         )
 
-    DEG2RAD = np.pi/180
-    RAD2DEG = 180/np.pi
+    # Daytime length (Ld) of the day of the year of each date, the table is
+    # cached by latitude so a numpy scalar or 0-d array latitude is converted
+    daytime_length = daytime_length_table(float(latitude))[day_of_year(dates) - 1]
 
-    pet = []
-    for date, temperature in zip(dates, temperatures):
+    temperatures = np.asarray(temperatures, dtype=float)
 
-        # Declination
-        # Note: using python datetimes whih have .timetuple() method
-        day_num = date.timetuple().tm_yday
-        angle = 360 * ((284 + day_num) / 365) * DEG2RAD
-        declination = (23.45 * DEG2RAD) * np.sin(angle)
+    # calculate saturated vapor pressure (ESAT)
+    saturated_vapor_pressure = (
+        6.108 * np.exp((17.26939 * temperatures) / (temperatures + 237.3))
+    )
 
-        # calculate sunset hour angle in degrees (w)
-        sunset_hour_angle = (
-            np.arccos(-1 * np.tan(declination) * np.tan(latitude * DEG2RAD))
-            * RAD2DEG
-        )
+    # calculate saturated vapor density (RHOSAT)
+    saturated_vapor_density = (
+        (216.7 * saturated_vapor_pressure) / (temperatures + 273.3)
+    )
 
-        # calculate daytime length in 12 hour unit (Ld)
-        daytime_length = abs((sunset_hour_angle / 15) * 2) / 12
+    # calculate potential evapotranspiration
+    # If temperatures are below freezing PET shouldn't exist.
+    pet = np.where(
+        temperatures <= 0,
+        0.0,
+        0.1651 * daytime_length * saturated_vapor_density * calib_coeff
+    )
 
-        # calculate saturated vapor pressure (ESAT)
-        saturated_vapor_pressure = (
-            6.108 * np.exp((17.26939 * temperature) / (temperature + 237.3))
-        )
+    return pet
 
-        # calculate saturated vapor density (RHOSAT)
-        saturated_vapor_density = (
-            (216.7 * saturated_vapor_pressure) / (temperature + 273.3)
-        )
 
-        if temperature <= 0:
-        # If temperatures are below freezing PET shouldn't exist.
+def day_of_year(dates):
+    """Return the day of the year, 1 to 366, of each date.
 
-            potential_evapotranspiration = 0
+    :param dates: An array of python datetimes, numpy datetime64 values, or
+                  a pandas DatetimeIndex
+    :type dates: numpy.ndarray
+    :return day_num: array of days of the year
+    :rtype day_num: numpy.ndarray
+    """
+    return pd.DatetimeIndex(dates).dayofyear.to_numpy()
 
-        else:
-        # calculate potential evapotranspiration
-            potential_evapotranspiration = (
-                0.1651 * daytime_length * saturated_vapor_density * calib_coeff
-            )
 
-        # add to list
-        pet.append(potential_evapotranspiration)
+@functools.lru_cache(maxsize=1024)
+def daytime_length_table(latitude):
+    """Return the daytime length (Ld) in multiples of 12 hours of each day of
+    the year at a latitude, see equations (4) to (6) of pet_hamon.
 
-    # convert list to numpy array
-    pet = np.array(pet)
+    The table is cached and shared by all calls with the same latitude, so it
+    is read-only.
 
-    return pet
+    :param latitude: A latitude, in decimal degrees
+    :type latitude: float
+    :return daytime_length: array of the 366 daytime lengths of days 1 to
+                            366 of the year
+    :rtype daytime_length: numpy.ndarray
+    """
+    DEG2RAD = np.pi/180
+    RAD2DEG = 180/np.pi
+
+    # Declination
+    day_num = np.arange(1, 367)
+    angle = 360 * ((284 + day_num) / 365) * DEG2RAD
+    declination = (23.45 * DEG2RAD) * np.sin(angle)
+
+    # calculate sunset hour angle in degrees (w)
+    sunset_hour_angle = (
+        np.arccos(-1 * np.tan(declination) * np.tan(latitude * DEG2RAD))
+        * RAD2DEG
+    )
+
+    # calculate daytime length in 12 hour unit (Ld)
+    daytime_length = np.abs((sunset_hour_angle / 15) * 2) / 12
+    daytime_length.flags.writeable = False
+
+    return daytime_length
 
 
 def snowmelt(precipitation,
@@ -311,6 +335,126 @@ def snowmelt(precipitation,
     return snowprecip, snowmelts, snowpacks, snow_water_equivalence
 
 
+def snowmelt_batch(precipitation,
+                   temperatures,
+                   temperature_cutoff,
+                   snowmelt_rate_coeff_with_rain,
+                   snowmelt_rate_coeff,
+                   timestep_daily_fraction):
+    """Snow melt routine of a batch of snowpacks, such as of several basins
+    or climate ensemble members, advanced together.
+
+    Same as snowmelt for each row, see snowmelt. The precipitation and
+    temperatures are arrays of shape num_members x num_timesteps, or of
+    length num_timesteps when shared by all members, and the coefficients
+    are single values or arrays with one value per member.
+
+    :param precipitation: Precipitation rates, in millimeters per day
+    :type precipitation: numpy.ndarray
+    :param temperatures: Temperatures, in degrees Fahrenheit
+    :type temperatures: numpy.ndarray
+    :param temperature_cutoff: Temperature when melt begins,
+                               in degrees Fahrenheit
+    :type temperature_cutoff: float or numpy.ndarray
+    :param snowmelt_rate_coeff_with_rain: Snowmelt coefficient when raining,
+                                          1/degrees Fahrenheit
+    :type snowmelt_rate_coeff_with_rain: float or numpy.ndarray
+    :param snowmelt_rate_coeff: Snowmelt rate coefficient (often variable),
+                                in inches per degree Fahrenheit
+    :type snowmelt_rate_coeff: float or numpy.ndarray
+    :param timestep_daily_fraction: Model timestep as a fraction of a day
+    :type timestep_daily_fraction: float
+    :return: Tuple of arrays of adjusted precipitation, snowmelt,
+             snowpack values, and snow water equivalence, each array
+             of shape num_members x num_timesteps is in millimeters per day
+    :rtype: Tuple
+    """
+    # Snow water equivalence is assumed to be 10% of the snow water density.
+    snow_water_equivalence_factor = 0.1
+    # Geothermal melting from "bottom" of snow pack, see snowmelt
+    melt_rate_male_gray = 0.02  # inches/day
+
+    precip_inches = np.atleast_2d(np.asarray(precipitation, dtype=float)) / 25.4  # mm to inches
+    temperatures = np.atleast_2d(np.asarray(temperatures, dtype=float))
+    coefficients = [
+        np.asarray(value, dtype=float)
+        for value in (temperature_cutoff, snowmelt_rate_coeff_with_rain, snowmelt_rate_coeff)
+    ]
+    num_members = np.broadcast_shapes(
+        precip_inches.shape[:1], temperatures.shape[:1],
+        *[np.shape(np.atleast_1d(value)) for value in coefficients]
+    )[0]
+    num_timesteps = np.broadcast_shapes(precip_inches.shape[1:], temperatures.shape[1:])[0]
+    precip_inches = np.broadcast_to(precip_inches, (num_members, num_timesteps))
+    temperatures = np.broadcast_to(temperatures, (num_members, num_timesteps))
+    temperature_cutoff, snowmelt_rate_coeff_with_rain, snowmelt_rate_coeff = [
+        np.broadcast_to(value, (num_members,)) for value in coefficients
+    ]
+
+    snowprecip = np.empty((num_members, num_timesteps))
+    snowmelts = np.empty((num_members, num_timesteps))
+    snowpacks = np.empty((num_members, num_timesteps))
+
+    snowmelt = np.zeros(num_members)
+    snowpack = np.zeros(num_members)
+    for i in range(num_timesteps):
+        temp = temperatures[:, i]
+        precip_inch = precip_inches[:, i]
+
+        # Snowmelt with rain or without rain where temp is high enough,
+        # limited to the snowpack available to melt, else the snowmelt of
+        # the previous timestep is kept as in snowmelt
+        melt = np.where(
+            precip_inch > 0,
+            snowmelt_rain_on_snow_heavily_forested(
+                precip_inch,
+                temp,
+                temperature_cutoff,
+                snowmelt_rate_coeff_with_rain
+            ),
+            snowmelt_temperature_index(
+                temp,
+                temperature_cutoff,
+                snowmelt_rate_coeff
+            )
+        ) * timestep_daily_fraction
+        melting = temp >= temperature_cutoff
+        snowmelt = np.where(melting, np.minimum(melt, snowpack), snowmelt)
+
+        # Melting snowpacks add the snowmelt to the precip, cold snowpacks
+        # accumulate the full precip (snow) and no water infiltrates
+        precip_inch = np.where(
+            melting,
+            precip_inch + (snowmelt * snow_water_equivalence_factor),
+            0
+        )
+        snowpack = np.where(
+            melting,
+            snowpack - snowmelt,
+            snowpack + (precip_inches[:, i] / snow_water_equivalence_factor)
+        )
+
+        # Apply geothermal melting, all of the snowpack if less than the
+        # melt rate
+        ground_melt = np.minimum(snowpack, melt_rate_male_gray)
+        snowpack = snowpack - ground_melt
+        precip_inch = precip_inch + (
+            ground_melt * snow_water_equivalence_factor
+        )
+
+        snowprecip[:, i] = precip_inch
+        snowmelts[:, i] = snowmelt
+        snowpacks[:, i] = snowpack
+
+    snowprecip = snowprecip * 25.4  # inches to mm
+    snowmelts = snowmelts * 25.4  # inches to mm
+    snowpacks = snowpacks * 25.4  # inches to mm
+
+    snow_water_equivalence = snowpacks * snow_water_equivalence_factor
+
+    return snowprecip, snowmelts, snowpacks, snow_water_equivalence
+
+
 def snowmelt_rain_on_snow_heavily_forested(precipitation,
                                            temperatures,
                                            temperature_cutoff=32.0,
@@ -549,6 +693,82 @@ def runoff(grow_season, precipitation, curve_number, amc):
 
     return runoff
 
+
+def runoff_vectorized(grow_season, precipitation, curve_number, amc):
+    """Calculate the amount of runoff using the SCS runoff curve number method
+    with array operations over whole series, same as runoff for each element
+    where there is precipitation. The curve number adjustments for wet,
+    normal and dry antecedent moisture conditions are selected with masks.
+
+    :param grow_season: Growing season flags
+    :type grow_season: numpy.ndarray
+    :param precipitation: precipitation, in mm
+    :type precipitation: numpy.ndarray
+    :param curve_number: curve number, dimensionless
+    :type curve_number: float or numpy.ndarray
+    :param amc: antecedent moisture conditions, in mm
+    :type amc: numpy.ndarray
+    :return runoff: runoff, in mm, 0 where precipitation <= 0
+    :rtype runoff: numpy.ndarray
+    """
+    grow_season = np.asarray(grow_season, dtype=bool)
+    precipitation = np.asarray(precipitation, dtype=float)
+    curve_number = np.asarray(curve_number, dtype=float)
+    amc = np.asarray(amc, dtype=float)
+
+    # Thresholds of wet and of normal conditions, cold if grow_season as in
+    # runoff, else warm
+    wet = amc > np.where(grow_season, 27.94, 53.34)
+    normal = amc > np.where(grow_season, 12.7, 35.56)
+    curve_number = np.where(
+        wet,
+        23 * curve_number / (10 + 0.13 * curve_number),
+        np.where(
+            normal,
+            curve_number,
+            curve_number * 4.2 / (10 - 0.058 * curve_number)
+        )
+    )
+
+    precip_inches = precipitation / 25.4  # mm to inches
+
+    potential_retention = (1000 / curve_number) - 10
+    with np.errstate(divide="ignore", invalid="ignore"):
+        runoff_inches = (
+            (precip_inches - 0.2 * potential_retention)**2
+            / (precip_inches + 0.8 * potential_retention)
+        )
+    runoff = np.where(precipitation > 0, runoff_inches * 25.4, 0)  # inches to mm
+
+    return runoff
+
+
+def antecedent_moisture(precipitation, window, history=None):
+    """Calculate the antecedent moisture conditions, the precipitation
+    summed over a moving window of the preceding timesteps, with a
+    cumulative sum. Negative precipitation, for example precipitation
+    minus pet, does not count.
+
+    :param precipitation: precipitation of each timestep, in mm
+    :type precipitation: numpy.ndarray
+    :param window: number of preceding timesteps of the moving window
+    :type window: int
+    :param history: precipitation of the window timesteps before the first
+                    timestep, oldest first, zeros by default
+    :type history: numpy.ndarray
+    :return amc: antecedent moisture conditions before each timestep and,
+                 as last value, after the last timestep, in mm
+    :rtype amc: numpy.ndarray
+    """
+    if history is None:
+        history = np.zeros(window)
+
+    values = np.maximum(np.concatenate((history, precipitation)), 0)
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    amc = cumulative[window:] - cumulative[:-window]
+
+    return amc
+
 def weighted_mean(values, weights):
     """Calculate the weighted mean.
 
@@ -673,32 +893,81 @@ def nash_sutcliffe(observed, modeled):
 
 def flow_duration(values):
     """Calculate the exceedance probabilities for a set of values for use in
-    plotting a flow duration curve.
+    plotting a flow duration curve. Several series, such as ensemble members
+    or basins, are calculated at once when values is a matrix of shape
+    num_series x num_timesteps.
 
-    :param observed: Array of flow values
-    :type observed: numpy.ndarray
-    :param modeled: Array of modeled data
-    :return tuple: Tuple of probabilities, sorted values
+    :param values: Array of flow values, or a matrix of one series per row
+    :type values: numpy.ndarray
+    :return tuple: Tuple of probabilities, sorted values, of the same shape
+                   as values
     :rtype: tuple
     """
-    # Sort the values
-    values_sorted = np.sort(values)
+    # Sort the values of each series
+    values_sorted = np.sort(values, axis=-1)
+
+    # Rank data from smallest to largest, tied values get the average of
+    # the first and last position of their run in the sorted values
+    positions = np.arange(values_sorted.shape[-1])
+    changes = values_sorted[..., 1:] != values_sorted[..., :-1]
+    starts = np.concatenate((np.ones_like(changes[..., :1]), changes), axis=-1)
+    ends = np.concatenate((changes, np.ones_like(changes[..., :1])), axis=-1)
+    first = np.maximum.accumulate(np.where(starts, positions, 0), axis=-1)
+    last = np.minimum.accumulate(
+        np.where(ends, positions, positions[-1])[..., ::-1], axis=-1
+    )[..., ::-1]
+    ranks = (first + last) / 2 + 1
+
+    # Reverse the order and compute the exceedance probabilities
+    probabilities = ranks[..., ::-1] / (values_sorted.shape[-1] + 1) * 100
 
-    # Rank data from smallest to largest
-    ranks = stats.rankdata(values_sorted, method="average")
+    return probabilities, values_sorted
 
-    # Reverse the order
-    ranks = ranks[::-1]
 
-    # Compute the exceedance probabilities
-    probabilities = (
-        [(ranks[i] / (len(values) + 1)) * 100 for i in range(len(values))]
-    )
+def flow_duration_quantiles(values, probabilities):
+    """Calculate the flows exceeded with the given exceedance probabilities
+    for one or several series, with linear interpolation between the sorted
+    values. Used to compare the flow duration curves of ensemble members or
+    basins at the same probabilities, see also sketch.QuantileSketch for
+    series too long or too many to keep.
 
-    return probabilities, values_sorted
+    :param values: Array of flow values, or a matrix of one series per row
+    :type values: numpy.ndarray
+    :param probabilities: Exceedance probabilities, in percent
+    :type probabilities: numpy.ndarray
+    :return flows: Flows of shape num_series x num_probabilities, or
+                   num_probabilities for one series
+    :rtype: numpy.ndarray
+    """
+    quantiles = 1 - np.atleast_1d(np.asarray(probabilities, dtype=float)) / 100
+    flows = np.quantile(values, quantiles, axis=-1)
+
+    # Move the probabilities to the last axis
+    return np.moveaxis(flows, 0, -1)
+
+
+def seed_sequences(seed, num_streams):
+    """Spawn independent seeds from one run-level seed. Each seed is a child
+    of the seed sequence of the seed, so the streams do not overlap and
+    child k is the same for the same seed, whichever process uses it and
+    however many streams are spawned. Pass one seed to each realization or
+    worker as the seed keyword, which creates a new generator from it
+    every time, so a seed can be reused by many runs of a realization.
+
+    :param seed: Run-level seed, or a numpy.random.SeedSequence
+    :type seed: int or numpy.random.SeedSequence
+    :param num_streams: Number of seeds
+    :type num_streams: int
+    :return seeds: List of seed sequences
+    :rtype: list of numpy.random.SeedSequence
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
 
+    return seed.spawn(num_streams)
 
-def randomize(value, size=24):
+
+def randomize(value, size=24, seed=1):
     """Generate pseudo random values of a certain size that sum to 1.0.
     Used to create 24 hourly random values from a single daily value.
 
@@ -706,15 +975,18 @@ def randomize(value, size=24):
     :type values: float
     :param size: Size of array wanted to be returned, default is 24 (hours)
     :type size: int
+    :param seed: Seed of the random values, a numpy.random.SeedSequence or
+                 a numpy.random.Generator, see seed_sequences
+    :type seed: int or numpy.random.SeedSequence or numpy.random.Generator
     :return randomized: Array of random values.
     :rtype: numpy.ndarray
 
     """
-    # Set the seed to reproduce results
-    np.random.seed(1)
+    # Generator of the seed, the global random state is not changed
+    rng = np.random.default_rng(seed)
 
     # Create random array of a certain size
-    random_array = np.random.random(size)
+    random_array = rng.random(size)
 
     # Normalize to make the sum of the array equal to 1.0
     random_array_normalized = random_array / random_array.sum()
@@ -725,7 +997,29 @@ def randomize(value, size=24):
     return randomized
 
 
-def create_rain_array(rain_file, values):
+def read_rain_distribution(rain_file):
+    """Read the rain distribution file into an array of shape
+    num_patterns x 24, one row of 24 hourly fractions per column of the
+    file. The array is cached and shared by all calls with the same file,
+    until the file is modified, so it is read-only.
+
+    :param rain_file: path to .csv ppt distribution file specified in the model config .ini
+    :type rain_file: string
+    :rtype: numpy.ndarray
+    """
+    return _read_rain_distribution(rain_file, os.path.getmtime(rain_file))
+
+
+@functools.lru_cache(maxsize=32)
+def _read_rain_distribution(rain_file, modified):
+    """Read the rain distribution file, cached by path and modification time."""
+    patterns = np.ascontiguousarray(pd.read_csv(rain_file).to_numpy(dtype=float).T)
+    patterns.flags.writeable = False
+
+    return patterns
+
+
+def create_rain_array(rain_file, values, seed=10):
     """Shuffles the rain distribution columns and creates an array of fractional values the same
     length as the precip input.  This can be passed to the chop_daily_to_hourly_precip function
     Every 24 values should sum to ~1.0.
@@ -733,65 +1027,69 @@ def create_rain_array(rain_file, values):
     :type rain_file: string
     :param values: Daily values.
     :type values: numpy.ndarray
+    :param seed: Seed of the random selection of the columns, a
+                 numpy.random.SeedSequence or a numpy.random.Generator,
+                 see seed_sequences
+    :type seed: int or numpy.random.SeedSequence or numpy.random.Generator
     :rtype: numpy.ndarray
     """
-    # Set seed for results
-    np.random.seed(10)
+    # Rain distribution patterns, see read_rain_distribution
+    patterns = read_rain_distribution(rain_file)
 
-    # Read in the PPT csv file and get the length of the precip columns
-    df = pd.read_csv(rain_file)
-    val_len = len(values) + 1
-    val_array = np.array(range(0, val_len))
-    rain_dist = []
-    high = len(df.columns) - 1
+    # Gather the 24 fractions of the column of each day
+    return patterns[rain_pattern_columns(rain_file, values, seed=seed)].ravel()
 
-    # Randomize the integers to select a column.
-    rand_array = np.random.randint(low=0, high=high, size=len(val_array))
 
-    for day in rand_array:
-        day_dist = df[df.columns[day]].values
-        for value in day_dist:
-            rain_dist.append(value)
+def rain_pattern_columns(rain_file, values, seed=10):
+    """Randomly select the column of the rain distribution file of each day,
+    the same columns as create_rain_array, without creating the hourly
+    fractions. The 24 fractions of a day are the row of its column of
+    read_rain_distribution.
 
-    return np.array(rain_dist)
+    :param rain_file: path to .csv ppt distribution file specified in the model config .ini
+    :type rain_file: string
+    :param values: Daily values.
+    :type values: numpy.ndarray
+    :param seed: Seed of the random selection of the columns, see
+                 create_rain_array
+    :type seed: int or numpy.random.SeedSequence or numpy.random.Generator
+    :return columns: Column of each day, of size len(values) + 1
+    :rtype: numpy.ndarray
+    """
+    num_patterns = len(read_rain_distribution(rain_file))
+
+    # Randomize the integers to select a column for each day.
+    rng = np.random.default_rng(seed)
 
+    return rng.integers(low=0, high=num_patterns - 1, size=len(values) + 1)
 
-def randomize_daily_to_hourly(values):
+
+def randomize_daily_to_hourly(values, seed=1):
     """Generate pseudo random values of a certain size that sum to 1.0.
     Used to create hourly random values from daily values.
     Function currently unused in program.
 
     :param values: Daily values to randomize into hourly values.
     :type values: numpy.ndarray
+    :param seed: Seed of the random values, a numpy.random.SeedSequence or
+                 a numpy.random.Generator, see seed_sequences
+    :type seed: int or numpy.random.SeedSequence or numpy.random.Generator
     :rtype: numpy.ndarray
     """
-    # Set the seed to reproduce results
-    np.random.seed(1)
-
-    # Create an array of random hourly values from daily values
-    randomized = []
-    for value in values:
-        # Create random array of 24 hours and add some zeros
-        n_zeros = 0 #np.random.randint(1, 12)
-        n_non_zeros = 24 - n_zeros
-
-        rand = np.random.random(n_non_zeros)
-        rand = np.append(rand, np.zeros(n_zeros))
-
-        # Shuffle the array to that the zeros are dispersed throughout the day
-        np.random.shuffle(rand)
+    # Generator of the seed, the global random state is not changed
+    rng = np.random.default_rng(seed)
 
-        # Normalize to make the sum of the array equal to 1.0
-        rand_normalized = rand / rand.sum()
+    # Create random arrays of 24 hours for all days at once
+    values = np.asarray(values, dtype=float)
+    rand = rng.random((len(values), 24))
 
-        # Distribute value across array
-        rand_with_value = rand_normalized * value
+    # Normalize to make the sum of each day equal to 1.0
+    rand_normalized = rand / rand.sum(axis=1, keepdims=True)
 
-        # Loop through random array with value and append random values to list
-        for rand_value in rand_with_value:
-            randomized.append(rand_value)
+    # Distribute each daily value across its day
+    randomized = rand_normalized * values[:, np.newaxis]
 
-    return np.array(randomized)
+    return randomized.ravel()
 
 
 def copy_daily_to_hourly(values):
@@ -802,17 +1100,9 @@ def copy_daily_to_hourly(values):
     :type values: numpy.ndarray
     :rtype: numpy.ndarray
     """
-    # Create an array of hourly values from daily values
-    copied = []
-    for value in values:
-        # Create array for 24 hours and distribute (copy) daily value to hourly
-        hourly_array = np.ones(24) * value
-
-        # Loop through array and append hourly values to list
-        for hourly_value in hourly_array:
-            copied.append(hourly_value)
-
-    return np.array(copied)
+    # Create an array of hourly values from daily values, each daily value
+    # copied to its 24 hours
+    return np.repeat(np.asarray(values, dtype=float), 24)
 
 
 def chop_daily_to_hourly(values):
@@ -824,13 +1114,7 @@ def chop_daily_to_hourly(values):
     :type values: numpy.ndarray
     :rtype: numpy.ndarray
     """
-    copied = []
-    for value in values:
-        hourly_array = np.ones(24) * value / 24
-        for hourly_value in hourly_array:
-            copied.append(hourly_value)
-
-    return np.array(copied)
+    return np.repeat(np.asarray(values, dtype=float) / 24, 24)
 
 
 def chop_daily_to_hourly_precip(values, rain_array):
@@ -844,15 +1128,11 @@ def chop_daily_to_hourly_precip(values, rain_array):
     :type rain_array: numpy.ndarray
     :rtype: numpy.ndarray
     """
-    copied = []
-    i = 0
-    for value in values:
-        hourly_array = np.ones(24) * value
-        for hourly_value in hourly_array:
-            copied.append(hourly_value * rain_array[i])
-            i += 1
+    values = np.asarray(values, dtype=float)
+    # Fractions of the 24 hours of each day, rain_array may be longer
+    rain_fractions = np.asarray(rain_array)[:24 * len(values)].reshape(-1, 24)
 
-    return np.array(copied)
+    return (values[:, np.newaxis] * rain_fractions).ravel()
 
 
 def sum_hourly_to_daily(values, minmax=False):
@@ -1,13 +1,161 @@
+import collections
 import math
 import numpy as np
 
-class Statics:
+# Ponding values of the infiltration state
+FIELDS = ("cumi", "i_end", "lamb", "tp", "pond")
 
-    cumi = 0
-    i_end = 0
-    lamb = 0
-    tp = 0
-    pond = 0
+# Coefficients 1 / (j * j!) of the terms x**j, j = 1 to 10, of the series
+# of the exponential integral used in infiltration
+SERIES_COEFFICIENTS = tuple(1 / (j * math.factorial(j)) for j in range(1, 11))
+
+
+def _field(index):
+    """Return a property of one ponding value of InfiltrationState."""
+    def get(self):
+        return self.values[index]
+
+    def set(self, value):
+        self.values[index] = value
+
+    return property(get, set)
+
+
+class InfiltrationState:
+    """Infiltration ponding state owned by one model, or by each member of a
+    batch of models, so that models can run concurrently.
+
+    The ponding values, see FIELDS, are rows of the values array of shape
+    len(FIELDS) x shape, a single value each for the default shape () or an
+    array with one value per element, such as per hydraulic conductivity
+    zone or per member and zone. Indexing returns the state of an element
+    as a view of the values.
+
+    :param shape: Shape of the batch, () for a single model
+    :type shape: tuple
+    """
+    cumi = _field(0)
+    i_end = _field(1)
+    lamb = _field(2)
+    tp = _field(3)
+    pond = _field(4)
+
+    def __init__(self, shape=()):
+        self.values = np.zeros((len(FIELDS),) + tuple(shape))
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        state = InfiltrationState.__new__(InfiltrationState)
+        state.values = self.values[(slice(None),) + index]
+        return state
+
+    def reset(self):
+        """Reset all ponding values to 0."""
+        self.values[:] = 0
+
+
+class InfiltrationCache:
+    """Bounded least recently used cache of the infiltration of the first
+    wet timestep after the ponding state is reset, such as the first day of
+    a storm in daily mode.
+
+    From a reset ponding state the infiltration, and the ponding values
+    after the timestep, depend only on the precipitation, the timestep and
+    the parameters, the time to ponding tp relative to the time. Other
+    timesteps are calculated by the solver. The hits and misses count the
+    timesteps served from the cache and calculated into the cache.
+
+    The precipitation is quantized to intervals of width tolerance, and the
+    result of an interval is calculated for the precipitation of its middle,
+    so results do not depend on the order of the timesteps. The
+    infiltration does not increase faster than the precipitation, so the
+    infiltration, limited to the precipitation, is within half the
+    tolerance of the solver. The ponding values are those of the middle of
+    the interval. With a tolerance of 0 only the same precipitation is
+    reused.
+
+    :param maxsize: Maximum number of cached results, 0 to disable the cache
+    :type maxsize: int
+    :param tolerance: Width of the precipitation intervals of the keys, in
+                      the units of ppt
+    :type tolerance: float
+    """
+    def __init__(self, maxsize=256, tolerance=1.0e-5):
+        if tolerance < 0:
+            raise ValueError(
+                "Incorrect infiltration cache tolerance: {}\n"
+                "Tolerance must not be negative.".format(tolerance)
+            )
+        self.maxsize = maxsize
+        self.tolerance = tolerance
+        self.hits = 0
+        self.misses = 0
+        self._results = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._results)
+
+    def clear(self):
+        """Remove all cached results and reset the hit and miss counts."""
+        self._results.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def infiltration_zones(self, solver, time, dt, ppt, k_dist, ak_zones, cd, m, statics):
+        """Calculate the infiltration over the hydraulic conductivity zones
+        with solver, infiltration_zones or infiltration_zones_vectorized, or
+        return the cached result if the ponding state is reset.
+
+        :param solver: Function calculating the infiltration
+        :type solver: function
+        :param statics: Ponding state, updated in place
+        :type statics: InfiltrationState
+        :return zone_infiltration: Infiltration, see solver
+        :rtype: float or numpy.ndarray
+        """
+        if self.maxsize <= 0 or statics.values.any():
+            return solver(time, dt, ppt, k_dist, ak_zones, cd, m, statics)
+
+        tp = FIELDS.index("tp")
+        if self.tolerance > 0:
+            interval = ppt // self.tolerance
+            ppt_solver = (interval + 0.5) * self.tolerance
+        else:
+            interval = ppt_solver = ppt
+        key = (interval, dt, cd, _cache_key(k_dist), _cache_key(ak_zones), _cache_key(m))
+        result = self._results.get(key)
+        if result is None:
+            self.misses += 1
+            zone_infiltration = solver(time, dt, ppt_solver, k_dist, ak_zones, cd, m, statics)
+            values = statics.values.copy()
+            ponded = values[tp] != 0
+            values[tp] = values[tp] - time * ponded
+            result = (_copy(zone_infiltration), values, ponded)
+            self._results[key] = result
+            if len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+        else:
+            self.hits += 1
+            self._results.move_to_end(key)
+
+        zone_infiltration, values, ponded = result
+        statics.values[:] = values
+        statics.values[tp] = values[tp] + time * ponded
+        return np.minimum(zone_infiltration, ppt) if isinstance(zone_infiltration, np.ndarray) \
+            else min(zone_infiltration, ppt)
+
+
+def _cache_key(value):
+    """Return a hashable key of a float or array of InfiltrationCache."""
+    return np.asarray(value, dtype=float).tobytes()
+
+
+def _copy(value):
+    """Return a copy of an array, or the value itself if it is immutable."""
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    return value
 
 
 def infiltration(time, dt, ppt, k0, cd, m, statics):
@@ -65,29 +213,20 @@ def infiltration(time, dt, ppt, k0, cd, m, statics):
 
         statics.pond = 1
 
+    exp_cd_m = math.exp(cd * m)
     if statics.lamb == 0:
-        fact = 1
         icd = statics.i_end + cd
-        for j in range(1, 11):
-            fact = fact * j
-            add = (icd * m) ** j / (j * fact)
-            statics.lamb = statics.lamb + add
-        statics.lamb = math.log(icd) - (math.log(icd) + statics.lamb) / math.exp(cd * m)
+        statics.lamb = math.log(icd) - (math.log(icd) + exponential_series(icd * m)) / exp_cd_m
 
         statics.ponding = 1
 
     statics.i_end = statics.i_end + ppt * (t - statics.tp) / 2.0
     for i in range(0, 21):
         icd = statics.i_end + cd
-        add = 0
-        fact = 1
-        for j in range(1, 11):
-            fact = fact * j
-            add_0 = math.pow((icd * m), j) / (j * fact)
-            add = add + add_0
-        f1 = -(math.log(icd) - (math.log(icd) + add) / math.exp(cd * m) - statics.lamb) / (k0 * m) - (
+        add = exponential_series(icd * m)
+        f1 = -(math.log(icd) - (math.log(icd) + add) / exp_cd_m - statics.lamb) / (k0 * m) - (
                     t - statics.tp)
-        f2 = (np.exp(statics.i_end * m) - 1) / (icd * k0 * m)
+        f2 = (math.exp(statics.i_end * m) - 1) / (icd * k0 * m)
         df = -f1 / f2
         statics.i_end = statics.i_end + df
         if abs(df) <= 0.000001:
@@ -105,9 +244,181 @@ def infiltration(time, dt, ppt, k0, cd, m, statics):
         statics.pond = 0
     return didt
 
+def exponential_series(x):
+    """Return the series sum(x**j / (j * j!)) for j = 1 to 10, the series of
+    the exponential integral Ei(x) - euler_gamma - log(x) truncated after 10
+    terms, evaluated with Horner's method.
+
+    :param x: Value, or array of values
+    :type x: float or numpy.ndarray
+    :rtype: float or numpy.ndarray
+    """
+    total = SERIES_COEFFICIENTS[-1] * x
+    for coefficient in SERIES_COEFFICIENTS[-2::-1]:
+        total = (total + coefficient) * x
+
+    return total
+
+
 def static_reset(statics):
-    statics.cumi = 0
-    statics.lamb = 0
-    statics.tp = 0
-    statics.i_end = 0
-    statics.pond = 0
\ No newline at end of file
+    statics.reset()
+
+
+def infiltration_zones(time, dt, ppt, k_dist, ak_zones, cd, m, statics):
+    """Calculate the infiltration over the hydraulic conductivity zones, each
+    zone with its own ponding state.
+
+    If the zone with the slowest hydraulic conductivity, the first zone,
+    infiltrates all the precipitation, then everything infiltrates,
+    otherwise the infiltration is the area weighted infiltration of all
+    zones.
+
+    :param k_dist: Hydraulic conductivity of each zone
+    :type k_dist: numpy.ndarray
+    :param ak_zones: Area fraction of each zone
+    :type ak_zones: numpy.ndarray
+    :param statics: Ponding state of each zone
+    :type statics: InfiltrationState
+    :return zone_infiltration: Infiltration
+    :rtype: float
+    """
+    zone_infiltration = 0.0
+    for k in range(len(k_dist)):
+        infiltrate = infiltration(time, dt, ppt, k_dist[k], cd, m, statics[k])
+        if k == 0:
+            infiltrate_slowest = infiltrate
+        zone_infiltration = zone_infiltration + infiltrate * ak_zones[k]
+    if infiltrate_slowest >= ppt:
+        zone_infiltration = ppt
+
+    return zone_infiltration
+
+
+def infiltration_zones_vectorized(time, dt, ppt, k_dist, ak_zones, cd, m, statics):
+    """Calculate the infiltration over the hydraulic conductivity zones with
+    array operations over all zones, and all members of a batch, at once,
+    same as infiltration_zones.
+
+    :param k_dist: Hydraulic conductivity of each zone, zones on the last
+                   axis, num_members x num_zones for a batch
+    :type k_dist: numpy.ndarray
+    :param ak_zones: Area fraction of each zone
+    :type ak_zones: numpy.ndarray
+    :param m: Scaling factor, or of each member as num_members x 1 for a
+              batch
+    :type m: float or numpy.ndarray
+    :param statics: Ponding state with the shape of k_dist
+    :type statics: InfiltrationState
+    :return zone_infiltration: Infiltration, of each member for a batch
+    :rtype: float or numpy.ndarray
+    """
+    infiltrate = infiltration_vectorized(time, dt, ppt, k_dist, cd, m, statics)
+    zone_infiltration = np.where(infiltrate[..., 0] >= ppt, ppt, infiltrate @ ak_zones)
+
+    return zone_infiltration
+
+
+def infiltration_vectorized(time, dt, ppt, k0, cd, m, statics):
+    """Calculate infiltration of each element of the ponding state with array
+    operations, same as infiltration for each element with its own ponding
+    values. The bisection and Newton iterations of all elements are done in
+    lock-step, elements that converged are not updated anymore.
+
+    :param k0: Hydraulic conductivity, broadcast to the shape of statics
+    :type k0: numpy.ndarray
+    :param m: Scaling factor, broadcast to the shape of statics
+    :type m: float or numpy.ndarray
+    :param statics: Ponding state, updated in place
+    :type statics: InfiltrationState
+    :return didt: Infiltration of each element
+    :rtype: numpy.ndarray
+    """
+    t = time
+    didt = np.zeros(statics.values.shape[1:])
+    if ppt <= 0:
+        # no rain.
+        statics.reset()
+        return didt
+
+    cumi, i_end, lamb, tp, pond = statics.values
+    k0m = k0 * m
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        rising = pond == 0
+        ponding = ~rising
+        if rising.any():
+            f1 = np.where(cumi > 0, cumi, 0.0)
+            nf = -k0m * (cd + f1) / (1 - np.exp(f1 * m))
+            start = rising & (cumi > 0) & (nf < ppt)
+            if start.any():
+                np.copyto(i_end, cumi, where=start)
+                np.copyto(tp, t - dt, where=start)
+                np.copyto(pond, 1, where=start)
+                np.copyto(lamb, 0, where=start)
+
+            f2 = cumi + ppt * dt
+            nf = (-k0m * (cd + f2)) / (1 - np.exp(f2 * m))
+            free = rising & ((f2 == 0.0) | (nf > ppt))
+            np.copyto(didt, ppt, where=free)
+            np.copyto(cumi, f2, where=free)
+            rising = rising & ~free
+
+            if rising.any():
+                np.copyto(i_end, cumi + nf * dt, where=rising)
+                active = rising
+                for i in range(0, 21):
+                    nf = -k0m * (cd + i_end) / (1 - np.exp(i_end * m))
+                    above = nf > ppt
+                    i_end_new = np.where(above, (i_end + f2) / 2.0, (i_end + f1) / 2.0)
+                    f1 = np.where(active & above, i_end, f1)
+                    f2 = np.where(active & ~above, i_end, f2)
+                    df = i_end_new - i_end
+                    np.copyto(i_end, i_end_new, where=active)
+                    active = active & (np.abs(df) > 0.00001)
+                    if not active.any():
+                        break
+                    if i == 20:
+                        print("Warning: max iter exceeded at {}".format(t))
+
+                np.copyto(tp, t - dt + (i_end - cumi) / ppt, where=rising)
+                late = rising & (tp > t)
+                np.copyto(didt, ppt, where=late)
+                np.copyto(cumi, cumi + ppt, where=late)
+                rising = rising & ~late
+                np.copyto(pond, 1, where=rising)
+                ponding = ponding | rising
+
+        if ponding.any():
+            exp_cd_m = np.exp(cd * m)
+            new = ponding & (lamb == 0)
+            if new.any():
+                icd = i_end + cd
+                log_icd = np.log(icd)
+                np.copyto(lamb, log_icd - (log_icd + exponential_series(icd * m)) / exp_cd_m, where=new)
+
+            np.copyto(i_end, i_end + ppt * (t - tp) / 2.0, where=ponding)
+            active = ponding
+            for i in range(0, 21):
+                icd = i_end + cd
+                log_icd = np.log(icd)
+                f1 = -(log_icd - (log_icd + exponential_series(icd * m)) / exp_cd_m - lamb) / k0m - (t - tp)
+                f2 = (np.exp(i_end * m) - 1) / (icd * k0m)
+                df = -f1 / f2
+                np.copyto(i_end, i_end + df, where=active)
+                active = active & (np.abs(df) > 0.000001)
+                if not active.any():
+                    break
+
+            filled = ponding & (i_end < cumi + ppt)
+            np.copyto(didt, i_end - cumi, where=filled)
+            np.copyto(cumi, i_end, where=filled)
+            np.copyto(i_end, i_end / dt, where=filled)
+            np.copyto(pond, 1, where=filled)
+
+            full = ponding & ~filled
+            np.copyto(didt, ppt * dt, where=full)
+            np.copyto(cumi, cumi + ppt * dt, where=full)
+            np.copyto(pond, 0, where=full)
+
+    return didt
+
@@ -0,0 +1,586 @@
+"""Compiled Topmodel kernel.
+
+Pure function version of the timestep and twi increments loops of
+Topmodel.run that operates on plain arrays so that it can be compiled with
+`Numba`_. The model parameters, the dynamic model state and the output
+series are each packed into arrays, and the positions of the values in
+those arrays are given by the module level indices below.
+
+Numba is an optional dependency, install with::
+
+    $ pip install numba
+
+If Numba is not installed, the functions in this module remain plain
+Python functions and Topmodel falls back to the python engine.
+
+.. _Numba: https://numba.pydata.org/
+"""
+
+import math
+import numpy as np
+
+from .infiltration import SERIES_COEFFICIENTS
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+NUMBA_AVAILABLE = numba is not None
+
+
+def jit(func):
+    """Compile a function with Numba in nopython mode if Numba is
+    installed, otherwise return the function unchanged."""
+    if NUMBA_AVAILABLE:
+        return numba.njit(func)
+    return func
+
+
+# Indices of the parameters array
+SCALING_PARAMETER = 0
+TWI_MEAN = 1
+TWI_ADJ = 2
+ROOT_ZONE_STORAGE_MAX = 3
+GRAVITY_DRAINED_POROSITY = 4
+SOIL_DEPTH_ROOTS = 5
+MACROPORE_FRACTION = 6
+VERTICAL_DRAINAGE_FLUX_INITIAL = 7
+FLOW_SUBSURFACE_MAX = 8
+OPTION_KARST = 9
+GROW_TRIGGER = 10
+ET_EXP_GROW = 11
+ET_EXP_DORM = 12
+IMPERVIOUS_AREA_FRACTION = 13
+EFF_IMP = 14
+PERCENT_RIPARIAN = 15
+LAKE_FRACTION = 16
+LAKE_DELAY = 17
+MAX_STORAGE = 18
+CAPILLARY_DRIVE = 19
+SCALING_FACTOR = 20
+DT = 21
+NUM_PARAMETERS = 22
+
+# Indices of the state array
+SATURATION_DEFICIT_AVG = 0
+MOISTURE_CONDITIONS = 1
+RIPARIAN_STORAGE = 2
+TIMESTEP = 3
+NUM_STATES = 4
+
+# Indices of the ponding array of each hydraulic conductivity zone
+# Note: same order as infiltration.FIELDS
+INFILTRATION_CUMI = 0
+INFILTRATION_I_END = 1
+INFILTRATION_LAMB = 2
+INFILTRATION_TP = 3
+INFILTRATION_POND = 4
+
+# Indices of the series array, each series is of length num_timesteps
+# Note: same order as topmodel.SERIES
+FLOW_PREDICTED = 0
+FLOW_PREDICTED_IMPERVIOUS = 1
+SATURATION_DEFICIT_AVGS = 2
+EVAPORATION_ACTUAL = 3
+ROOT_ZONE_AVG = 4
+RETURN_FLOW_TOTALS = 5
+OVERLAND_FLOW = 6
+INFILTRATION_ARRAY = 7
+INFILTRATION_EXCESS = 8
+PEX_FLOW = 9
+SUB_FLOW = 10
+KARST_FLOW = 11
+Q_ROOT = 12
+PRECIP_FOR_EVAPORATION = 13
+NUM_SERIES = 14
+
+
+@jit
+def exponential_series(x):
+    """Return the series of the exponential integral truncated after 10
+    terms, same as infiltration.exponential_series."""
+    total = SERIES_COEFFICIENTS[-1] * x
+    for j in range(len(SERIES_COEFFICIENTS) - 2, -1, -1):
+        total = (total + SERIES_COEFFICIENTS[j]) * x
+
+    return total
+
+
+@jit
+def infiltration(time, dt, ppt, k0, cd, m, ponding, k):
+    """Calculate infiltration using the ponding values of zone k of the
+    ponding array, same as infiltration.infiltration."""
+    f1 = 0.0
+    t = time
+    if ppt <= 0:
+        ponding[:, k] = 0.0
+        return 0.0
+
+    if ponding[INFILTRATION_POND, k] == 0:
+        if ponding[INFILTRATION_CUMI, k] > 0:
+            f1 = ponding[INFILTRATION_CUMI, k]
+            nf = -k0 * m * (cd + f1) / (1 - math.exp(f1 * m))
+            if nf < ppt:
+                ponding[INFILTRATION_I_END, k] = ponding[INFILTRATION_CUMI, k]
+                ponding[INFILTRATION_TP, k] = t - dt
+                ponding[INFILTRATION_POND, k] = 1
+                ponding[INFILTRATION_LAMB, k] = 0
+        f2 = ponding[INFILTRATION_CUMI, k] + ppt * dt
+        nf = (-k0 * m * (cd + f2)) / (1 - math.exp(f2 * m))
+        if f2 == 0.0 or nf > ppt:
+            didt = ppt
+            ponding[INFILTRATION_CUMI, k] = ponding[INFILTRATION_CUMI, k] + didt * dt
+            return didt
+
+        ponding[INFILTRATION_I_END, k] = ponding[INFILTRATION_CUMI, k] + nf * dt
+        for i in range(0, 21):
+            i_end = ponding[INFILTRATION_I_END, k]
+            nf = -k0 * m * (cd + i_end) / (1 - math.exp(i_end * m))
+            if nf > ppt:
+                f1 = i_end
+                ponding[INFILTRATION_I_END, k] = (i_end + f2) / 2.0
+                df = ponding[INFILTRATION_I_END, k] - f1
+            else:
+                f2 = i_end
+                ponding[INFILTRATION_I_END, k] = (i_end + f1) / 2.0
+                df = ponding[INFILTRATION_I_END, k] - f2
+            if abs(df) <= 0.00001:
+                break
+            if i == 20:
+                print("Warning: max iter exceeded at", t)
+
+        ponding[INFILTRATION_TP, k] = (
+            t - dt + (ponding[INFILTRATION_I_END, k] - ponding[INFILTRATION_CUMI, k]) / ppt
+        )
+        if ponding[INFILTRATION_TP, k] > t:
+            didt = ppt
+            ponding[INFILTRATION_CUMI, k] = ponding[INFILTRATION_CUMI, k] + didt
+            return didt
+
+        ponding[INFILTRATION_POND, k] = 1
+
+    exp_cd_m = math.exp(cd * m)
+    if ponding[INFILTRATION_LAMB, k] == 0:
+        icd = ponding[INFILTRATION_I_END, k] + cd
+        ponding[INFILTRATION_LAMB, k] = (
+            math.log(icd) - (math.log(icd) + exponential_series(icd * m)) / exp_cd_m
+        )
+
+    ponding[INFILTRATION_I_END, k] = (
+        ponding[INFILTRATION_I_END, k] + ppt * (t - ponding[INFILTRATION_TP, k]) / 2.0
+    )
+    for i in range(0, 21):
+        i_end = ponding[INFILTRATION_I_END, k]
+        icd = i_end + cd
+        add = exponential_series(icd * m)
+        f1 = -(math.log(icd) - (math.log(icd) + add) / exp_cd_m
+               - ponding[INFILTRATION_LAMB, k]) / (k0 * m) - (t - ponding[INFILTRATION_TP, k])
+        f2 = (math.exp(i_end * m) - 1) / (icd * k0 * m)
+        df = -f1 / f2
+        ponding[INFILTRATION_I_END, k] = i_end + df
+        if abs(df) <= 0.000001:
+            break
+
+    if ponding[INFILTRATION_I_END, k] < ponding[INFILTRATION_CUMI, k] + ppt:
+        didt = ponding[INFILTRATION_I_END, k] - ponding[INFILTRATION_CUMI, k]
+        ponding[INFILTRATION_CUMI, k] = ponding[INFILTRATION_I_END, k]
+        ponding[INFILTRATION_I_END, k] = ponding[INFILTRATION_I_END, k] / dt
+        ponding[INFILTRATION_POND, k] = 1
+    else:
+        didt = ppt * dt
+        ponding[INFILTRATION_CUMI, k] = ponding[INFILTRATION_CUMI, k] + didt
+        ponding[INFILTRATION_POND, k] = 0
+
+    return didt
+
+
+@jit
+def infiltration_zones(time, dt, ppt, k_dist, ak_zones, cd, m, ponding):
+    """Calculate the infiltration over the hydraulic conductivity zones, each
+    zone with its own ponding values, same as infiltration.infiltration_zones.
+
+    :param ponding: Ponding values of each zone, see ponding indices,
+                    len(infiltration.FIELDS) x num_zones
+    :type ponding: numpy.ndarray
+    """
+    zone_infiltration = 0.0
+    infiltrate_slowest = 0.0
+    for k in range(k_dist.shape[0]):
+        infiltrate = infiltration(time, dt, ppt, k_dist[k], cd, m, ponding, k)
+        if k == 0:
+            infiltrate_slowest = infiltrate
+        zone_infiltration = zone_infiltration + infiltrate * ak_zones[k]
+    if infiltrate_slowest >= ppt:
+        zone_infiltration = ppt
+
+    return zone_infiltration
+
+
+@jit
+def infiltration_series(parameters, k_dist, ak_zones, precip_available, timestep_start, ponding):
+    """Calculate the infiltration of each timestep of precip_available, in
+    millimeters, starting at timestep timestep_start, same as the
+    infiltration of Topmodel._add_infiltration. The ponding array is
+    updated in place and holds the ponding values at the end of the last
+    timestep.
+
+    :param parameters: Model parameters, see parameter indices
+    :type parameters: numpy.ndarray
+    :param precip_available: Precipitation minus pet of each timestep
+    :type precip_available: numpy.ndarray
+    :param timestep_start: Timestep of the first value of precip_available
+    :type timestep_start: int
+    :param ponding: Ponding values of each zone, see ponding indices
+    :type ponding: numpy.ndarray
+    :return infiltration_array: Infiltration of each timestep
+    :rtype: numpy.ndarray
+    """
+    dt = parameters[DT]
+    capillary_drive = parameters[CAPILLARY_DRIVE]
+    scaling_factor = parameters[SCALING_FACTOR]
+    infiltration_array = np.zeros(precip_available.shape[0])
+    for i in range(precip_available.shape[0]):
+        if precip_available[i] <= 0:
+            ponding[:, :] = 0.0
+        else:
+            infiltration_array[i] = 1000 * infiltration_zones(
+                timestep_start + i + 1, dt, precip_available[i] / 1000, k_dist, ak_zones,
+                capillary_drive, scaling_factor, ponding
+            )
+
+    return infiltration_array
+
+
+@jit
+def record_row(i, stride, offset):
+    """Return the row of a recorded matrix for timestep i, or -1 if timestep
+    i is not recorded."""
+    if stride == 0 or i < offset or (i - offset) % stride != 0:
+        return -1
+    return (i - offset) // stride
+
+
+@jit
+def run(parameters,
+        twi_values,
+        twi_saturated_areas,
+        precip_available,
+        precip,
+        temperatures,
+        pet_hamon,
+        precip_for_recharge,
+        infiltration_array,
+        infiltration_excess,
+        flow_predicted_impervious,
+        state,
+        moisture_conditions,
+        root_zone_storage,
+        unsaturated_zone_storage,
+        saturation_deficit_local,
+        evaporation,
+        series,
+        record_strides,
+        record_offsets,
+        unsaturated_zone_storages,
+        root_zone_storages,
+        saturation_deficit_locals,
+        evaporations,
+        precip_excesses_op):
+    """Calculate water fluxes and flow prediction for all timesteps.
+
+    Same calculations as the timestep and twi increments loops of
+    Topmodel.run, with the infiltration and impervious area flow of each
+    timestep calculated before, see Topmodel._add_infiltration. The state
+    array and the root zone and unsaturated zone storage arrays are updated
+    in place and hold the model state at the end of the last timestep, the
+    local saturation deficit and evaporation arrays hold the values of the
+    last timestep. The series array is filled in place.
+
+    The recorded matrices, in the order of topmodel.MATRICES, are filled in
+    place every record stride timesteps starting at the record offset.
+    Matrices with a record stride of 0 are not recorded.
+
+    :param parameters: Model parameters, see parameter indices
+    :type parameters: numpy.ndarray
+    :param twi_values: Twi value of each twi increment
+    :type twi_values: numpy.ndarray
+    :param twi_saturated_areas: Area proportion of each twi increment
+    :type twi_saturated_areas: numpy.ndarray
+    :param precip_available: Precipitation minus pet of each timestep
+    :type precip_available: numpy.ndarray
+    :param precip: Precipitation of each timestep
+    :type precip: numpy.ndarray
+    :param temperatures: Temperature of each timestep
+    :type temperatures: numpy.ndarray
+    :param pet_hamon: Potential evapotranspiration of each timestep
+    :type pet_hamon: numpy.ndarray
+    :param precip_for_recharge: Precipitation that infiltrates, of each
+                                timestep
+    :type precip_for_recharge: numpy.ndarray
+    :param infiltration_array: Infiltration of each timestep
+    :type infiltration_array: numpy.ndarray
+    :param infiltration_excess: Infiltration excess of each timestep
+    :type infiltration_excess: numpy.ndarray
+    :param flow_predicted_impervious: Impervious area flow of each timestep
+    :type flow_predicted_impervious: numpy.ndarray
+    :param state: Model state, see state indices
+    :type state: numpy.ndarray
+    :param moisture_conditions: Antecedent moisture conditions before each
+                                timestep and after the last timestep, see
+                                hydrocalcs.antecedent_moisture
+    :type moisture_conditions: numpy.ndarray
+    :param root_zone_storage: Root zone storage of each twi increment
+    :type root_zone_storage: numpy.ndarray
+    :param unsaturated_zone_storage: Unsaturated zone storage of each twi
+                                     increment
+    :type unsaturated_zone_storage: numpy.ndarray
+    :param series: Output series, see series indices
+    :type series: numpy.ndarray
+    :param record_strides: Record stride of each matrix
+    :type record_strides: numpy.ndarray
+    :param record_offsets: Record offset of each matrix
+    :type record_offsets: numpy.ndarray
+    """
+    num_timesteps = precip_available.shape[0]
+    num_twi_increments = twi_values.shape[0]
+
+    scaling_parameter = parameters[SCALING_PARAMETER]
+    twi_offset = parameters[TWI_MEAN] * parameters[TWI_ADJ]
+    root_zone_storage_max = parameters[ROOT_ZONE_STORAGE_MAX]
+    water_table_depth = parameters[SOIL_DEPTH_ROOTS]
+    gravity_drained_porosity = parameters[GRAVITY_DRAINED_POROSITY]
+    macropore_fraction = parameters[MACROPORE_FRACTION]
+    vertical_drainage_flux_initial = parameters[VERTICAL_DRAINAGE_FLUX_INITIAL]
+    flow_subsurface_max = parameters[FLOW_SUBSURFACE_MAX]
+    option_karst = parameters[OPTION_KARST] != 0
+    grow_trigger = parameters[GROW_TRIGGER]
+    impervious_fraction = (
+        parameters[IMPERVIOUS_AREA_FRACTION] * parameters[EFF_IMP]
+    )
+    percent_riparian = parameters[PERCENT_RIPARIAN]
+    lake_fraction = parameters[LAKE_FRACTION]
+
+    precip_excesses = np.zeros(num_twi_increments)
+
+    for i in range(num_timesteps):
+        sat_flow = 0.0
+        qroot = 0.0
+        return_flow = 0.0
+        flow_predicted_overland = 0.0
+        flow_predicted_vertical_drainage_flux = 0.0
+        flow_predicted_karst = 0.0
+        transpiration = 0.0
+        precip_for_evaporation = 0.0
+
+        # Precipitation
+        # =============
+        if precip_available[i] <= 0:
+            precip_for_evaporation = -1 * precip_available[i]
+            if temperatures[i] <= 0:
+                precip_for_evaporation = 0.0
+
+        if temperatures[i] > grow_trigger:
+            et_exponent = parameters[ET_EXP_GROW]
+        else:
+            et_exponent = parameters[ET_EXP_DORM]
+
+        saturation_deficit_avg = state[SATURATION_DEFICIT_AVG]
+
+        # Twi increments
+        # ==============
+        for j in range(num_twi_increments):
+            area = twi_saturated_areas[j]
+            precip_excesses[j] = 0.0
+
+            sdl = saturation_deficit_avg + scaling_parameter * (twi_offset - twi_values[j])
+            soil_root_deficit = (root_zone_storage_max - root_zone_storage[j]) * area
+            saturation_excess = (gravity_drained_porosity * water_table_depth - sdl) * area
+
+            if saturation_excess > 0:
+                if saturation_excess < soil_root_deficit:
+                    qroot = qroot + saturation_excess
+                elif root_zone_storage[j] == root_zone_storage_max:
+                    qroot = qroot + soil_root_deficit
+
+            if sdl < 0:
+                return_flow = return_flow - sdl * area
+                sdl = 0.0
+
+            if unsaturated_zone_storage[j] > sdl:
+                root_zone_storage[j] = root_zone_storage[j] + (unsaturated_zone_storage[j] - sdl)
+                unsaturated_zone_storage[j] = sdl
+
+            if precip_for_recharge[i] > 0:
+                precip_excess = (
+                    precip_for_recharge[i]
+                    - (sdl - unsaturated_zone_storage[j])
+                    - (root_zone_storage_max - root_zone_storage[j])
+                )
+                precip_excesses[j] = precip_excess
+                if precip_excess < 0:
+                    precip_excess = 0.0
+
+                if not abs(precip_excess - precip_for_recharge[i]) <= 1E-20:
+                    root_zone_storage[j] = (
+                        root_zone_storage[j]
+                        + (1.0 - macropore_fraction) * (precip_for_recharge[i] - precip_excess)
+                    )
+                    unsaturated_zone_storage[j] = (
+                        unsaturated_zone_storage[j]
+                        + macropore_fraction * (precip_for_recharge[i] - precip_excess)
+                    )
+                    if root_zone_storage[j] > root_zone_storage_max:
+                        unsaturated_zone_storage[j] = (
+                            unsaturated_zone_storage[j]
+                            + (root_zone_storage[j] - root_zone_storage_max)
+                        )
+                        root_zone_storage[j] = root_zone_storage_max
+                    elif unsaturated_zone_storage[j] > sdl:
+                        root_zone_storage[j] = (
+                            root_zone_storage[j] + (unsaturated_zone_storage[j] - sdl)
+                        )
+                        unsaturated_zone_storage[j] = sdl
+
+                    if root_zone_storage[j] > root_zone_storage_max:
+                        precip_excesses[j] = (root_zone_storage[j] - root_zone_storage_max) * area
+                        root_zone_storage[j] = root_zone_storage_max
+
+                sat_flow = precip_excesses[j] + sat_flow
+
+            if sdl > 0:
+                vertical_drainage_flux = (
+                    vertical_drainage_flux_initial * (unsaturated_zone_storage[j] / sdl)
+                )
+                if vertical_drainage_flux > unsaturated_zone_storage[j]:
+                    vertical_drainage_flux = unsaturated_zone_storage[j]
+                unsaturated_zone_storage[j] = unsaturated_zone_storage[j] - vertical_drainage_flux
+                flow_predicted_vertical_drainage_flux = (
+                    flow_predicted_vertical_drainage_flux + vertical_drainage_flux * area
+                )
+
+            if precip_for_evaporation > 0:
+                evaporation[j] = (
+                    precip_for_evaporation
+                    * (root_zone_storage[j] / root_zone_storage_max)**et_exponent
+                )
+                if evaporation[j] > root_zone_storage[j]:
+                    evaporation[j] = root_zone_storage[j]
+                transpiration = transpiration + evaporation[j] * area
+                root_zone_storage[j] = root_zone_storage[j] - evaporation[j]
+            else:
+                evaporation[j] = 0.0
+
+            if precip_excesses[j] > 0:
+                flow_predicted_overland = flow_predicted_overland + precip_excesses[j] * area
+
+            saturation_deficit_local[j] = sdl
+
+        # Saving variables of interest
+        # ============================
+        row = record_row(i, record_strides[0], record_offsets[0])
+        if row >= 0:
+            unsaturated_zone_storages[row] = unsaturated_zone_storage
+        row = record_row(i, record_strides[1], record_offsets[1])
+        if row >= 0:
+            root_zone_storages[row] = root_zone_storage
+        row = record_row(i, record_strides[2], record_offsets[2])
+        if row >= 0:
+            saturation_deficit_locals[row] = saturation_deficit_local
+        row = record_row(i, record_strides[3], record_offsets[3])
+        if row >= 0:
+            evaporations[row] = evaporation
+        row = record_row(i, record_strides[4], record_offsets[4])
+        if row >= 0:
+            precip_excesses_op[row] = precip_excesses * twi_saturated_areas
+
+        series[RETURN_FLOW_TOTALS, i] = return_flow
+        series[PEX_FLOW, i] = flow_predicted_overland
+        flow_predicted_overland = flow_predicted_overland + infiltration_excess[i]
+
+        # Subsurface flow (base flow)
+        # ===========================
+        subsurface_flow_rate_ratio = saturation_deficit_avg / scaling_parameter
+        if subsurface_flow_rate_ratio > 100:
+            flow_predicted_subsurface = 0.0
+        else:
+            flow_predicted_subsurface = (
+                flow_subsurface_max * math.exp(-1 * subsurface_flow_rate_ratio)
+            )
+
+        if option_karst:
+            flow_predicted_karst = flow_predicted_subsurface
+            flow_predicted_subsurface = 0.0
+
+        saturation_deficit_avg = (
+            saturation_deficit_avg
+            - flow_predicted_vertical_drainage_flux
+            + flow_predicted_subsurface
+            + return_flow
+            + qroot
+        )
+        if saturation_deficit_avg < 0:
+            saturation_deficit_avg = 0.0
+        state[SATURATION_DEFICIT_AVG] = saturation_deficit_avg
+
+        # Impervious area flow
+        # ====================
+        flow_predicted_impervious_area = flow_predicted_impervious[i]
+        state[MOISTURE_CONDITIONS] = moisture_conditions[i + 1]
+
+        series[FLOW_PREDICTED_IMPERVIOUS, i] = flow_predicted_impervious_area
+        series[SUB_FLOW, i] = flow_predicted_subsurface
+        series[OVERLAND_FLOW, i] = flow_predicted_overland
+        series[KARST_FLOW, i] = flow_predicted_karst
+
+        # Total flow and channel routing
+        # ==============================
+        flow_predicted_total = (
+            flow_predicted_subsurface
+            + flow_predicted_overland
+            + return_flow
+            + flow_predicted_karst
+        )
+        flow_predicted_stream = (
+            flow_predicted_total * (1 - percent_riparian - impervious_fraction)
+            + flow_predicted_impervious_area * impervious_fraction
+        )
+        transpiration = transpiration * (1 - percent_riparian - impervious_fraction)
+        if flow_predicted_stream < 0:
+            flow_predicted_stream = 0.0
+
+        riparian_storage = (
+            state[RIPARIAN_STORAGE] - transpiration
+            + flow_predicted_stream * lake_fraction
+            + precip_available[i] * percent_riparian
+        )
+        if riparian_storage > 0:
+            q_riparian = riparian_storage / parameters[LAKE_DELAY]
+            riparian_storage = riparian_storage - q_riparian
+            if riparian_storage > parameters[MAX_STORAGE]:
+                q_riparian = q_riparian + riparian_storage - parameters[MAX_STORAGE]
+                riparian_storage = parameters[MAX_STORAGE]
+        else:
+            q_riparian = 0.0
+        state[RIPARIAN_STORAGE] = riparian_storage
+
+        flow_predicted_stream = flow_predicted_stream * (1 - lake_fraction) + q_riparian
+
+        # Saving variables of interest
+        # ============================
+        series[FLOW_PREDICTED, i] = flow_predicted_stream
+        series[ROOT_ZONE_AVG, i] = np.sum(root_zone_storage) / num_twi_increments
+        series[Q_ROOT, i] = qroot
+        series[SATURATION_DEFICIT_AVGS, i] = saturation_deficit_avg
+        series[INFILTRATION_ARRAY, i] = infiltration_array[i]
+        series[INFILTRATION_EXCESS, i] = infiltration_excess[i]
+        series[PRECIP_FOR_EVAPORATION, i] = precip_for_evaporation
+        if precip_available[i] > 0:
+            series[EVAPORATION_ACTUAL, i] = pet_hamon[i]
+        elif precip[i] > 0:
+            series[EVAPORATION_ACTUAL, i] = evaporation[0] + precip[i]
+        else:
+            series[EVAPORATION_ACTUAL, i] = evaporation[0]
+
+    state[TIMESTEP] = state[TIMESTEP] + num_timesteps
@@ -22,11 +22,13 @@ from pathlib import PurePath
 from waterpy import (hydrocalcs,
                      modelconfigfile,
                      parametersfile,
+                     statefile,
                      timeseriesfile,
                      twifile,
                      plots,
                      report)
-from waterpy.topmodel import Topmodel
+from waterpy.topmodel import MATRICES, Topmodel
+from waterpy.ensemble import TopmodelEnsemble
 
 
 def waterpy(configfile, options):
@@ -43,6 +45,8 @@ def waterpy(configfile, options):
     parameters, timeseries, twi, database = read_input_files(config_data)
     preprocessed_data = preprocess(config_data, parameters, timeseries, twi)
     topmodel_data = run_topmodel(config_data, parameters, timeseries, twi, preprocessed_data)
+    if options.verbose and topmodel_data["spin_up_cycles"]:
+        print("Spin-up cycles: {}".format(topmodel_data["spin_up_cycles"]))
     postprocess(config_data, timeseries, preprocessed_data, topmodel_data)
 
 
@@ -113,7 +117,7 @@ def preprocess(config_data, parameters, timeseries, twi):
         pet = timeseries["pet"].to_numpy() * timestep_daily_fraction
     else:
         pet = hydrocalcs.pet(
-            dates=timeseries.index.to_pydatetime(),
+            dates=timeseries.index,
             temperatures=timeseries["temperature"].to_numpy(),
             latitude=parameters["basin"]["latitude"]["value"],
             calib_coeff=parameters["land_type"]["pet_calib_coeff"]["value"],
@@ -178,8 +182,14 @@ def preprocess(config_data, parameters, timeseries, twi):
     return preprocessed_data
 
 
-def run_topmodel(config_data, parameters, timeseries, twi, preprocessed_data):
-    """Run Topmodel.
+def get_topmodel_arguments(config_data, parameters, timeseries, twi, preprocessed_data,
+                           realization=None):
+    """Get the keyword arguments used to initialize Topmodel.
+
+    The seed of the random selection of the rain distribution is the
+    random_seed option, or with a realization its child of that index, see
+    hydrocalcs.seed_sequences, so that each realization has its own
+    reproducible rain distribution, whichever process runs it.
 
     :param config_data: A ConfigParser object that behaves much like a dictionary.
     :type config_data: ConfigParser
@@ -190,11 +200,17 @@ def run_topmodel(config_data, parameters, timeseries, twi, preprocessed_data):
     :param preprocessed_data: A dict of the calculated variables from
                               preprocessing.
     :type: dict
-    :return topmodel_data: A dict of relevant data results from Topmodel
+    :param realization: Index of the realization of the rain distribution,
+                        None for the random_seed option itself
+    :type realization: int
+    :return topmodel_arguments: A dict of keyword arguments for Topmodel
     :rtype: dict
     """
-    # Initialize Topmodel
-    topmodel = Topmodel(
+    seed = config_data["Options"].getint("random_seed", fallback=10)
+    if realization is not None:
+        seed = hydrocalcs.seed_sequences(seed, realization + 1)[realization]
+
+    topmodel_arguments = dict(
         scaling_parameter=preprocessed_data["scaling_parameter_adjusted"],
         raw_scaling_parameter=parameters["basin"]["scaling_parameter"]["value"],
         saturated_hydraulic_conductivity=(
@@ -233,7 +249,75 @@ def run_topmodel(config_data, parameters, timeseries, twi, preprocessed_data):
         option_randomize_daily_to_hourly=config_data["Options"].getboolean("option_randomize_daily_to_hourly"),
         option_min_max=config_data["Options"].getboolean("option_max_min"),
         option_distribution=config_data["Options"].getboolean("option_distribution_record"),
-        option_forecast=config_data["Options"].getboolean("forecast")
+        option_forecast=config_data["Options"].getboolean("forecast"),
+        engine=config_data["Options"].get("option_engine", fallback="python"),
+        record=get_record(config_data),
+        initial_state=get_initial_state(config_data),
+        option_spin_up=config_data["Options"].getboolean("option_spin_up", fallback=False),
+        spin_up_tolerance=config_data["Options"].getfloat("spin_up_tolerance", fallback=0.01),
+        spin_up_max_cycles=config_data["Options"].getint("spin_up_max_cycles", fallback=20),
+        option_hourly_streaming=config_data["Options"].getboolean("option_hourly_streaming", fallback=False),
+        amc_window_days=config_data["Options"].getfloat("amc_window_days", fallback=5),
+        infiltration_cache_size=config_data["Options"].getint("infiltration_cache_size", fallback=256),
+        infiltration_cache_tolerance=config_data["Options"].getfloat("infiltration_cache_tolerance", fallback=0.01),
+        seed=seed,
+    )
+
+    return topmodel_arguments
+
+
+def get_record(config_data):
+    """Get the output matrices to record and their stride in timesteps.
+
+    Matrices are only recorded when option_write_output_matrices is True.
+
+    :param config_data: A ConfigParser object that behaves much like a dictionary.
+    :type config_data: ConfigParser
+    :return record: Dict of matrix names and record strides.
+    :rtype: dict
+    """
+    if not config_data["Options"].getboolean("option_write_output_matrices"):
+        return {}
+
+    stride = config_data["Options"].getint("option_output_matrices_stride", fallback=1)
+
+    return {name: stride for name in MATRICES}
+
+
+def get_initial_state(config_data):
+    """Get the initial model state from the state file, if any.
+
+    :param config_data: A ConfigParser object that behaves much like a dictionary.
+    :type config_data: ConfigParser
+    :return initial_state: A dict of the model state, or None to start from
+                           the initial soil zone storages
+    :rtype: dict
+    """
+    state_file = config_data["Inputs"].get("state_file", fallback="")
+    if not state_file:
+        return None
+
+    return statefile.read(state_file)
+
+
+def run_topmodel(config_data, parameters, timeseries, twi, preprocessed_data):
+    """Run Topmodel.
+
+    :param config_data: A ConfigParser object that behaves much like a dictionary.
+    :type config_data: ConfigParser
+    :param parameters: The parameters for the model.
+    :type parameters: Dict
+    :param twi: A dataframe of all the twi data.
+    :type twi: Pandas.DataFrame
+    :param preprocessed_data: A dict of the calculated variables from
+                              preprocessing.
+    :type: dict
+    :return topmodel_data: A dict of relevant data results from Topmodel
+    :rtype: dict
+    """
+    # Initialize Topmodel
+    topmodel = Topmodel(
+        **get_topmodel_arguments(config_data, parameters, timeseries, twi, preprocessed_data)
     )
 
     # Run Topmodel
@@ -259,12 +343,62 @@ def run_topmodel(config_data, parameters, timeseries, twi, preprocessed_data):
         "excesses": topmodel.precip_excesses_op,
         "sat_overland_flow": topmodel.pex_flow,
         "return_flow": topmodel.return_flow_totals,
-        "overland_flow": topmodel.overland_flow
+        "overland_flow": topmodel.overland_flow,
+        "output_strides": topmodel.get_output_strides(),
+        "state": topmodel.get_state(),
+        "spin_up_days": 365 if topmodel.drop_first else 0,
+        "spin_up_cycles": topmodel.spin_up_cycles,
     }
 
     return topmodel_data
 
 
+def run_topmodel_ensemble(config_data, parameters, timeseries, twi, preprocessed_data,
+                          member_parameters, realization=None):
+    """Run an ensemble of Topmodel parameter sets in one batched pass.
+
+    :param config_data: A ConfigParser object that behaves much like a dictionary.
+    :type config_data: ConfigParser
+    :param parameters: The parameters for the model.
+    :type parameters: Dict
+    :param twi: A dataframe of all the twi data.
+    :type twi: Pandas.DataFrame
+    :param preprocessed_data: A dict of the calculated variables from
+                              preprocessing.
+    :type: dict
+    :param member_parameters: A dict of Topmodel keyword arguments, such as
+                              scaling_parameter or et_exp_grow, to arrays of
+                              values with one value per member. These
+                              replace the values from the parameters files.
+    :type member_parameters: dict
+    :param realization: Index of the realization of the rain distribution
+                        shared by all members, see get_topmodel_arguments
+    :type realization: int
+    :return ensemble_data: A dict of relevant data results from the
+                           ensemble, each of size num_members x num_timesteps
+    :rtype: dict
+    """
+    topmodel_arguments = get_topmodel_arguments(
+        config_data, parameters, timeseries, twi, preprocessed_data, realization=realization
+    )
+    for name in ("engine", "record", "initial_state", "option_spin_up",
+                 "spin_up_tolerance", "spin_up_max_cycles", "option_hourly_streaming"):
+        topmodel_arguments.pop(name)
+    topmodel_arguments.update(member_parameters)
+
+    # Initialize and run the ensemble
+    ensemble = TopmodelEnsemble(**topmodel_arguments)
+    ensemble.run()
+
+    # Return a dict of relevant calculated values
+    ensemble_data = {
+        "flow_predicted": ensemble.flow_predicted,
+        "saturation_deficit_avgs": ensemble.saturation_deficit_avgs,
+    }
+
+    return ensemble_data
+
+
 def postprocess(config_data, timeseries, preprocessed_data, topmodel_data):
     """Postprocess data for output.
 
@@ -272,7 +406,7 @@ def postprocess(config_data, timeseries, preprocessed_data, topmodel_data):
     Plot timeseries
     """
     # Get output timeseries data
-    timeseries = timeseries[365:]
+    timeseries = timeseries[topmodel_data["spin_up_days"]:]
     output_df = get_output_dataframe(timeseries,
                                      preprocessed_data,
                                      topmodel_data)
@@ -291,6 +425,16 @@ def postprocess(config_data, timeseries, preprocessed_data, topmodel_data):
     if config_data["Options"].getboolean("option_write_output_matrices"):
         write_output_matrices_csv(config_data, timeseries, topmodel_data)
 
+    # Write model state at the end of the run
+    if config_data["Outputs"].get("output_filename_state", fallback=""):
+        statefile.write(
+            PurePath(
+                config_data["Outputs"]["output_dir"],
+                config_data["Outputs"]["output_filename_state"]
+            ),
+            topmodel_data["state"]
+        )
+
     # Plot output data
     plot_output_data(df=output_df,
                      comparison_data=output_comparison_data,
@@ -319,9 +463,9 @@ def get_output_dataframe(timeseries, preprocessed_data, topmodel_data):
         output_data["snow_water_equivalence"] = preprocessed_data["snow_water_equivalence"]
 
     if "pet" not in timeseries.columns:
-        output_data["pet"] = preprocessed_data["pet"][365:]
+        output_data["pet"] = preprocessed_data["pet"][topmodel_data["spin_up_days"]:]
     output_data["aet"] = topmodel_data["evaporation_actual"]
-    output_data["precip_minus_pet"] = preprocessed_data["precip_minus_pet"][365:]
+    output_data["precip_minus_pet"] = preprocessed_data["precip_minus_pet"][topmodel_data["spin_up_days"]:]
     output_data["infiltration"] = topmodel_data["infiltration"]
     output_data["infiltration_excess"] = topmodel_data["infiltration_excess"]
     output_data["q_root"] = topmodel_data["q_root"]
@@ -459,85 +603,52 @@ def write_output_csv(df, filename, minmax):
 def write_output_matrices_csv(config_data, timeseries, topmodel_data):
     """Write output matrices.
 
-    Matrices are of size: len(timeseries) x len(twi_bins)
+    Matrices are of size: len(timeseries) / stride x len(twi_bins)
 
-    The following are the matrices saved.
+    The following are the matrices saved, if recorded.
          saturation_deficit_locals
          unsaturated_zone_storages
          root_zone_storages
+         evaporations
+         excesses
     """
-    num_cols = topmodel_data["saturation_deficit_locals"].shape[1]
-    header = ["bin_{}".format(i) for i in range(1, num_cols+1)]
-
-    saturation_deficit_locals_df = (
-        pd.DataFrame(topmodel_data["saturation_deficit_locals"],
-                     index=timeseries.index)
-    )
-
-    unsaturated_zone_storages_df = (
-        pd.DataFrame(topmodel_data["unsaturated_zone_storages"],
-                     index=timeseries.index)
-    )
-
-    root_zone_storages_df = (
-        pd.DataFrame(topmodel_data["root_zone_storages"],
-                     index=timeseries.index)
-    )
-
-    evaporations_df = (
-        pd.DataFrame(topmodel_data["evaporations"],
-                     index=timeseries.index)
-    )
-
-    excesses_df = (
-        pd.DataFrame(topmodel_data["excesses"],
-                     index=timeseries.index)
-    )
-
-    saturation_deficit_locals_df.to_csv(
-        PurePath(
-            config_data["Outputs"]["output_dir"],
-            config_data["Outputs"]["output_filename_saturation_deficit_locals"]
-        ),
-        float_format="%.2f",
-        header=header,
-    )
-
-    unsaturated_zone_storages_df.to_csv(
-        PurePath(
-            config_data["Outputs"]["output_dir"],
-            config_data["Outputs"]["output_filename_unsaturated_zone_storages"]
-        ),
-        float_format="%.16f",
-        header=header,
-    )
+    matrices = [
+        ("saturation_deficit_locals", "saturation_deficit_locals",
+         "output_filename_saturation_deficit_locals", "%.2f"),
+        ("unsaturated_zone_storages", "unsaturated_zone_storages",
+         "output_filename_unsaturated_zone_storages", "%.16f"),
+        ("root_zone_storages", "root_zone_storages",
+         "output_filename_root_zone_storages", "%.16f"),
+        ("evaporations", "evaporations",
+         "output_filename_evaporations", "%.16f"),
+        ("excesses", "precip_excesses_op",
+         "output_filename_excesses", "%.16f"),
+    ]
+
+    for key, name, filename, float_format in matrices:
+        matrix = topmodel_data[key]
+        if matrix is None:
+            continue
+
+        stride = topmodel_data["output_strides"][name]
+        num_cols = matrix.shape[1]
+        header = ["bin_{}".format(i) for i in range(1, num_cols+1)]
+
+        matrix_df = (
+            pd.DataFrame(matrix,
+                         index=timeseries.index[::stride])
+        )
 
-    root_zone_storages_df.to_csv(
-        PurePath(
-            config_data["Outputs"]["output_dir"],
-            config_data["Outputs"]["output_filename_root_zone_storages"]
-        ),
-        float_format="%.16f",
-        header=header,
-    )
+        matrix_df.to_csv(
+            PurePath(
+                config_data["Outputs"]["output_dir"],
+                config_data["Outputs"][filename]
+            ),
+            float_format=float_format,
+            header=header,
+        )
 
-    evaporations_df.to_csv(
-        PurePath(
-            config_data["Outputs"]["output_dir"],
-            config_data["Outputs"]["output_filename_evaporations"]
-        ),
-        float_format="%.16f",
-        header=header,
-    )
 
-    excesses_df.to_csv(
-        PurePath(
-            config_data["Outputs"]["output_dir"],
-            config_data["Outputs"]["output_filename_excesses"]
-        ),
-        float_format="%.16f",
-        header=header,
-    )
 def plot_output_data(df, comparison_data, path, minmax):
     """Plot output timeseries."""
     for key, series in df.iteritems():
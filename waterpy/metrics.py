@@ -0,0 +1,208 @@
+"""Goodness of fit metrics of many modeled series against one observed series.
+
+The modeled series are the rows of a matrix of shape
+(num_members, num_timesteps), such as the flow_predicted of a
+TopmodelEnsemble, and all metrics of all members are calculated together with
+array operations instead of one hydrocalcs call per metric and member.
+Timesteps where the observed or the modeled value is missing (NaN) are left
+out of the metrics of that member.
+
+References:
+
+Nash, J. E. and Sutcliffe, J. V., 1970, River flow forecasting through
+conceptual models part I - A discussion of principles, Journal of Hydrology,
+10(3), 282-290.
+
+Gupta, H. V., Kling, H., Yilmaz, K. K. and Martinez, G. F., 2009,
+Decomposition of the mean squared error and NSE performance criteria:
+Implications for improving hydrological modelling, Journal of Hydrology,
+377(1-2), 80-91.
+
+Moriasi, D. N. et al., 2007, Model evaluation guidelines for systematic
+quantification of accuracy in watershed simulations, Transactions of the
+ASABE, 50(3), 885-900.
+
+:authors: 2019 by Alexander Headman, Jeremiah Lant, see AUTHORS
+:license: CC0 1.0, see LICENSE file for details
+"""
+
+import numpy as np
+
+
+METRICS = (
+    "nash_sutcliffe",
+    "log_nash_sutcliffe",
+    "kling_gupta",
+    "percent_bias",
+    "root_mean_squared_error",
+    "correlation",
+)
+
+
+def goodness_of_fit(observed, modeled, epsilon=None):
+    """Calculate the goodness of fit metrics of every modeled series, see
+    METRICS.
+
+    nash_sutcliffe      1 - sum((o - m)**2) / sum((o - mean(o))**2)
+    log_nash_sutcliffe  nash_sutcliffe of log(o + epsilon), log(m + epsilon)
+    kling_gupta         1 - sqrt((r - 1)**2 + (alpha - 1)**2 + (beta - 1)**2)
+                        where alpha = std(m) / std(o), beta = mean(m) / mean(o)
+    percent_bias        100 * sum(o - m) / sum(o), positive when the model
+                        underestimates, same sign as hydrocalcs.percent_error
+    root_mean_squared_error  sqrt(mean((o - m)**2))
+    correlation         Pearson correlation coefficient r of o and m
+
+    Metrics of members with fewer than two valid timesteps are NaN, and so
+    are the efficiencies and correlation of members without variance of the
+    observed values, or for kling_gupta and correlation of the modeled
+    values.
+
+    :param observed: Observed series of size num_timesteps
+    :type observed: numpy.ndarray
+    :param modeled: Modeled series of size num_timesteps, or a matrix of
+                    shape num_members x num_timesteps
+    :type modeled: numpy.ndarray
+    :param epsilon: Value added before taking logarithms of the
+                    log_nash_sutcliffe, by default 1% of the mean observed
+                    value so that zero flows can be used
+    :type epsilon: float
+    :return metrics: Dict of metric names to arrays of size num_members
+    :rtype: dict
+    """
+    observed = np.asarray(observed, dtype=float)
+    modeled = np.atleast_2d(np.asarray(modeled, dtype=float))
+    if modeled.shape[1] != observed.shape[0]:
+        raise ValueError(
+            "Incorrect modeled shape: {}\n"
+            "Modeled must have {} timesteps, the size of observed."
+            "".format(modeled.shape, observed.shape[0])
+        )
+
+    # Mask of the timesteps of each member with observed and modeled values
+    valid = np.isfinite(modeled) & np.isfinite(observed)
+    observed = np.where(valid, observed, 0)
+    modeled = np.where(valid, modeled, 0)
+
+    if epsilon is None:
+        epsilon = 0.01 * np.nanmean(np.where(valid, observed, np.nan))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        moments = _moments(observed, modeled, valid)
+        log_moments = _moments(
+            np.where(valid, np.log(observed + epsilon), 0),
+            np.where(valid, np.log(modeled + epsilon), 0),
+            valid,
+        )
+
+        correlation = moments["sum_products"] / np.sqrt(
+            moments["sum_squares_observed"] * moments["sum_squares_modeled"]
+        )
+        alpha = np.sqrt(moments["sum_squares_modeled"] / moments["sum_squares_observed"])
+        beta = moments["mean_modeled"] / moments["mean_observed"]
+
+        metrics = {
+            "nash_sutcliffe": _nash_sutcliffe(moments),
+            "log_nash_sutcliffe": _nash_sutcliffe(log_moments),
+            "kling_gupta": 1 - np.sqrt(
+                (correlation - 1)**2 + (alpha - 1)**2 + (beta - 1)**2
+            ),
+            "percent_bias": (
+                100 * moments["sum_error"] / (moments["mean_observed"] * moments["count"])
+            ),
+            "root_mean_squared_error": np.sqrt(
+                moments["sum_squared_error"] / moments["count"]
+            ),
+            "correlation": correlation,
+        }
+
+    # Not enough values to compare, or no variance to compare against
+    too_few = moments["count"] < 2
+    no_variance_observed = moments["sum_squares_observed"] == 0
+    no_variance = no_variance_observed | (moments["sum_squares_modeled"] == 0)
+    undefined = {
+        "nash_sutcliffe": no_variance_observed,
+        "log_nash_sutcliffe": log_moments["sum_squares_observed"] == 0,
+        "kling_gupta": no_variance,
+        "correlation": no_variance,
+    }
+    for name in METRICS:
+        metrics[name] = np.where(too_few | undefined.get(name, False), np.nan, metrics[name])
+
+    return metrics
+
+
+def _moments(observed, modeled, valid):
+    """Calculate the sums of each member needed by the metrics, with the
+    values of invalid timesteps set to 0."""
+    count = valid.sum(axis=1)
+    mean_observed = observed.sum(axis=1) / count
+    mean_modeled = modeled.sum(axis=1) / count
+
+    error = observed - modeled
+    deviation_observed = np.where(valid, observed - mean_observed[:, np.newaxis], 0)
+    deviation_modeled = np.where(valid, modeled - mean_modeled[:, np.newaxis], 0)
+
+    return {
+        "count": count,
+        "mean_observed": mean_observed,
+        "mean_modeled": mean_modeled,
+        "sum_error": error.sum(axis=1),
+        "sum_squared_error": np.einsum("ij,ij->i", error, error),
+        "sum_squares_observed": np.einsum("ij,ij->i", deviation_observed, deviation_observed),
+        "sum_squares_modeled": np.einsum("ij,ij->i", deviation_modeled, deviation_modeled),
+        "sum_products": np.einsum("ij,ij->i", deviation_observed, deviation_modeled),
+    }
+
+
+def _nash_sutcliffe(moments):
+    """Calculate the Nash-Sutcliffe efficiency from the moments, same as
+    hydrocalcs.nash_sutcliffe."""
+    return 1 - moments["sum_squared_error"] / moments["sum_squares_observed"]
+
+
+class NashSutcliffeBound:
+    """Class that represents an upper bound of the Nash-Sutcliffe efficiency
+    of a run while it is calculated.
+
+    The sum of squared errors only grows as modeled values are added, so the
+    final efficiency is at most 1 - sum_squared_error / sum_squares_observed
+    of the values added so far. Once that is not greater than the threshold,
+    for example the worst efficiency of a calibration population, the run
+    can be stopped, see Topmodel.run. Timesteps where the observed or the
+    modeled value is missing (NaN) are left out, same as goodness_of_fit.
+    """
+    def __init__(self, observed, threshold):
+        self.observed = np.asarray(observed, dtype=float)
+        valid = np.isfinite(self.observed)
+        self.sum_squares_observed = np.sum(
+            (self.observed[valid] - np.mean(self.observed[valid]))**2
+        )
+        self.threshold = threshold
+        self.sum_squared_error = 0.0
+
+    @property
+    def nash_sutcliffe_max(self):
+        """Upper bound of the final Nash-Sutcliffe efficiency."""
+        return 1 - self.sum_squared_error / self.sum_squares_observed
+
+    @property
+    def exceeded(self):
+        """True if the final efficiency can not exceed the threshold."""
+        return self.nash_sutcliffe_max <= self.threshold
+
+    def update(self, start, modeled):
+        """Add the squared errors of modeled values of the timesteps from
+        start.
+
+        :param start: Index of the observed value of the first modeled value
+        :type start: int
+        :param modeled: Modeled values
+        :type modeled: numpy.ndarray
+        :return: True while the final efficiency can exceed the threshold
+        :rtype: bool
+        """
+        modeled = np.asarray(modeled, dtype=float)
+        error = self.observed[start:start + len(modeled)] - modeled[:max(0, len(self.observed) - start)]
+        self.sum_squared_error += np.nansum(error**2)
+
+        return not self.exceeded
@@ -0,0 +1,165 @@
+"""Streaming quantile sketch of flow series.
+
+QuantileSketch counts the values of one or several series, such as ensemble
+members or basins, in logarithmically spaced buckets, so that the quantiles
+and flow duration curves of very long records or large ensembles can be
+built from chunks of values with memory that does not depend on the number
+of values. Each quantile is within a relative accuracy of the exact value,
+and sketches with the same buckets can be merged, for example the sketches
+of the chunks or the workers of a run.
+
+Reference:
+
+Masson, C., Rim, J. E. and Lee, H. K., 2019, DDSketch: A fast and fully
+mergeable quantile sketch with relative-error guarantees, Proceedings of the
+VLDB Endowment, 12(12), 2195-2205.
+
+:authors: 2019 by Alexander Headman, Jeremiah Lant, see AUTHORS
+:license: CC0 1.0, see LICENSE file for details
+"""
+
+import math
+import numpy as np
+
+
+class QuantileSketch:
+    """Class that represents mergeable streaming quantiles of one or several
+    series of values.
+
+    Bucket 0 counts the values less than or equal to 0, estimated as 0, and
+    bucket 1 the values in (0, min_value], estimated as min_value.
+    Bucket k > 1 counts the values in (min_value * gamma**(k - 2),
+    min_value * gamma**(k - 1)], where gamma = (1 + relative_accuracy) /
+    (1 - relative_accuracy), with the values greater than max_value in the
+    last bucket. NaN values are not counted. Values can be counted with a
+    weight, such as the likelihood of an ensemble member, and the quantiles
+    are then weighted quantiles.
+    """
+    def __init__(self,
+                 num_series=1,
+                 relative_accuracy=0.01,
+                 min_value=1.0e-6,
+                 max_value=1.0e6):
+
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(
+                "Incorrect relative accuracy: {}\n"
+                "Relative accuracy must be between 0 and 1."
+                "".format(relative_accuracy)
+            )
+        if not 0 < min_value < max_value:
+            raise ValueError(
+                "Incorrect value range: {} to {}\n"
+                "Minimum value must be positive and less than the maximum value."
+                "".format(min_value, max_value)
+            )
+
+        self.num_series = num_series
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.num_buckets = int(math.ceil(math.log(max_value / min_value, self.gamma))) + 2
+        self.counts = np.zeros((num_series, self.num_buckets))
+
+        # Estimated value of each bucket, within relative_accuracy of all
+        # values of the bucket
+        exponents = np.arange(self.num_buckets - 1)
+        self.bucket_values = np.concatenate((
+            [0.0],
+            min_value * 2 * self.gamma**exponents / (self.gamma + 1),
+        ))
+        self.bucket_values[1] = min_value
+
+    @property
+    def count(self):
+        """Number of values counted of each series, or total weight of the
+        values counted with weights."""
+        return self.counts.sum(axis=1)
+
+    def update(self, values, weights=None):
+        """Count a chunk of values of each series.
+
+        :param values: Values of shape num_series x num_values, or
+                       num_values when num_series is 1
+        :type values: numpy.ndarray
+        :param weights: Weights of the values, broadcast to the shape of
+                        values, 1 for each value by default
+        :type weights: float or numpy.ndarray
+        """
+        values = np.asarray(values, dtype=float).reshape(self.num_series, -1)
+        if weights is None:
+            weights = 1.0
+        weights = np.broadcast_to(np.asarray(weights, dtype=float), values.shape)
+
+        buckets = np.zeros(values.shape, dtype=np.int64)
+        positive = values > 0
+        buckets[positive] = 1 + np.ceil(
+            np.log(np.clip(values[positive], self.min_value, self.max_value) / self.min_value)
+            / math.log(self.gamma)
+        ).astype(np.int64)
+        np.minimum(buckets, self.num_buckets - 1, out=buckets)
+
+        # Count the buckets of all series in one call with an offset per series
+        series = np.broadcast_to(np.arange(self.num_series)[:, np.newaxis], values.shape)
+        counted = ~np.isnan(values)
+        self.counts += np.bincount(
+            (series[counted] * self.num_buckets + buckets[counted]),
+            weights=weights[counted],
+            minlength=self.num_series * self.num_buckets,
+        ).reshape(self.num_series, self.num_buckets)
+
+    def merge(self, other):
+        """Add the counts of another sketch with the same buckets and number
+        of series, such as the sketch of another chunk or worker.
+
+        :param other: Sketch to merge
+        :type other: QuantileSketch
+        """
+        if (other.num_series != self.num_series
+                or other.relative_accuracy != self.relative_accuracy
+                or other.min_value != self.min_value
+                or other.max_value != self.max_value):
+            raise ValueError(
+                "Incorrect sketch to merge.\n"
+                "Sketches must have the same number of series, relative "
+                "accuracy and value range."
+            )
+        self.counts += other.counts
+
+    def quantiles(self, quantiles):
+        """Estimate the quantiles of each series.
+
+        :param quantiles: Quantiles between 0 and 1
+        :type quantiles: numpy.ndarray
+        :return values: Values of shape num_series x num_quantiles, NaN for
+                        series without values
+        :rtype: numpy.ndarray
+        """
+        quantiles = np.atleast_1d(np.asarray(quantiles, dtype=float))
+        cumulative = np.cumsum(self.counts, axis=1)
+        count = cumulative[:, -1]
+
+        # Rank of each quantile, less than the count so that quantile 1 is
+        # the last bucket with values, and the first bucket with more values
+        # than the rank
+        ranks = np.minimum(
+            quantiles[np.newaxis, :] * count[:, np.newaxis],
+            np.nextafter(count, 0)[:, np.newaxis],
+        )
+        buckets = (cumulative[:, np.newaxis, :] <= ranks[:, :, np.newaxis]).sum(axis=2)
+        values = self.bucket_values[np.minimum(buckets, self.num_buckets - 1)]
+
+        return np.where(count[:, np.newaxis] > 0, values, np.nan)
+
+    def flow_duration(self, probabilities):
+        """Estimate the flows exceeded with the given exceedance
+        probabilities of each series, same as
+        hydrocalcs.flow_duration_quantiles.
+
+        :param probabilities: Exceedance probabilities, in percent
+        :type probabilities: numpy.ndarray
+        :return flows: Flows of shape num_series x num_probabilities
+        :rtype: numpy.ndarray
+        """
+        return self.quantiles(1 - np.asarray(probabilities, dtype=float) / 100)
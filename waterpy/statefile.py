@@ -0,0 +1,33 @@
+"""Module that contains functions to read and write a Topmodel state file.
+
+The state file holds the dynamic model state returned by Topmodel.get_state
+in the compressed numpy binary format (*.npz), one array per state variable.
+"""
+
+import numpy as np
+
+
+def read(filepath):
+    """Read state file.
+
+    :param filepath: File path to state file.
+    :type filepath: string
+    :return state: A dict of the model state, see topmodel.STATES
+    :rtype: dict
+    """
+    with np.load(filepath) as data:
+        state = {key: data[key] for key in data.files}
+
+    return state
+
+
+def write(filepath, state):
+    """Write state file.
+
+    :param filepath: File path to state file.
+    :type filepath: string
+    :param state: A dict of the model state, see topmodel.STATES
+    :type state: dict
+    """
+    with open(filepath, "wb") as f:
+        np.savez_compressed(f, **state)
@@ -27,13 +27,71 @@ http://dx.doi.org/10.3133/sir20155143
 """
 
 import math
+import warnings
 import numpy as np
 
 from . import hydrocalcs
 from . import infiltration
+from . import kernel
 from . import utils
 
 
+# Engines available to run Topmodel
+#   python: reference loop over each timestep and each twi increment
+#   vectorized: array operations over all twi increments at once
+#   jit: all timesteps and twi increments in one function compiled with
+#        Numba (optional dependency), see kernel module
+ENGINES = ("python", "vectorized", "jit")
+
+# Days calculated by each call of the compiled kernel when the run is
+# checked against an objective bound, see Topmodel.run
+BOUND_CHUNK_DAYS = 30
+
+# Values calculated each timestep and the output array of Topmodel.run
+# each is saved to, see Topmodel.step
+SERIES = {
+    "flow_predicted": "flow_predicted",
+    "flow_predicted_impervious": "flow_predicted_impervious",
+    "saturation_deficit_avg": "saturation_deficit_avgs",
+    "evaporation_actual": "evaporation_actual",
+    "root_zone_avg": "root_zone_avg",
+    "return_flow": "return_flow_totals",
+    "overland_flow": "overland_flow",
+    "infiltration": "infiltration_array",
+    "infiltration_excess": "infiltration_excess",
+    "pex_flow": "pex_flow",
+    "sub_flow": "sub_flow",
+    "karst_flow": "karst_flow",
+    "q_root": "q_root",
+    "precip_for_evaporation": "precip_for_evaporation",
+}
+
+# Dynamic model state saved in checkpoints, see Topmodel.get_state
+STATES = (
+    "saturation_deficit_avg",
+    "root_zone_storage",
+    "unsaturated_zone_storage",
+    "riparian_storage",
+    "moisture_conditions",
+    "amc_window",
+    "current_timestep",
+    "infiltration_cumi",
+    "infiltration_i_end",
+    "infiltration_lamb",
+    "infiltration_tp",
+    "infiltration_pond",
+)
+
+# Matrices of size num_timesteps x num_twi_increments that can be recorded
+# by Topmodel.run, see the record keyword of Topmodel
+MATRICES = (
+    "unsaturated_zone_storages",
+    "root_zone_storages",
+    "saturation_deficit_locals",
+    "evaporations",
+    "precip_excesses_op",
+)
+
 
 class Topmodel:
     """Class that represents a Topmodel based rainfall-runoff model
@@ -44,6 +102,53 @@ class Topmodel:
 
     Notes:
         Temperatures used to set exponent for new evaporation calculation
+
+        The engine keyword selects how the timesteps and twi increments
+        are calculated, see ENGINES.
+
+        The record keyword selects which matrices of size
+        num_timesteps x num_twi_increments are recorded, see MATRICES.
+        It is either a list of matrix names, recorded every timestep, or a
+        dict of matrix names to a stride, recorded every stride timesteps.
+        Matrices that are not recorded are set to None. By default all
+        matrices are recorded every timestep.
+
+        The initial_state keyword is a model state from get_state(), such as
+        a state file read with statefile.read, to start the run from instead
+        of the initial soil zone storages and storage deficit. The first
+        year is then not dropped as spin-up in hourly mode.
+
+        The option_spin_up keyword cycles the first year of forcing before
+        the run until the storage deficit and soil zone storages change by
+        less than spin_up_tolerance (mm) over a cycle, for at most
+        spin_up_max_cycles cycles. The number of cycles is saved in
+        spin_up_cycles and the first year is then not dropped in hourly mode.
+
+        The option_hourly_streaming keyword, used with
+        option_randomize_daily_to_hourly, generates the 24 hourly timesteps
+        of each day when the day is calculated and aggregates them to daily
+        values right away, so no hourly arrays of the whole record are
+        created. The daily outputs are the same, except precip_for_evaporation
+        which is summed to daily values.
+
+        The amc_window_days keyword is the number of days of precipitation
+        available summed into the antecedent moisture conditions used by the
+        impervious area runoff, the same number of days in daily and hourly
+        mode.
+
+        The infiltration_cache_size keyword is the maximum number of
+        infiltration results of the first wet timestep after a dry timestep
+        cached in infiltration_cache, 0 to disable the cache. The
+        precipitation is quantized to intervals of
+        infiltration_cache_tolerance (mm), and the infiltration is within
+        half that tolerance of the solver. The cache is not used by the jit
+        engine.
+
+        The seed keyword is the seed of the random selection of the rain
+        distribution of each day with option_distribution, an int, a
+        numpy.random.SeedSequence or a numpy.random.Generator. Realizations
+        of the rain distribution get independent seeds from
+        hydrocalcs.seed_sequences, see main.get_topmodel_arguments.
     """
     def __init__(self,
                  scaling_parameter,
@@ -81,11 +186,36 @@ class Topmodel:
                  option_randomize_daily_to_hourly=False,
                  option_min_max=False,
                  option_distribution=False,
-                 option_forecast=False):
+                 option_forecast=False,
+                 engine="python",
+                 record=None,
+                 initial_state=None,
+                 option_spin_up=False,
+                 spin_up_tolerance=0.01,
+                 spin_up_max_cycles=20,
+                 option_hourly_streaming=False,
+                 amc_window_days=5,
+                 infiltration_cache_size=256,
+                 infiltration_cache_tolerance=0.01,
+                 seed=10):
 
         self.lake_delay = 1.5  # this is input.
         self.option_min_max = option_min_max
 
+        # Check engine used to update the twi increments
+        if engine not in ENGINES:
+            raise ValueError(
+                "Incorrect engine: {}\n"
+                "Engine must be one of: {}".format(engine, ", ".join(ENGINES))
+            )
+        if engine == "jit" and not kernel.NUMBA_AVAILABLE:
+            warnings.warn(
+                "Numba is not installed, using the python engine instead "
+                "of the jit engine."
+            )
+            engine = "python"
+        self.engine = engine
+
         # Check timestep daily fraction
         if timestep_daily_fraction > 1:
             raise ValueError(
@@ -104,13 +234,40 @@ class Topmodel:
                 "".format(timestep_daily_fraction)
             )
 
-        if option_distribution:
-            self.rain_array = hydrocalcs.create_rain_array(rain_file, precip)
+        if option_hourly_streaming and not option_randomize_daily_to_hourly:
+            raise ValueError(
+                "Incorrect option for hourly streaming.\n"
+                "Option for hourly streaming requires the option to "
+                "randomize daily to hourly."
+            )
+
+        # Note: with option_hourly_streaming, only the rain distribution
+        # column of each day is kept, and its 24 fractions are gathered
+        # when the day is calculated
+        self.rain_file = rain_file
+        self.rain_array = None
+        self.rain_columns = None
+        if option_distribution and option_hourly_streaming:
+            self.rain_columns = hydrocalcs.rain_pattern_columns(rain_file, precip, seed=seed)
+        elif option_distribution:
+            self.rain_array = hydrocalcs.create_rain_array(rain_file, precip, seed=seed)
+        self.option_distribution = option_distribution
 
         # If option_randomize_daily_to_hourly, then compute updated values for
         # precip_minus_pet, temperature, and timestep_daily_fraction
         # Timestep daily fraction is 3600 seconds per hour / 86400 seconds per day
-        if option_randomize_daily_to_hourly:
+        # If option_hourly_streaming, then the daily values are kept and the
+        # hourly values of each day are computed during the run
+        self.option_hourly_streaming = option_hourly_streaming
+        if option_hourly_streaming:
+            self.option_randomize_daily_to_hourly = option_randomize_daily_to_hourly
+            self.pet_hamon = np.asarray(pet_hamon, dtype=float)
+            self.temperatures = np.asarray(temperatures, dtype=float)
+            self.timestep_daily_fraction = 3600 / 86400
+            self.precip_available = np.asarray(precip_available, dtype=float)
+            self.precip = np.asarray(precip, dtype=float)
+
+        elif option_randomize_daily_to_hourly:
             self.option_randomize_daily_to_hourly = option_randomize_daily_to_hourly
             self.pet_hamon = hydrocalcs.chop_daily_to_hourly(pet_hamon)
             self.temperatures = hydrocalcs.copy_daily_to_hourly(temperatures)
@@ -159,18 +316,62 @@ class Topmodel:
 
         self.moisture_conditions = 0.0
 
+        # Antecedent moisture conditions lookback in timesteps and window of
+        # the precipitation available over the lookback, oldest first
+        self.amc_lookback = int(round(amc_window_days / self.timestep_daily_fraction))
+        if self.amc_lookback < 1:
+            raise ValueError(
+                "Incorrect antecedent moisture conditions window: {}\n"
+                "Window must be at least one timestep".format(amc_window_days)
+            )
+        self.amc_window = np.zeros(self.amc_lookback)
+
+        # Infiltration of the first wet timestep after a dry timestep
+        self.infiltration_cache = infiltration.InfiltrationCache(
+            infiltration_cache_size, tolerance=infiltration_cache_tolerance / 1000
+        )
+
+        # Index of the next timestep calculated by run() or step()
+        self.current_timestep = 0
+
+        # Spin-up option
+        if spin_up_tolerance <= 0 or spin_up_max_cycles < 1:
+            raise ValueError(
+                "Incorrect spin-up: tolerance {}, max cycles {}\n"
+                "Spin-up tolerance must be positive and max cycles at "
+                "least 1".format(spin_up_tolerance, spin_up_max_cycles)
+            )
+        self.option_spin_up = option_spin_up
+        self.spin_up_tolerance = spin_up_tolerance
+        self.spin_up_max_cycles = spin_up_max_cycles
+        self.spin_up_cycles = 0
+        self.spin_up_converged = None
+        self.aborted = False
+
         # Assign twi
         self.twi_values = twi_values
         self.twi_saturated_areas = twi_saturated_areas
         self.twi_mean = twi_mean
         self.num_twi_increments = len(self.twi_values)
 
-        # Calculate the number of timesteps
-        self.num_timesteps = len(self.precip_available)
+        # Calculate the number of timesteps and the number of timesteps of
+        # the output arrays, which are days with option_hourly_streaming
+        if self.option_hourly_streaming:
+            self.num_days = len(self.precip_available)
+            self.num_timesteps = 24 * self.num_days
+            self.num_output_timesteps = self.num_days
+        else:
+            self.num_timesteps = len(self.precip_available)
+            self.num_output_timesteps = self.num_timesteps
 
         # Initialize total predicted flow array with nan
-        self.flow_predicted = utils.nans(self.num_timesteps)
-        self.flow_predicted_impervious = utils.nans(self.num_timesteps)
+        # Note: with option_hourly_streaming and option_min_max, the daily
+        # total, maximum, minimum, median and average predicted flows
+        if self.option_hourly_streaming and self.option_min_max:
+            self.flow_predicted = utils.nans((5, self.num_output_timesteps))
+        else:
+            self.flow_predicted = utils.nans(self.num_output_timesteps)
+        self.flow_predicted_impervious = utils.nans(self.num_output_timesteps)
 
         # Soil hydraulic variables
         # Note: soil depth of root zone set to soil depth of AB horizon
@@ -200,23 +401,46 @@ class Topmodel:
             self.flow_initial = 0.1
 
         # Watershed average storage deficit
-        self.saturation_deficit_avgs = np.zeros(self.num_timesteps)
+        self.saturation_deficit_avgs = np.zeros(self.num_output_timesteps)
         self.saturation_deficit_avg = None
 
         # Soil zone storages
-        self.unsaturated_zone_storages = utils.nans((self.num_timesteps, self.num_twi_increments))
-        self.root_zone_storages = utils.nans((self.num_timesteps, self.num_twi_increments))
         self.unsaturated_zone_storage = None
         self.root_zone_storage = None
-        self.precip_excesses_op = utils.nans((self.num_timesteps, self.num_twi_increments))
+
+        # Recorded matrices of soil zone storages and fluxes
+        # Note: in hourly mode, the first year (8760 hours) is dropped
+        # during post processing, unless starting from an initial state or
+        # with the spin-up option
+        if initial_state is None and not option_spin_up:
+            self.drop_first = 8760
+        else:
+            self.drop_first = 0
+        self.record = self._check_record(record)
+        self.record_offsets = {}
+        for name in MATRICES:
+            if name in self.record:
+                # Note: with option_hourly_streaming, matrices are recorded
+                # daily and offsets and strides are in days
+                stride = self.record[name]
+                if self.option_hourly_streaming:
+                    stride = max(1, stride // 24)
+                    offset = (self.drop_first // 24) % stride
+                elif self.option_randomize_daily_to_hourly:
+                    offset = self.drop_first % stride
+                else:
+                    offset = 0
+                self.record_offsets[name] = offset
+                num_rows = max(0, -(-(self.num_output_timesteps - offset) // stride))
+                setattr(self, name, utils.nans((num_rows, self.num_twi_increments)))
+            else:
+                setattr(self, name, None)
 
         # Variables used in self.run() method
-        self.saturation_deficit_locals = utils.nans((self.num_timesteps, self.num_twi_increments))
-        self.evaporations = utils.nans((self.num_timesteps, self.num_twi_increments))
-        self.evaporation_actual = utils.nans(self.num_timesteps)
-        self.root_zone_avg = utils.nans(self.num_timesteps)
-        self.return_flow_totals = utils.nans(self.num_timesteps)
-        self.overland_flow = utils.nans(self.num_timesteps)
+        self.evaporation_actual = utils.nans(self.num_output_timesteps)
+        self.root_zone_avg = utils.nans(self.num_output_timesteps)
+        self.return_flow_totals = utils.nans(self.num_output_timesteps)
+        self.overland_flow = utils.nans(self.num_output_timesteps)
 
         # Karst option
         self.option_karst = option_karst
@@ -236,15 +460,15 @@ class Topmodel:
         self.flow_predicted_karst = None
         self.subsurface_flow_rate_ratio = None
         self.zone_infiltration = None
-        self.infiltration_array = np.zeros(self.num_timesteps)
+        self.infiltration_array = np.zeros(self.num_output_timesteps)
         self.evaporation = np.zeros(self.num_twi_increments)
-        self.precip_for_evaporation = np.zeros(self.num_timesteps)
+        self.precip_for_evaporation = np.zeros(self.num_output_timesteps)
 
         # Unit testing variables
-        self.pex_flow = np.zeros(self.num_timesteps)
-        self.sub_flow = np.zeros(self.num_timesteps)
-        self.karst_flow = np.zeros(self.num_timesteps)
-        self.q_root = np.zeros(self.num_timesteps)
+        self.pex_flow = np.zeros(self.num_output_timesteps)
+        self.sub_flow = np.zeros(self.num_output_timesteps)
+        self.karst_flow = np.zeros(self.num_output_timesteps)
+        self.q_root = np.zeros(self.num_output_timesteps)
 
         # Riparian stuff.
         self.riparian_area = riparian_area  # Stream area + lake area = riparian area
@@ -256,6 +480,25 @@ class Topmodel:
         # Initialize model
         self._initialize()
 
+        # Start from the initial state if given
+        if initial_state is not None:
+            self.set_state(initial_state)
+
+        # Forcing arrays of the timestep loop, not used by the jit engine and
+        # calculated each day with option_hourly_streaming
+        if self.engine == "jit" or self.option_hourly_streaming:
+            self.forcing = None
+        else:
+            self.forcing = preprocess_forcing(
+                precip_available=self.precip_available,
+                precip=self.precip,
+                temperatures=self.temperatures,
+                pet_hamon=self.pet_hamon,
+                grow_trigger=self.grow_trigger,
+                et_exp_grow=self.et_exp_grow,
+                et_exp_dorm=self.et_exp_dorm,
+            )
+
     def _initialize(self):
         """Initialize model soil parameters, storage deficit, and
         unsaturated zone and root zone storages.
@@ -323,6 +566,13 @@ class Topmodel:
                 self.soil_depth_roots * self.available_water_holding_capacity
                 )
 
+        # Local saturation deficit of each twi increment relative to the
+        # watershed average storage deficit - equation 31 in Wolock, 1993
+        self.twi_offsets = (
+            self.scaling_parameter
+            * (self.twi_mean * self.twi_adj - np.asarray(self.twi_values, dtype=float))
+        )
+
 
     def _initialize_channel_routing_parameters(self):
         """Initialize the channel routing parameters.
@@ -386,626 +636,1540 @@ class Topmodel:
         self.k_zones = 9
         self.e_xk = math.log(self.k0)
         self.sigma = math.sqrt(math.log(self.k_coef**2+1))
-        self.k_dist = [math.exp(self.e_xk+((i+1)-5)*self.sigma) for i in range(self.k_zones)]
-        self.ak_zones = [2.33000E-04, 5.97800E-03, 6.05970E-02, 2.41730E-01, 3.82924E-01,
-                         2.41730E-01, 6.05970E-02, 5.97800E-03, 2.33000E-04]
+        self.k_dist = np.array([math.exp(self.e_xk+((i+1)-5)*self.sigma) for i in range(self.k_zones)])
+        self.ak_zones = np.array([2.33000E-04, 5.97800E-03, 6.05970E-02, 2.41730E-01, 3.82924E-01,
+                                  2.41730E-01, 6.05970E-02, 5.97800E-03, 2.33000E-04])
         self.scaling_factor = (
                 1 / (self.raw_scaling_parameter / 1000)
         )
         self.dt = 1
-        self.inf_class = infiltration.Statics
-        self.infiltration_excess = np.zeros(self.num_timesteps)
+        # Ponding state of each hydraulic conductivity zone
+        self.inf_state = infiltration.InfiltrationState((self.k_zones,))
+        self.infiltration_excess = np.zeros(self.num_output_timesteps)
 
 
 
-    def run(self):
-        """Calculate water fluxes and flow prediction."""
-        # Start of timestep loop
-        for i in range(self.num_timesteps):
+    def run(self, objective_bound=None):
+        """Calculate water fluxes and flow prediction.
 
-            # Initialize predicted flows, precipitation in excess
-            # of evapotranspiration and field-capacity storage, and
-            # local saturation deficit
-            self.sat_flow = 0
-            self.qroot = 0
-            self.return_flow = 0
-            self.flow_predicted_overland = 0
-            self.flow_predicted_vertical_drainage_flux = 0
-            self.flow_predicted_karst = 0
-            self.q_riparian = 0
-            self.adj_flow = 0
-            self.qsrip = 0
-            self.transpiration = 0
-            self.precip_excesses = np.zeros(self.num_twi_increments)
-            self.saturation_deficit_local = utils.nans(self.num_twi_increments)
-
-            # Assign water available for evapotranspiration and
-            # water available for recharge based on how precipitation
-            # compares to potential evapotranspiration
-            # If precip_available < 0 => moisture has to be taken out of soil
-            # to meet the pet demand
-            # If precip_available > 0 => then surplus precip soaks into the
-            # ground to recharge soil moisture and any left over after that
-            # runs off as streamflow
-            # If precip_available = 0 => no surplus precip
-
-            self.precip_for_recharge = 0
-            self.precip_for_evaporation[i] = 0
-            self.zone_infiltration = 0
-
-
-            if self.precip_available[i] <= 0:
-                # Either no precip, or all precip evaporates.
-                # Value is assigned to precip for evaporation.
-                self.precip_for_evaporation[i] = (  # Precip_for_evap = remaining PET
-                    -1 * self.precip_available[i]   # precip - PET = precip_available
-                )
-                if self.temperatures[i] <= 0:
-                    self.precip_for_evaporation[i] = 0
-                infiltration.static_reset(self.inf_class)
-                self.infiltration_array[i] = 0
-                self.zone_infiltration = 0
-
-            elif self.precip_available[i] > 0:
-                self.precip_for_evaporation[i] = 0
-                self.precip_for_recharge = self.precip_available[i]
-
-                # Calculate infiltration
-                t = i + 1
-                ppt = self.precip_for_recharge / 1000
-                if ppt <= 0:
-                    self.zone_infiltration = 0
-                    infiltration.static_reset(self.inf_class)
-                else:
-                    infiltrate = infiltration.infiltration(
-                        t, self.dt, ppt, self.k_dist[0], self.capillary_drive, self.scaling_factor, self.inf_class
-                    )
-                    if infiltrate >= ppt:
-                        # if slowest K value equals or exceeds precip, everything infiltrates.
-                        self.zone_infiltration = ppt
-                    else:
-                        for k in range(len(self.k_dist)):
-                            infiltrate = infiltration.infiltration(
-                                t, self.dt, ppt, self.k_dist[k], self.capillary_drive, self.scaling_factor,
-                                self.inf_class
-                            )
-                            self.zone_infiltration = self.zone_infiltration + infiltrate * self.ak_zones[k]
-                self.infiltration_array[i] = self.zone_infiltration * 1000
-                if self.precip_for_recharge - self.infiltration_array[i] < 1.0e-4:
-                    self.infiltration_excess[i] = 0
-                else:
-                    self.infiltration_excess[i] = self.precip_for_recharge - self.infiltration_array[i]
-                self.precip_for_recharge = (
-                        self.precip_for_recharge - self.infiltration_excess[i]
-                 )
-
-            # Set the et_exponent based on current temperature
-            # Temperature > 15 degrees Celsius means growth
-            # Temperature <= 15 degrees Celsius means dormant
-            if self.temperatures[i] > self.grow_trigger:
-                # changed from 0.5, changed to 1 (4/9/2020).
-                # Changed to 0.9 after some discussion on (4/14/2020)
-                self.et_exponent = self.et_exp_grow
+        The objective_bound keyword is a metrics.NashSutcliffeBound of the
+        observed flow of the output series, after the first year is dropped
+        in hourly mode. It is updated with the flow predicted of each day
+        as the run goes, every BOUND_CHUNK_DAYS days with the jit engine
+        when no matrices are recorded. As soon as the final Nash-Sutcliffe
+        efficiency can no longer exceed the threshold of the bound, the run
+        stops and aborted is set to True, and the output series are left
+        incomplete and not post processed.
+
+        :param objective_bound: Bound of the Nash-Sutcliffe efficiency of
+                                the run
+        :type objective_bound: metrics.NashSutcliffeBound
+        """
+        self.aborted = False
+        if self.option_spin_up:
+            self._spin_up()
+
+        if self.option_hourly_streaming:
+            # Calculate the hourly timesteps one day at a time
+            for day in range(self.num_days):
+                self._run_day(day)
+                if objective_bound is not None:
+                    # Total daily flow is the first row with option_min_max
+                    flow = self.flow_predicted[0, day] if self.option_min_max else self.flow_predicted[day]
+                    if not self._update_objective_bound(objective_bound, [flow], day):
+                        self.aborted = True
+                        return
+        elif self.engine == "jit":
+            # Run all timesteps in the compiled kernel
+            self._run_kernel(objective_bound=objective_bound)
+            if self.aborted:
+                return
+        else:
+            # Start of timestep loop
+            forcing = self._prepare_forcing(self.forcing)
+            steps = 24 if self.option_randomize_daily_to_hourly else 1
+            for i in range(self.num_timesteps):
+                self._run_timestep(forcing, i)
+                if objective_bound is not None and (i + 1) % steps == 0:
+                    flow = np.sum(self.flow_predicted[i + 1 - steps:i + 1])
+                    if not self._update_objective_bound(objective_bound, [flow], i // steps):
+                        self.aborted = True
+                        return
+
+        # Post processing
+        # ===============
+        # If option_randomize_daily_to_hourly is True, then convert back from
+        # hourly to daily, or with option_hourly_streaming only drop the
+        # first year of the daily values.
+        if self.option_hourly_streaming:
+            self._postprocess_streaming()
+        elif self.option_randomize_daily_to_hourly:
+            self.flow_predicted = (
+                hydrocalcs.sum_hourly_to_daily(self.flow_predicted[self.drop_first:], minmax=self.option_min_max)
+            )
+            self.overland_flow = (
+                hydrocalcs.sum_hourly_to_daily(self.overland_flow[self.drop_first:])
+            )
+            self.flow_predicted_impervious = (
+                hydrocalcs.sum_hourly_to_daily(self.flow_predicted_impervious[self.drop_first:])
+                * self.impervious_area_fraction * self.eff_imp
+            )
+            self.saturation_deficit_avgs = (
+                hydrocalcs.bind_hourly_to_daily(self.saturation_deficit_avgs[self.drop_first:])
+            )
+            self._postprocess_matrices()
+            self.pex_flow = (
+                hydrocalcs.sum_hourly_to_daily(self.pex_flow[self.drop_first:])
+            )
+            self.infiltration_array = (
+                hydrocalcs.sum_hourly_to_daily(self.infiltration_array[self.drop_first:])
+            )
+            self.infiltration_excess = (
+                hydrocalcs.sum_hourly_to_daily(self.infiltration_excess[self.drop_first:])
+            )
+            self.evaporation_actual = (
+                    hydrocalcs.sum_hourly_to_daily(self.evaporation_actual[self.drop_first:])
+            )
+            self.root_zone_avg = (
+                hydrocalcs.bind_hourly_to_daily(self.root_zone_avg[self.drop_first:])
+            )
+            self.q_root = (
+                hydrocalcs.sum_hourly_to_daily(self.q_root[self.drop_first:])
+            )
+            self.sub_flow = (
+                hydrocalcs.sum_hourly_to_daily(self.sub_flow[self.drop_first:])
+            )
+            self.return_flow_totals = (
+                hydrocalcs.sum_hourly_to_daily(self.return_flow_totals[self.drop_first:])
+            )
+            self.karst_flow = (
+                hydrocalcs.sum_hourly_to_daily(self.karst_flow[self.drop_first:])
+            )
+
+    def _update_objective_bound(self, objective_bound, flows, day):
+        """Update the objective bound with the daily flows predicted from
+        day, or the flows of each timestep if the forcing is not
+        randomized to hourly, see run. The days of the first year that is
+        dropped in hourly mode are skipped.
+
+        :return: False if the run can be stopped
+        :rtype: bool
+        """
+        if self.option_randomize_daily_to_hourly:
+            day -= self.drop_first // 24
+        flows = np.asarray(flows, dtype=float)[max(0, -day):]
+        if not len(flows):
+            return True
+
+        return objective_bound.update(max(0, day), flows)
+
+    def _postprocess_streaming(self):
+        """Drop the first year of the daily values calculated with
+        option_hourly_streaming."""
+        drop_days = self.drop_first // 24
+        for attribute in SERIES.values():
+            setattr(self, attribute, getattr(self, attribute)[..., drop_days:])
+        if self.option_min_max:
+            self.flow_predicted = tuple(self.flow_predicted)
+        self.flow_predicted_impervious = (
+            self.flow_predicted_impervious * self.impervious_area_fraction * self.eff_imp
+        )
+        for name, stride in self.record.items():
+            stride = max(1, stride // 24)
+            matrix = getattr(self, name)
+            setattr(self, name, matrix[(drop_days - self.record_offsets[name]) // stride:])
+
+    def _postprocess_matrices(self):
+        """Convert the recorded matrices back from hourly to daily.
+
+        Matrices recorded every timestep are summed or averaged to daily
+        values, matrices recorded with a stride (a multiple of 24 hours) are
+        already daily samples and only the first year is dropped.
+        """
+        aggregations = {
+            "unsaturated_zone_storages": hydrocalcs.sum_hourly_to_daily,
+            "root_zone_storages": hydrocalcs.bind_hourly_to_daily,
+            "saturation_deficit_locals": hydrocalcs.bind_hourly_to_daily,
+            "evaporations": hydrocalcs.sum_hourly_to_daily,
+            "precip_excesses_op": hydrocalcs.sum_hourly_to_daily,
+        }
+        for name, stride in self.record.items():
+            matrix = getattr(self, name)
+            if stride == 1:
+                matrix = aggregations[name](matrix[self.drop_first:])
             else:
-                # changed from 5 8/19/2019
-                # Changed to 2 based on Tanja's notes from 2014 notes. (4/14/2020)
-                # Changed code to be input in charactistics - 8/2020.
-                self.et_exponent = self.et_exp_dorm
-
-            # Start of twi increments loop
-            for j in range(self.num_twi_increments):
-
-                # Local saturation/storage/drainage deficit
-                # =========================================
-                # Calculate the local saturation deficit
-                self.saturation_deficit_local[j] = (
-                    self.saturation_deficit_avg
-                    + self.scaling_parameter * (self.twi_mean * self.twi_adj - self.twi_values[j])
+                matrix = matrix[(self.drop_first - self.record_offsets[name]) // stride:]
+            setattr(self, name, matrix)
+
+    def get_state(self):
+        """Return the dynamic model state at the end of the last timestep
+        calculated, see STATES. The state can be saved with statefile.write
+        and used as the initial_state of a new run.
+
+        :return state: A dict of the model state
+        :rtype: dict
+        """
+        return {
+            "saturation_deficit_avg": self.saturation_deficit_avg,
+            "root_zone_storage": np.array(self.root_zone_storage, dtype=float),
+            "unsaturated_zone_storage": np.array(self.unsaturated_zone_storage, dtype=float),
+            "riparian_storage": self.riparian_storage,
+            "moisture_conditions": self.moisture_conditions,
+            "amc_window": self.amc_window.copy(),
+            "current_timestep": self.current_timestep,
+            "infiltration_cumi": self.inf_state.cumi.copy(),
+            "infiltration_i_end": self.inf_state.i_end.copy(),
+            "infiltration_lamb": self.inf_state.lamb.copy(),
+            "infiltration_tp": self.inf_state.tp.copy(),
+            "infiltration_pond": self.inf_state.pond.copy(),
+        }
+
+    def set_state(self, state):
+        """Set the dynamic model state from a state returned by get_state(),
+        see STATES.
+
+        :param state: A dict of the model state
+        :type state: dict
+        """
+        missing = [name for name in STATES if name not in state]
+        if missing:
+            raise ValueError(
+                "Incorrect state, missing: {}".format(", ".join(missing))
+            )
+        for name in ("root_zone_storage", "unsaturated_zone_storage"):
+            if np.shape(state[name]) != (self.num_twi_increments,):
+                raise ValueError(
+                    "Incorrect state {}: shape {}\n"
+                    "State must have one value per twi increment: {}".format(
+                        name, np.shape(state[name]), self.num_twi_increments)
                 )
+        for name in infiltration.FIELDS:
+            if np.shape(state["infiltration_" + name]) != (self.k_zones,):
+                raise ValueError(
+                    "Incorrect state infiltration_{}: shape {}\n"
+                    "State must have one value per hydraulic conductivity "
+                    "zone: {}".format(
+                        name, np.shape(state["infiltration_" + name]), self.k_zones)
+                )
+        if np.shape(state["amc_window"]) != (self.amc_lookback,):
+            raise ValueError(
+                "Incorrect state amc_window: shape {}\n"
+                "State must have one value per timestep of the antecedent "
+                "moisture conditions lookback: {}".format(
+                    np.shape(state["amc_window"]), self.amc_lookback)
+            )
 
-                self.soil_root_deficit = (self.root_zone_storage_max - self.root_zone_storage[j]) * self.twi_saturated_areas[j]
-                self.water_table_depth = self.soil_depth_roots
-                self.saturation_excess = ((self.gravity_drained_porosity * self.water_table_depth)
-                                          - self.saturation_deficit_local[j]) * self.twi_saturated_areas[j]
-
-                # Accounts for the root zone storage in deficit zone.  Adapted from KYTopModel.  Removed updating
-                # soil root zone numbers, saturation excess is added to qroot.
-                if self.saturation_excess <= 0:
-                    self.saturation_deficit_local[j] = self.saturation_deficit_local[j]
-
-                elif self.saturation_excess > 0:
-                    if self.saturation_excess < self.soil_root_deficit:
-                        #self.root_zone_storage[j] = self.root_zone_storage[j] + self.saturation_excess
-                        self.qroot = (self.qroot + self.saturation_excess
-                                      )
-                        # self.saturation_deficit_local[j] = (
-                        #             self.gravity_drained_porosity
-                        #             * self.water_table_depth)
-
-                    elif self.root_zone_storage[j] == self.root_zone_storage_max:
-
-                        # Robert Hudson fix
-                        #self.saturation_deficit_local[j] = (self.saturation_deficit_local[j] + self.soil_root_deficit)
-                        self.qroot = self.qroot + self.soil_root_deficit
-                    # else:
-                    #     self.saturation_deficit_local[j] = (self.saturation_deficit_local[j] + self.soil_root_deficit)
-
-                # If local saturation deficit is less than zero, meaning soil
-                # is overly saturated, then set the local saturation deficit
-                # to zero meaning soil is saturated and water table is at the
-                # land surface
-                if self.saturation_deficit_local[j] < 0:
-                    self.return_flow = self.return_flow - self.saturation_deficit_local[j] * self.twi_saturated_areas[j]
-                    self.saturation_deficit_local[j] = 0
-
-                # If the unsaturated zone storage is greater than the local
-                # saturation deficit, update the root zone storage with the
-                # difference and assign the local saturation deficit to the
-                # unsaturated zone storage
-                if self.unsaturated_zone_storage[j] > self.saturation_deficit_local[j]:
-                    self.root_zone_storage[j] = (
-                        self.root_zone_storage[j] +
-                        + (self.unsaturated_zone_storage[j]
-                           - self.saturation_deficit_local[j])
-                    )
-                    self.unsaturated_zone_storage[j] = self.saturation_deficit_local[j]
-
-
-                # Precipitation
-                # =============
-                # If there is precipitation available, then process the
-                # precipitation by calculating the excess precipitation and
-                # adding it to an array of precipitation excesses over all twi
-                # increments
-                if self.precip_for_recharge > 0:
-                    self.precip_excess = (
-                        self.precip_for_recharge
-                        - (self.saturation_deficit_local[j]
-                           - self.unsaturated_zone_storage[j])
-                        - (self.root_zone_storage_max
-                           - self.root_zone_storage[j])
-                    )
-                    self.precip_excesses[j] = (
-                        self.precip_excesses[j] + self.precip_excess
-                    )
+        self.saturation_deficit_avg = float(state["saturation_deficit_avg"])
+        self.root_zone_storage = np.array(state["root_zone_storage"], dtype=float)
+        self.unsaturated_zone_storage = np.array(state["unsaturated_zone_storage"], dtype=float)
+        self.riparian_storage = float(state["riparian_storage"])
+        self.moisture_conditions = float(state["moisture_conditions"])
+        self.amc_window = np.array(state["amc_window"], dtype=float)
+        self.current_timestep = int(state["current_timestep"])
+        self.inf_state.cumi = state["infiltration_cumi"]
+        self.inf_state.i_end = state["infiltration_i_end"]
+        self.inf_state.lamb = state["infiltration_lamb"]
+        self.inf_state.tp = state["infiltration_tp"]
+        self.inf_state.pond = state["infiltration_pond"]
+
+    def get_output_strides(self):
+        """Return the stride of each recorded matrix in output timesteps,
+        which are days when option_randomize_daily_to_hourly is True.
+
+        :return output_strides: A dict of recorded matrix names to strides
+        :rtype: dict
+        """
+        if self.option_randomize_daily_to_hourly:
+            return {name: max(1, stride // 24) for name, stride in self.record.items()}
+        return dict(self.record)
 
-                    # If the excess precipitation calculated is less than 0.0,
-                    # then reset the excess precipitation to 0.0
-                    if self.precip_excess < 0:
-                        self.precip_excess = 0
+    def _check_record(self, record):
+        """Check the record specification and return it as a dict of matrix
+        names to strides, see the record keyword of Topmodel.
 
-                    self.precip_excess_diff = (
-                        abs(self.precip_excess
-                            - self.precip_for_recharge)
-                    )
+        :param record: None, a list of matrix names or a dict of matrix
+                       names to strides
+        :return record: A dict of matrix names to strides
+        :rtype: dict
+        """
+        if record is None:
+            record = MATRICES
+        if not isinstance(record, dict):
+            record = {name: 1 for name in record}
+
+        for name, stride in record.items():
+            if name not in MATRICES:
+                raise ValueError(
+                    "Incorrect record: {}\n"
+                    "Recorded matrices must be in: {}".format(name, ", ".join(MATRICES))
+                )
+            if int(stride) != stride or stride < 1:
+                raise ValueError(
+                    "Incorrect record stride for {}: {}\n"
+                    "Stride must be a positive integer".format(name, stride)
+                )
+            if self.option_randomize_daily_to_hourly and stride != 1 and stride % 24 != 0:
+                raise ValueError(
+                    "Incorrect record stride for {}: {}\n"
+                    "With option to randomize daily to hourly, stride must be "
+                    "1 or a multiple of 24 hours".format(name, stride)
+                )
 
-                    if not self.precip_excess_diff <= 1E-20:
-                        # Calculate the root zone storage amount from the
-                        # differences between
-                        # 1. (1 - self.macropore_fraction): the amount that is
-                        # not bypassing the soil root zone
-                        # 2. (self.precip_for_recharge
-                        #     - self.precip_excess): the amount that is
-                        # available without any excess
-                        self.root_zone_storage[j] = (
-                            self.root_zone_storage[j]
-                            + (1.0 - self.macropore_fraction)
-                            * (self.precip_for_recharge - self.precip_excess)
-                        )
+        return {name: int(stride) for name, stride in record.items()}
+
+    def _get_matrix_values(self):
+        """Return the values of the current timestep of each matrix, see
+        MATRICES."""
+        return {
+            "unsaturated_zone_storages": self.unsaturated_zone_storage,
+            "root_zone_storages": self.root_zone_storage,
+            "saturation_deficit_locals": self.saturation_deficit_local,
+            "evaporations": self.evaporation,
+            "precip_excesses_op": self.precip_excesses * self.twi_saturated_areas,
+        }
+
+    def _record_matrices(self, i):
+        """Save the soil zone storages and fluxes of timestep i to the
+        recorded matrices."""
+        if not self.record:
+            return
+
+        values = self._get_matrix_values()
+        for name, stride in self.record.items():
+            row, remainder = divmod(i - self.record_offsets[name], stride)
+            if remainder == 0 and row >= 0:
+                getattr(self, name)[row] = values[name]
+
+    def step(self, precip_available, temperature, pet, precip):
+        """Calculate water fluxes and flow prediction for the next timestep.
+
+        The model state is kept between calls, so the model can be advanced
+        one timestep at a time as new forcing becomes available, either
+        from its initial state or after run(). The forcing is for a single
+        model timestep, it is not disaggregated to hourly. The twi
+        increments are updated with the vectorized engine if the engine is
+        jit.
+
+        :param precip_available: Precipitation minus potential evapotranspiration
+        :type precip_available: float
+        :param temperature: Temperature
+        :type temperature: float
+        :param pet: Potential evapotranspiration
+        :type pet: float
+        :param precip: Precipitation
+        :type precip: float
+        :return fluxes: A dict of the values of the timestep, see SERIES
+        :rtype: dict
+        """
+        forcing = preprocess_forcing(
+            precip_available=np.array([precip_available], dtype=float),
+            precip=np.array([precip], dtype=float),
+            temperatures=np.array([temperature], dtype=float),
+            pet_hamon=np.array([pet], dtype=float),
+            grow_trigger=self.grow_trigger,
+            et_exp_grow=self.et_exp_grow,
+            et_exp_dorm=self.et_exp_dorm,
+        )
 
-                        # Calculate the unsaturated zone storage amount from
-                        # the amount bypassing the soil root zone and the
-                        # amount that is available without any excess
+        return self._calculate_timestep(self._prepare_forcing(forcing), 0)
 
-                        self.unsaturated_zone_storage[j] = (
-                            self.unsaturated_zone_storage[j]
-                            + self.macropore_fraction
-                            * (self.precip_for_recharge
-                               - self.precip_excess)
-                        )
+    def steps(self, precip_available, temperatures, pet_hamon, precip):
+        """Generator of the water fluxes and flow prediction of each timestep
+        of the forcing arrays, see step().
 
-                        # If the root zone storage is greater than the maximum
-                        # soil root zone storage, then added the difference
-                        # to the unsaturated zone storage and assign the root
-                        # zone storage to the maximum root zone storage
-                        if self.root_zone_storage[j] > self.root_zone_storage_max:
-                            self.unsaturated_zone_storage[j] = (
-                                self.unsaturated_zone_storage[j]
-                                + (self.root_zone_storage[j]
-                                   - self.root_zone_storage_max)
-                            )
-                            self.root_zone_storage[j] = self.root_zone_storage_max
-
-                        elif self.unsaturated_zone_storage[j] > self.saturation_deficit_local[j]:
-                            self.root_zone_storage[j] = (
-                                    self.root_zone_storage[j]
-                                    + (self.unsaturated_zone_storage[j]
-                                       - self.saturation_deficit_local[j])
-                            )
-                            self.unsaturated_zone_storage[j] = self.saturation_deficit_local[j]
-
-                        if self.root_zone_storage[j] > self.root_zone_storage_max:
-                            self.precip_excesses[j] = (
-                                (self.root_zone_storage[j] - self.root_zone_storage_max) * self.twi_saturated_areas[j]
-                            )
-
-                            self.root_zone_storage[j] = self.root_zone_storage_max
-
-                    self.sat_flow = (self.precip_excesses[j] + self.sat_flow)
-
-                        # else:
-                        #     # If the unsaturated zone storage is greater than
-                        #     # the local saturation deficit, update the root
-                        #     # zone storage with the difference and assign the
-                        #     # local saturation deficit to the unsaturated zone
-                        #     # storage (same step preformed in calculation of
-                        #     # the local saturation deficit above)
-                        #     if self.unsaturated_zone_storage[j] > self.saturation_deficit_local[j]:
-                        #         self.root_zone_storage[j] = (
-                        #             self.root_zone_storage[j]
-                        #             + (self.unsaturated_zone_storage[j]
-                        #                - self.saturation_deficit_local[j])
-                        #         )
-                        #
-
-
-                # Drainage from unsaturated zone storage
-                # ======================================
-                # If there is water available for vertical drainage, then
-                # calculate the vertical drainage flux (millimeters/day)
-                # equation 23 in Wolock, 1993
-                # Note: self.vertical_drainage_flux_initial =
-                # self.saturated_hydraulic_conductivity
-                # * self.timestep_daily_fraction
-                if self.saturation_deficit_local[j] > 0:
-                    self.vertical_drainage_flux = (
-                        self.vertical_drainage_flux_initial
-                        * (self.unsaturated_zone_storage[j]
-                           / self.saturation_deficit_local[j])
-                    )
+        :return fluxes: A dict of the values of each timestep, see SERIES
+        :rtype: generator
+        """
+        for values in zip(precip_available, temperatures, pet_hamon, precip):
+            yield self.step(*values)
+
+    def _spin_up(self):
+        """Cycle the first year of forcing, without saving any output, until
+        the watershed average storage deficit and the root zone and
+        unsaturated zone storages change by less than the spin-up tolerance
+        over a cycle, see the option_spin_up keyword of Topmodel.
+        """
+        num_timesteps = min(
+            self.num_timesteps, int(round(365 / self.timestep_daily_fraction))
+        )
 
-                    # If the vertical drainage flux is greater than the soil
-                    # water available for drainage (unsaturated_zone_storage),
-                    # then assign the vertical drainage flux to the
-                    # unsaturated_zone_storage
-                    if self.vertical_drainage_flux > self.unsaturated_zone_storage[j]:
-                        self.vertical_drainage_flux = self.unsaturated_zone_storage[j]
-
-                    # Update the unsaturated zone storage by removing the
-                    # vertical drainage flux amount from the amount of soil
-                    # water available to drain
-                    self.unsaturated_zone_storage[j] = self.unsaturated_zone_storage[j] - self.vertical_drainage_flux
-
-                    # Calculate the predicted vertical drainage flux from the
-                    # vertical drainage amount and the current saturated
-                    # land-surface area in the watershed
-                    self.flow_predicted_vertical_drainage_flux = (
-                        self.flow_predicted_vertical_drainage_flux
-                        + (self.vertical_drainage_flux
-                           * self.twi_saturated_areas[j])
-                    )
+        self.spin_up_converged = False
+        for cycle in range(1, self.spin_up_max_cycles + 1):
+            saturation_deficit_avg = self.saturation_deficit_avg
+            root_zone_storage = np.array(self.root_zone_storage, dtype=float)
+            unsaturated_zone_storage = np.array(self.unsaturated_zone_storage, dtype=float)
+
+            if self.option_hourly_streaming:
+                for day in range(min(self.num_days, 365)):
+                    self._run_day(day, record=False)
+            elif self.engine == "jit":
+                self._run_kernel(num_timesteps, record=False)
+            else:
+                forcing = self._prepare_forcing(
+                    {name: values[:num_timesteps] for name, values in self.forcing.items()}
+                )
+                for i in range(num_timesteps):
+                    self._calculate_timestep(forcing, i)
 
-                # Evaporation from soil root zone storage
-                # =======================================
-                # If there is evaporation in excess of precipitation,
-                # then compute evaporation.
-                # Note: Evaporation is calculated using AET formula from
-                # Table 2 of USGS SIR 20155143 (see reference [2] in
-                # module docstring)
-                if self.precip_for_evaporation[i] > 0:
-
-                    self.evaporation[j] = (
-                            self.precip_for_evaporation[i] *
-                            (self.root_zone_storage[j] / self.root_zone_storage_max)**self.et_exponent
-                    )
+            change = max(
+                abs(self.saturation_deficit_avg - saturation_deficit_avg),
+                np.max(np.abs(self.root_zone_storage - root_zone_storage)),
+                np.max(np.abs(self.unsaturated_zone_storage - unsaturated_zone_storage)),
+            )
+            self.spin_up_cycles = cycle
+            if change < self.spin_up_tolerance:
+                self.spin_up_converged = True
+                break
+
+        if not self.spin_up_converged:
+            warnings.warn(
+                "Spin-up did not converge after {} cycles, the model state "
+                "changed by {} over the last cycle.".format(self.spin_up_cycles, change)
+            )
 
-                    # If the precipitation available for evapotranspiration is
-                    # greater than the soil root zone storage amount, then
-                    # assign all the water in the soil root zone storage to the
-                    # precipitation available for evapotranspiration
-                    if self.evaporation[j] > self.root_zone_storage[j]:
-                        self.evaporation[j] = self.root_zone_storage[j]
-
-                    # Calculate the amount of water in the soil root zone
-                    # storage by removing the amount available for
-                    # evapotranspiration
-                    # note: soil root zone storage will be depleted (equal 0.0)
-                    # if the condition above is true where the precipitation
-                    # available for evapotranspiration is greater than the soil
-                    # root zone storage amount
-
-                    self.transpiration = self.transpiration + (self.evaporation[j] * self.twi_saturated_areas[j])
-                    self.root_zone_storage[j] = (
-                        self.root_zone_storage[j] - self.evaporation[j]
-                    )
+    def _get_hourly_forcing(self, day):
+        """Return the hourly precipitation available, precipitation,
+        temperatures and pet of a day with option_hourly_streaming, same as
+        chop_daily_to_hourly, chop_daily_to_hourly_precip and
+        copy_daily_to_hourly for that day."""
+        if self.option_distribution:
+            rain = hydrocalcs.read_rain_distribution(self.rain_file)[self.rain_columns[day]]
+            precip_available = self.precip_available[day] * rain
+            precip = self.precip[day] * rain
+        else:
+            precip_available = np.full(24, self.precip_available[day] / 24)
+            precip = np.full(24, self.precip[day] / 24)
+        temperatures = np.full(24, self.temperatures[day])
+        pet_hamon = np.full(24, self.pet_hamon[day] / 24)
+
+        return precip_available, precip, temperatures, pet_hamon
+
+    def _run_day(self, day, record=True):
+        """Calculate the 24 hourly timesteps of a day with
+        option_hourly_streaming and save the daily values, summed or
+        averaged as in the post processing of hourly values, to the output
+        arrays.
+
+        :param day: Index of the day
+        :type day: int
+        :param record: Save the daily values, False for spin-up cycles
+        :type record: bool
+        """
+        precip_available, precip, temperatures, pet_hamon = self._get_hourly_forcing(day)
+
+        # Matrices of the hourly values of the day, only for the matrices
+        # that are recorded that day
+        matrices = {}
+        if record:
+            for name, stride in self.record.items():
+                stride = max(1, stride // 24)
+                if (day - self.record_offsets[name]) % stride == 0 and day >= self.record_offsets[name]:
+                    matrices[name] = utils.nans((24, self.num_twi_increments))
+
+        # Hourly series of the day in the order of SERIES
+        if self.engine == "jit":
+            series = utils.nans((kernel.NUM_SERIES, 24))
+            self._call_kernel(precip_available, precip, temperatures, pet_hamon, series, matrices)
+        else:
+            series = utils.nans((len(SERIES), 24))
+            forcing = self._prepare_forcing(preprocess_forcing(
+                precip_available=precip_available,
+                precip=precip,
+                temperatures=temperatures,
+                pet_hamon=pet_hamon,
+                grow_trigger=self.grow_trigger,
+                et_exp_grow=self.et_exp_grow,
+                et_exp_dorm=self.et_exp_dorm,
+            ))
+            for hour in range(24):
+                fluxes = self._calculate_timestep(forcing, hour)
+                series[:, hour] = [fluxes[name] for name in SERIES]
+                if matrices:
+                    values = self._get_matrix_values()
+                    for name, matrix in matrices.items():
+                        matrix[hour] = values[name]
+
+        if not record:
+            return
+
+        # Aggregate the hourly values to daily values
+        for k, (name, attribute) in enumerate(SERIES.items()):
+            if name in ("saturation_deficit_avg", "root_zone_avg"):
+                getattr(self, attribute)[day] = np.average(series[k])
+            elif name == "flow_predicted" and self.option_min_max:
+                self.flow_predicted[:, day] = (
+                    np.sum(series[k]), np.max(series[k]), np.min(series[k]),
+                    np.median(series[k]), np.average(series[k])
+                )
+            else:
+                getattr(self, attribute)[day] = np.sum(series[k])
+
+        aggregations = {
+            "unsaturated_zone_storages": np.sum,
+            "root_zone_storages": np.average,
+            "saturation_deficit_locals": np.average,
+            "evaporations": np.sum,
+            "precip_excesses_op": np.sum,
+        }
+        for name, matrix in matrices.items():
+            row = (day - self.record_offsets[name]) // max(1, self.record[name] // 24)
+            if self.record[name] == 1:
+                getattr(self, name)[row] = aggregations[name](matrix, axis=0)
+            else:
+                getattr(self, name)[row] = matrix[0]
+
+    def _run_timestep(self, forcing, i):
+        """Calculate water fluxes and flow prediction for timestep i of the
+        forcing and save them to the output arrays."""
+        fluxes = self._calculate_timestep(forcing, i)
+
+        # Saving variables of interest
+        # ============================
+        self._record_matrices(i)
+        for name, attribute in SERIES.items():
+            getattr(self, attribute)[i] = fluxes[name]
+
+    def _prepare_forcing(self, forcing):
+        """Return the forcing with the values of each timestep that only
+        depend on the forcing and on the model state at the start of the
+        forcing, see _add_moisture_conditions and _add_infiltration, and
+        move that state to the end of the forcing.
+
+        :param forcing: A dict of forcing arrays, see preprocess_forcing
+        :type forcing: dict
+        :return forcing: A dict of forcing arrays
+        :rtype: dict
+        """
+        return self._add_infiltration(self._add_moisture_conditions(forcing))
+
+    def _add_moisture_conditions(self, forcing):
+        """Return the forcing with the antecedent moisture conditions before
+        each timestep of the forcing and after the last timestep, calculated
+        from the current amc_window, and move the amc_window to the end of
+        the forcing.
+
+        :param forcing: A dict of forcing arrays, see preprocess_forcing
+        :type forcing: dict
+        :return forcing: A dict of forcing arrays with moisture_conditions
+        :rtype: dict
+        """
+        return dict(
+            forcing,
+            moisture_conditions=self._calculate_moisture_conditions(forcing["amc_precip"])
+        )
 
+    def _add_infiltration(self, forcing):
+        """Return the forcing with the infiltration, infiltration excess,
+        precipitation for recharge and impervious area flow of each timestep,
+        calculated from the current infiltration ponding state starting at
+        the current timestep, and move the ponding state to the end of the
+        forcing.
+
+        The infiltration only depends on the precipitation available and the
+        ponding state, and the impervious area flow on the precipitation for
+        recharge and the antecedent moisture conditions, not on the soil
+        zone storages, so they are calculated for all timesteps before the
+        timestep loop. The infiltration is calculated with the compiled
+        kernel if the engine is jit, otherwise with infiltration_cache.
+
+        :param forcing: A dict of forcing arrays with moisture_conditions,
+                        see _add_moisture_conditions
+        :type forcing: dict
+        :return forcing: A dict of forcing arrays with infiltration,
+                         infiltration_excess, precip_for_recharge and
+                         flow_predicted_impervious
+        :rtype: dict
+        """
+        precip_available = forcing["precip_available"]
+        if self.engine == "jit":
+            infiltration_array = kernel.infiltration_series(
+                self._get_kernel_parameters(),
+                np.asarray(self.k_dist, dtype=float),
+                np.asarray(self.ak_zones, dtype=float),
+                precip_available,
+                self.current_timestep,
+                self.inf_state.values,
+            )
+        else:
+            infiltration_array = np.zeros(len(precip_available))
+            for n, value in enumerate(precip_available):
+                if value <= 0:
+                    # Either no precip, or all precip evaporates.
+                    self.inf_state.reset()
                 else:
-                    self.evaporation[j] = 0
-                    self.root_zone_storage[j] = (
-                                     self.root_zone_storage[j]
-                             )
-
-                # Overland flow
-                # =============
-                # If the excess precipitation is greater than zero, then
-                # calculate the predicted overland flow from the amount of
-                # excess precipitation and the saturated area for the current
-                # twi increment
-
-                if self.precip_excesses[j] > 0:
-                    self.flow_predicted_overland = (
-                        self.flow_predicted_overland
-                        + (self.precip_excesses[j]  # this is saturation overland flow.
-                           * self.twi_saturated_areas[j])
+                    # if slowest K value equals or exceeds precip, everything infiltrates.
+                    infiltration_array[n] = 1000 * self.infiltration_cache.infiltration_zones(
+                        infiltration.infiltration_zones,
+                        self.current_timestep + n + 1, self.dt, value / 1000, self.k_dist,
+                        self.ak_zones, self.capillary_drive, self.scaling_factor, self.inf_state
                     )
 
+        raining = precip_available > 0
+        infiltration_excess = np.where(
+            raining & (precip_available - infiltration_array >= 1.0e-4),
+            precip_available - infiltration_array,
+            0.0
+        )
+        precip_for_recharge = np.where(raining, precip_available - infiltration_excess, 0.0)
+
+        # Impervious area flow, using TR55 SCS Curve Number method instead
+        # of equation 37 in Wolock, 1993, with the antecedent moisture
+        # conditions before each timestep
+        flow_predicted_impervious = hydrocalcs.runoff_vectorized(
+            grow_season=forcing["growing"],
+            precipitation=precip_for_recharge,
+            curve_number=self.impervious_curve_number,
+            amc=forcing["moisture_conditions"][:-1],
+        )
+
+        return dict(
+            forcing,
+            infiltration=infiltration_array,
+            infiltration_excess=infiltration_excess,
+            precip_for_recharge=precip_for_recharge,
+            flow_predicted_impervious=flow_predicted_impervious,
+        )
+
+    def _calculate_moisture_conditions(self, amc_precip):
+        """Return the antecedent moisture conditions before each timestep of
+        amc_precip and after the last timestep, see
+        hydrocalcs.antecedent_moisture, and move the amc_window to the end of
+        amc_precip.
+
+        :param amc_precip: Precipitation available of each timestep
+        :type amc_precip: numpy.ndarray
+        :return moisture_conditions: Array of size len(amc_precip) + 1
+        :rtype: numpy.ndarray
+        """
+        moisture_conditions = hydrocalcs.antecedent_moisture(
+            amc_precip, self.amc_lookback, self.amc_window
+        )
+        self.amc_window = np.maximum(
+            np.concatenate((self.amc_window, amc_precip))[-self.amc_lookback:], 0
+        )
+
+        return moisture_conditions
 
+    def _calculate_timestep(self, forcing, n):
+        """Calculate water fluxes and flow prediction for the current
+        timestep from its forcing and advance the model state.
+
+        :param forcing: A dict of forcing arrays, see preprocess_forcing
+        :type forcing: dict
+        :param n: Index of the current timestep in the forcing arrays
+        :type n: int
+        :return fluxes: A dict of the values of the timestep, see SERIES
+        :rtype: dict
+        """
+        i = self.current_timestep
+        precip_available = forcing["precip_available"][n]
+        precip = forcing["precip"][n]
+        pet = forcing["pet_hamon"][n]
+        precip_for_evaporation = forcing["precip_for_evaporation"][n]
+        # Initialize predicted flows, precipitation in excess
+        # of evapotranspiration and field-capacity storage, and
+        # local saturation deficit
+        self.sat_flow = 0
+        self.qroot = 0
+        self.return_flow = 0
+        self.flow_predicted_overland = 0
+        self.flow_predicted_vertical_drainage_flux = 0
+        self.flow_predicted_karst = 0
+        self.q_riparian = 0
+        self.adj_flow = 0
+        self.qsrip = 0
+        self.transpiration = 0
+        self.precip_excesses = np.zeros(self.num_twi_increments)
+        self.saturation_deficit_local = utils.nans(self.num_twi_increments)
+
+        # Assign water available for evapotranspiration and
+        # water available for recharge based on how precipitation
+        # compares to potential evapotranspiration
+        # If precip_available < 0 => moisture has to be taken out of soil
+        # to meet the pet demand
+        # If precip_available > 0 => then surplus precip soaks into the
+        # ground to recharge soil moisture and any left over after that
+        # runs off as streamflow
+        # If precip_available = 0 => no surplus precip
+
+        # Note: precip for evaporation is calculated in preprocess_forcing,
+        # the infiltration and the precip for recharge in _add_infiltration
+        self.precip_for_recharge = forcing["precip_for_recharge"][n]
+        infiltration_array = forcing["infiltration"][n]
+        infiltration_excess = forcing["infiltration_excess"][n]
+
+        # Set the et_exponent based on current temperature, see
+        # preprocess_forcing
+        self.et_exponent = forcing["et_exponent"][n]
+
+        # Update the twi increments with the selected engine
+        # Note: step() uses the vectorized engine when the engine is jit
+        if self.engine == "python":
+            self._update_twi_increments_loop(precip_for_evaporation)
+        else:
+            self._update_twi_increments_vectorized(precip_for_evaporation)
 
-                # Saving variables of interest
-                # ============================
-                self.unsaturated_zone_storages[i][j] = self.unsaturated_zone_storage[j]
-                self.precip_excesses_op[i][j] = self.precip_excesses[j] * self.twi_saturated_areas[j]
-                self.root_zone_storages[i][j] = self.root_zone_storage[j]
-                self.saturation_deficit_locals[i][j] = self.saturation_deficit_local[j]
-                self.evaporations[i][j] = self.evaporation[j]
+        # CONTINUE TIMESTEP LOOP
 
+        # Accounting for infiltration excess.
+        pex_flow = self.flow_predicted_overland
 
+        self.flow_predicted_overland = (
+                self.flow_predicted_overland + infiltration_excess
+        )
 
-                # END OF TWI INCREMENTS LOOP
 
-            # CONTINUE TIMESTEP LOOP
+        # Subsurface flow (base flow)
+        # ===========================
 
-            # Accounting for infiltration excess.
-            self.return_flow_totals[i] = self.return_flow
-            self.pex_flow[i] = self.flow_predicted_overland
+        # Calculate the subsurface flow rate - equation 30 in Wolock, 1993
+        self.subsurface_flow_rate_ratio = (
+            self.saturation_deficit_avg / self.scaling_parameter
+        )
 
-            self.flow_predicted_overland = (
-                    self.flow_predicted_overland + self.infiltration_excess[i]
+        if self.subsurface_flow_rate_ratio > 100:
+            self.flow_predicted_subsurface = 0
+        else:
+            self.flow_predicted_subsurface = (
+                self.flow_subsurface_max
+                * math.exp(-1 * self.subsurface_flow_rate_ratio)
             )
 
+        # If karst option is set to True, then send flow to karst
+        # and set the subsurface flow to 0 "bypassing" subsurface.
+        if self.option_karst:
+            self.flow_predicted_karst = self.flow_predicted_subsurface
+            self.flow_predicted_subsurface = 0
 
-            # Subsurface flow (base flow)
-            # ===========================
+        # Update the average watershed saturation deficit with the
+        # subsurface flow and the vertical drainage flux
+        # Possible differences here is we do not specify return flows or pumpage.
 
-            # Calculate the subsurface flow rate - equation 30 in Wolock, 1993
-            self.subsurface_flow_rate_ratio = (
-                self.saturation_deficit_avg / self.scaling_parameter
-            )
+        self.saturation_deficit_avg = (
+            self.saturation_deficit_avg
+            - self.flow_predicted_vertical_drainage_flux
+            + self.flow_predicted_subsurface
+            + self.return_flow
+            + self.qroot
+        )
+
+        if self.saturation_deficit_avg < 0:
+            self.saturation_deficit_avg = 0
+
+        # Impervious area flow
+        # ====================
+        # The contribution of impervious areas to streamflow only depends
+        # on the forcing, it is calculated for all timesteps of the forcing,
+        # see _add_infiltration
+        self.flow_predicted_impervious_area = forcing["flow_predicted_impervious"][n]
+
+        self.moisture_conditions = forcing["moisture_conditions"][n + 1]
 
-            if self.subsurface_flow_rate_ratio > 100:
-                self.flow_predicted_subsurface = 0
+        # Total flow
+        # ==========
+        # Calculate the total flow in a given timestep
+        # Equation 1 in Wolock, 1993
+
+        self.flow_predicted_total = (
+            self.flow_predicted_subsurface
+            + self.flow_predicted_overland
+            + self.return_flow
+            + self.flow_predicted_karst
+        )
+
+        # Channel routing
+        # ===============
+        # Calculate the flow delivered to the stream
+        # Note: self.flow_predicted_karst will be 0 unless
+        # the option for karst is set to True.
+        self.flow_predicted_stream = (
+            self.flow_predicted_total
+            * (1 - self.percent_riparian - self.impervious_area_fraction * self.eff_imp)
+            + self.flow_predicted_impervious_area * (self.impervious_area_fraction * self.eff_imp)
+        )
+
+        self.transpiration = (self.transpiration
+                              * (1 - self.percent_riparian
+                                 - self.impervious_area_fraction * self.eff_imp))
+
+        if self.flow_predicted_stream < 0:
+            self.flow_predicted_stream = 0
+
+        self.riparian_storage = (
+                self.riparian_storage - self.transpiration
+                + self.flow_predicted_stream * self.lake_fraction
+                + precip_available * self.percent_riparian
+        )
+
+        if self.riparian_storage > 0:
+            self.q_riparian = self.riparian_storage / self.lake_delay
+            self.riparian_storage = self.riparian_storage - self.q_riparian
+            self.max_storage = 100000000
+
+            if self.riparian_storage > self.max_storage:
+                self.q_riparian = self.q_riparian + self.riparian_storage - self.max_storage
+                self.riparian_storage = self.max_storage
+            if self.q_riparian <= self.flow_predicted_stream * self.lake_fraction:
+                self.adj_flow = (1 - self.lake_fraction) + self.q_riparian / self.flow_predicted_stream
             else:
-                self.flow_predicted_subsurface = (
-                    self.flow_subsurface_max
-                    * math.exp(-1 * self.subsurface_flow_rate_ratio)
-                )
+                self.adj_flow = 1
+            self.qsrip = self.q_riparian - self.flow_predicted_stream * self.lake_fraction # not sure what this does.
+        else:
+            self.q_riparian = 0
 
-            # If karst option is set to True, then send flow to karst
-            # and set the subsurface flow to 0 "bypassing" subsurface.
-            if self.option_karst:
-                self.flow_predicted_karst = self.flow_predicted_subsurface
-                self.flow_predicted_subsurface = 0
+        self.flow_predicted_stream = (
+            self.flow_predicted_stream * (1 - self.lake_fraction)
+            + self.q_riparian
+        )
 
-            # Update the average watershed saturation deficit with the
-            # subsurface flow and the vertical drainage flux
-            # Possible differences here is we do not specify return flows or pumpage.
+        # Adjust the flow delivered to the stream by the
+        # channel travel time
+        self.flow_predicted_stream = (
+            self.flow_predicted_stream / 1 # self.channel_travel_time
+        )
+
+        # Final predicted flow and variables of interest
+        # ==============================================
+        if precip_available > 0:
+            evaporation_actual = pet
+        else:
+            if precip > 0:
+                evaporation_actual = self.evaporation[0] + precip
+            else:
+                evaporation_actual = self.evaporation[0]
+
+        self.current_timestep = i + 1
+
+        return {
+            "flow_predicted": self.flow_predicted_stream,
+            "flow_predicted_impervious": self.flow_predicted_impervious_area,
+            "saturation_deficit_avg": self.saturation_deficit_avg,
+            "evaporation_actual": evaporation_actual,
+            "root_zone_avg": np.sum(self.root_zone_storage) / self.num_twi_increments,
+            "return_flow": self.return_flow,
+            "overland_flow": self.flow_predicted_overland,
+            "infiltration": infiltration_array,
+            "infiltration_excess": infiltration_excess,
+            "pex_flow": pex_flow,
+            "sub_flow": self.flow_predicted_subsurface,
+            "karst_flow": self.flow_predicted_karst if self.option_karst else 0,
+            "q_root": self.qroot,
+            "precip_for_evaporation": precip_for_evaporation,
+        }
+
+    def _run_kernel(self, num_timesteps=None, record=True, objective_bound=None):
+        """Calculate water fluxes and flow prediction for all timesteps with
+        the compiled kernel, see _call_kernel.
+
+        :param num_timesteps: Number of timesteps calculated from the start
+                              of the forcing arrays, all timesteps if None
+        :type num_timesteps: int
+        :param record: Save the output series and recorded matrices, False
+                       for spin-up cycles
+        :type record: bool
+        :param objective_bound: Bound of the Nash-Sutcliffe efficiency of
+                                the run, see run
+        :type objective_bound: metrics.NashSutcliffeBound
+        """
+        if num_timesteps is None:
+            num_timesteps = self.num_timesteps
+        series = utils.nans((kernel.NUM_SERIES, num_timesteps))
+        recorded = self.record if record else {}
+
+        # With an objective bound and no recorded matrices, the kernel is
+        # called for BOUND_CHUNK_DAYS days at a time and the bound is
+        # updated after each call
+        steps = 24 if self.option_randomize_daily_to_hourly else 1
+        if objective_bound is not None and not recorded:
+            chunk = BOUND_CHUNK_DAYS * steps
+        else:
+            chunk = num_timesteps
+
+        for start in range(0, num_timesteps, chunk):
+            stop = min(start + chunk, num_timesteps)
+            self._call_kernel(
+                self.precip_available[start:stop],
+                self.precip[start:stop],
+                self.temperatures[start:stop],
+                self.pet_hamon[start:stop],
+                series[:, start:stop],
+                {name: getattr(self, name) for name in recorded},
+                record_strides=recorded,
+                record_offsets=self.record_offsets,
+            )
+            if objective_bound is not None:
+                flows = series[kernel.FLOW_PREDICTED, start:stop].reshape(-1, steps).sum(axis=1)
+                if not self._update_objective_bound(objective_bound, flows, start // steps):
+                    self.aborted = True
+                    return
+
+        if not record:
+            return
+
+        self.flow_predicted = series[kernel.FLOW_PREDICTED]
+        self.flow_predicted_impervious = series[kernel.FLOW_PREDICTED_IMPERVIOUS]
+        self.saturation_deficit_avgs = series[kernel.SATURATION_DEFICIT_AVGS]
+        self.evaporation_actual = series[kernel.EVAPORATION_ACTUAL]
+        self.root_zone_avg = series[kernel.ROOT_ZONE_AVG]
+        self.return_flow_totals = series[kernel.RETURN_FLOW_TOTALS]
+        self.overland_flow = series[kernel.OVERLAND_FLOW]
+        self.infiltration_array = series[kernel.INFILTRATION_ARRAY]
+        self.infiltration_excess = series[kernel.INFILTRATION_EXCESS]
+        self.pex_flow = series[kernel.PEX_FLOW]
+        self.sub_flow = series[kernel.SUB_FLOW]
+        self.karst_flow = series[kernel.KARST_FLOW]
+        self.q_root = series[kernel.Q_ROOT]
+        self.precip_for_evaporation = series[kernel.PRECIP_FOR_EVAPORATION]
+
+    def _call_kernel(self, precip_available, precip, temperatures, pet_hamon, series, matrices,
+                     record_strides=None, record_offsets=None):
+        """Calculate water fluxes and flow prediction for the timesteps of the
+        forcing arrays with the compiled kernel.
+
+        The model parameters and the model state are packed into the arrays
+        used by kernel.run, and the model state at the end of the last
+        timestep is unpacked back into the model attributes. The series
+        array, see the series indices in the kernel module, and the matrices
+        are filled in place.
+
+        :param series: Output series of size NUM_SERIES x num_timesteps
+        :type series: numpy.ndarray
+        :param matrices: A dict of names to matrices to record, see MATRICES
+        :type matrices: dict
+        :param record_strides: A dict of names to record strides, every
+                               timestep by default
+        :type record_strides: dict
+        :param record_offsets: A dict of names to record offsets, the first
+                               timestep by default
+        :type record_offsets: dict
+        """
+        if record_strides is None:
+            record_strides = {name: 1 for name in matrices}
+        if record_offsets is None:
+            record_offsets = {}
+        parameters = self._get_kernel_parameters()
+        state = self._get_kernel_state()
+        root_zone_storage = np.array(self.root_zone_storage, dtype=float)
+        unsaturated_zone_storage = np.array(self.unsaturated_zone_storage, dtype=float)
+        saturation_deficit_local = np.zeros(self.num_twi_increments)
+        evaporation = np.zeros(self.num_twi_increments)
+
+        # Matrices that are not recorded are passed as empty matrices
+        empty = np.empty((0, self.num_twi_increments))
+        strides = np.array([record_strides.get(name, 0) if name in matrices else 0
+                            for name in MATRICES], dtype=np.int64)
+        offsets = np.array([record_offsets.get(name, 0) for name in MATRICES], dtype=np.int64)
+        forcing = self._prepare_forcing(preprocess_forcing(
+            precip_available=precip_available,
+            precip=precip,
+            temperatures=temperatures,
+            pet_hamon=pet_hamon,
+            grow_trigger=self.grow_trigger,
+            et_exp_grow=self.et_exp_grow,
+            et_exp_dorm=self.et_exp_dorm,
+        ))
+
+        kernel.run(
+            parameters,
+            np.asarray(self.twi_values, dtype=float),
+            np.asarray(self.twi_saturated_areas, dtype=float),
+            forcing["precip_available"],
+            forcing["precip"],
+            forcing["temperatures"],
+            forcing["pet_hamon"],
+            forcing["precip_for_recharge"],
+            forcing["infiltration"],
+            forcing["infiltration_excess"],
+            forcing["flow_predicted_impervious"],
+            state,
+            forcing["moisture_conditions"],
+            root_zone_storage,
+            unsaturated_zone_storage,
+            saturation_deficit_local,
+            evaporation,
+            series,
+            strides,
+            offsets,
+            *[matrices.get(name, empty) for name in MATRICES]
+        )
 
-            self.saturation_deficit_avg = (
+        self._set_kernel_state(state)
+        self.root_zone_storage = root_zone_storage
+        self.unsaturated_zone_storage = unsaturated_zone_storage
+        self.saturation_deficit_local = saturation_deficit_local
+        self.evaporation = evaporation
+
+    def _get_kernel_parameters(self):
+        """Return the model parameters packed into an array, see the
+        parameter indices in the kernel module."""
+        parameters = np.zeros(kernel.NUM_PARAMETERS)
+        parameters[kernel.SCALING_PARAMETER] = self.scaling_parameter
+        parameters[kernel.TWI_MEAN] = self.twi_mean
+        parameters[kernel.TWI_ADJ] = self.twi_adj
+        parameters[kernel.ROOT_ZONE_STORAGE_MAX] = self.root_zone_storage_max
+        parameters[kernel.GRAVITY_DRAINED_POROSITY] = self.gravity_drained_porosity
+        parameters[kernel.SOIL_DEPTH_ROOTS] = self.soil_depth_roots
+        parameters[kernel.MACROPORE_FRACTION] = self.macropore_fraction
+        parameters[kernel.VERTICAL_DRAINAGE_FLUX_INITIAL] = self.vertical_drainage_flux_initial
+        parameters[kernel.FLOW_SUBSURFACE_MAX] = self.flow_subsurface_max
+        parameters[kernel.OPTION_KARST] = self.option_karst
+        parameters[kernel.GROW_TRIGGER] = self.grow_trigger
+        parameters[kernel.ET_EXP_GROW] = self.et_exp_grow
+        parameters[kernel.ET_EXP_DORM] = self.et_exp_dorm
+        parameters[kernel.IMPERVIOUS_AREA_FRACTION] = self.impervious_area_fraction
+        parameters[kernel.EFF_IMP] = self.eff_imp
+        parameters[kernel.PERCENT_RIPARIAN] = self.percent_riparian
+        parameters[kernel.LAKE_FRACTION] = self.lake_fraction
+        parameters[kernel.LAKE_DELAY] = self.lake_delay
+        parameters[kernel.MAX_STORAGE] = self.max_storage
+        parameters[kernel.CAPILLARY_DRIVE] = self.capillary_drive
+        parameters[kernel.SCALING_FACTOR] = self.scaling_factor
+        parameters[kernel.DT] = self.dt
+
+        return parameters
+
+    def _get_kernel_state(self):
+        """Return the scalar model state packed into an array, see the state
+        indices in the kernel module."""
+        state = np.zeros(kernel.NUM_STATES)
+        state[kernel.SATURATION_DEFICIT_AVG] = self.saturation_deficit_avg
+        state[kernel.MOISTURE_CONDITIONS] = self.moisture_conditions
+        state[kernel.RIPARIAN_STORAGE] = self.riparian_storage
+        state[kernel.TIMESTEP] = self.current_timestep
+
+        return state
+
+    def _set_kernel_state(self, state):
+        """Unpack the scalar model state from an array, see the state indices
+        in the kernel module."""
+        self.saturation_deficit_avg = state[kernel.SATURATION_DEFICIT_AVG]
+        self.moisture_conditions = state[kernel.MOISTURE_CONDITIONS]
+        self.riparian_storage = state[kernel.RIPARIAN_STORAGE]
+        self.current_timestep = int(state[kernel.TIMESTEP])
+
+    def _update_twi_increments_loop(self, precip_for_evaporation):
+        """Update the soil zone storages and fluxes of each twi increment,
+        one increment at a time, for the current timestep."""
+        for j in range(self.num_twi_increments):
+
+            # Local saturation/storage/drainage deficit
+            # =========================================
+            # Calculate the local saturation deficit
+            self.saturation_deficit_local[j] = (
                 self.saturation_deficit_avg
-                - self.flow_predicted_vertical_drainage_flux
-                + self.flow_predicted_subsurface
-                + self.return_flow
-                + self.qroot
+                + self.twi_offsets[j]
             )
 
-            if self.saturation_deficit_avg < 0:
-                self.saturation_deficit_avg = 0
+            self.soil_root_deficit = (self.root_zone_storage_max - self.root_zone_storage[j]) * self.twi_saturated_areas[j]
+            self.water_table_depth = self.soil_depth_roots
+            self.saturation_excess = ((self.gravity_drained_porosity * self.water_table_depth)
+                                      - self.saturation_deficit_local[j]) * self.twi_saturated_areas[j]
+
+            # Accounts for the root zone storage in deficit zone.  Adapted from KYTopModel.  Removed updating
+            # soil root zone numbers, saturation excess is added to qroot.
+            if self.saturation_excess <= 0:
+                self.saturation_deficit_local[j] = self.saturation_deficit_local[j]
+
+            elif self.saturation_excess > 0:
+                if self.saturation_excess < self.soil_root_deficit:
+                    #self.root_zone_storage[j] = self.root_zone_storage[j] + self.saturation_excess
+                    self.qroot = (self.qroot + self.saturation_excess
+                                  )
+                    # self.saturation_deficit_local[j] = (
+                    #             self.gravity_drained_porosity
+                    #             * self.water_table_depth)
+
+                elif self.root_zone_storage[j] == self.root_zone_storage_max:
+
+                    # Robert Hudson fix
+                    #self.saturation_deficit_local[j] = (self.saturation_deficit_local[j] + self.soil_root_deficit)
+                    self.qroot = self.qroot + self.soil_root_deficit
+                # else:
+                #     self.saturation_deficit_local[j] = (self.saturation_deficit_local[j] + self.soil_root_deficit)
+
+            # If local saturation deficit is less than zero, meaning soil
+            # is overly saturated, then set the local saturation deficit
+            # to zero meaning soil is saturated and water table is at the
+            # land surface
+            if self.saturation_deficit_local[j] < 0:
+                self.return_flow = self.return_flow - self.saturation_deficit_local[j] * self.twi_saturated_areas[j]
+                self.saturation_deficit_local[j] = 0
+
+            # If the unsaturated zone storage is greater than the local
+            # saturation deficit, update the root zone storage with the
+            # difference and assign the local saturation deficit to the
+            # unsaturated zone storage
+            if self.unsaturated_zone_storage[j] > self.saturation_deficit_local[j]:
+                self.root_zone_storage[j] = (
+                    self.root_zone_storage[j] +
+                    + (self.unsaturated_zone_storage[j]
+                       - self.saturation_deficit_local[j])
+                )
+                self.unsaturated_zone_storage[j] = self.saturation_deficit_local[j]
+
 
-            # Impervious area flow
-            # ====================
-            # Calculate the contribution of impervious areas to streamflow -
-            # using TR55 SCS Curve Number method instead of
-            # equation 37 in Wolock, 1993.
-            # If there is water available, then calculate the
-            # impervious area flow otherwise there is no impervious area flow
+            # Precipitation
+            # =============
+            # If there is precipitation available, then process the
+            # precipitation by calculating the excess precipitation and
+            # adding it to an array of precipitation excesses over all twi
+            # increments
             if self.precip_for_recharge > 0:
-                if self.temperatures[i] > self.grow_trigger:
-                    growing = True
-                else:
-                    growing = False
-                self.flow_predicted_impervious_area = (
-                    hydrocalcs.runoff(
-                        grow_season=growing,
-                        precipitation=self.precip_for_recharge,
-                        curve_number=self.impervious_curve_number,
-                        amc=self.moisture_conditions
+                self.precip_excess = (
+                    self.precip_for_recharge
+                    - (self.saturation_deficit_local[j]
+                       - self.unsaturated_zone_storage[j])
+                    - (self.root_zone_storage_max
+                       - self.root_zone_storage[j])
+                )
+                self.precip_excesses[j] = (
+                    self.precip_excesses[j] + self.precip_excess
+                )
+
+                # If the excess precipitation calculated is less than 0.0,
+                # then reset the excess precipitation to 0.0
+                if self.precip_excess < 0:
+                    self.precip_excess = 0
+
+                self.precip_excess_diff = (
+                    abs(self.precip_excess
+                        - self.precip_for_recharge)
+                )
+
+                if not self.precip_excess_diff <= 1E-20:
+                    # Calculate the root zone storage amount from the
+                    # differences between
+                    # 1. (1 - self.macropore_fraction): the amount that is
+                    # not bypassing the soil root zone
+                    # 2. (self.precip_for_recharge
+                    #     - self.precip_excess): the amount that is
+                    # available without any excess
+                    self.root_zone_storage[j] = (
+                        self.root_zone_storage[j]
+                        + (1.0 - self.macropore_fraction)
+                        * (self.precip_for_recharge - self.precip_excess)
                     )
-                    #* self.impervious_area_fraction
+
+                    # Calculate the unsaturated zone storage amount from
+                    # the amount bypassing the soil root zone and the
+                    # amount that is available without any excess
+
+                    self.unsaturated_zone_storage[j] = (
+                        self.unsaturated_zone_storage[j]
+                        + self.macropore_fraction
+                        * (self.precip_for_recharge
+                           - self.precip_excess)
+                    )
+
+                    # If the root zone storage is greater than the maximum
+                    # soil root zone storage, then added the difference
+                    # to the unsaturated zone storage and assign the root
+                    # zone storage to the maximum root zone storage
+                    if self.root_zone_storage[j] > self.root_zone_storage_max:
+                        self.unsaturated_zone_storage[j] = (
+                            self.unsaturated_zone_storage[j]
+                            + (self.root_zone_storage[j]
+                               - self.root_zone_storage_max)
+                        )
+                        self.root_zone_storage[j] = self.root_zone_storage_max
+
+                    elif self.unsaturated_zone_storage[j] > self.saturation_deficit_local[j]:
+                        self.root_zone_storage[j] = (
+                                self.root_zone_storage[j]
+                                + (self.unsaturated_zone_storage[j]
+                                   - self.saturation_deficit_local[j])
+                        )
+                        self.unsaturated_zone_storage[j] = self.saturation_deficit_local[j]
+
+                    if self.root_zone_storage[j] > self.root_zone_storage_max:
+                        self.precip_excesses[j] = (
+                            (self.root_zone_storage[j] - self.root_zone_storage_max) * self.twi_saturated_areas[j]
+                        )
+
+                        self.root_zone_storage[j] = self.root_zone_storage_max
+
+                self.sat_flow = (self.precip_excesses[j] + self.sat_flow)
+
+                    # else:
+                    #     # If the unsaturated zone storage is greater than
+                    #     # the local saturation deficit, update the root
+                    #     # zone storage with the difference and assign the
+                    #     # local saturation deficit to the unsaturated zone
+                    #     # storage (same step preformed in calculation of
+                    #     # the local saturation deficit above)
+                    #     if self.unsaturated_zone_storage[j] > self.saturation_deficit_local[j]:
+                    #         self.root_zone_storage[j] = (
+                    #             self.root_zone_storage[j]
+                    #             + (self.unsaturated_zone_storage[j]
+                    #                - self.saturation_deficit_local[j])
+                    #         )
+                    #
+
+
+            # Drainage from unsaturated zone storage
+            # ======================================
+            # If there is water available for vertical drainage, then
+            # calculate the vertical drainage flux (millimeters/day)
+            # equation 23 in Wolock, 1993
+            # Note: self.vertical_drainage_flux_initial =
+            # self.saturated_hydraulic_conductivity
+            # * self.timestep_daily_fraction
+            if self.saturation_deficit_local[j] > 0:
+                self.vertical_drainage_flux = (
+                    self.vertical_drainage_flux_initial
+                    * (self.unsaturated_zone_storage[j]
+                       / self.saturation_deficit_local[j])
                 )
 
-                if self.precip_available[i] <= 0:
-                    amc_precip = 0
-                else:
-                    amc_precip = self.precip_available[i]
-                if self.precip_available[i - 120] <= 0:
-                    amc_last_five = 0
-                else:
-                    amc_last_five = self.precip_available[i - 120]
-                if i > 120:
-                    self.moisture_conditions = (self.moisture_conditions
-                                                + amc_precip
-                                                - amc_last_five
-                                                )
-                else:
-                    self.moisture_conditions = self.moisture_conditions + amc_precip
+                # If the vertical drainage flux is greater than the soil
+                # water available for drainage (unsaturated_zone_storage),
+                # then assign the vertical drainage flux to the
+                # unsaturated_zone_storage
+                if self.vertical_drainage_flux > self.unsaturated_zone_storage[j]:
+                    self.vertical_drainage_flux = self.unsaturated_zone_storage[j]
+
+                # Update the unsaturated zone storage by removing the
+                # vertical drainage flux amount from the amount of soil
+                # water available to drain
+                self.unsaturated_zone_storage[j] = self.unsaturated_zone_storage[j] - self.vertical_drainage_flux
+
+                # Calculate the predicted vertical drainage flux from the
+                # vertical drainage amount and the current saturated
+                # land-surface area in the watershed
+                self.flow_predicted_vertical_drainage_flux = (
+                    self.flow_predicted_vertical_drainage_flux
+                    + (self.vertical_drainage_flux
+                       * self.twi_saturated_areas[j])
+                )
 
-            else:
-                self.flow_predicted_impervious_area = 0
-                if self.precip_available[i] <= 0:
-                    amc_precip = 0
-                else:
-                    amc_precip = self.precip_available[i]
-                if self.precip_available[i - 120] <= 0:
-                    amc_last_five = 0
-                else:
-                    amc_last_five = self.precip_available[i - 120]
-                if i > 120:
-                    self.moisture_conditions = (self.moisture_conditions
-                                                + amc_precip
-                                                - amc_last_five
-                                                )
-                else:
-                    self.moisture_conditions = self.moisture_conditions + amc_precip
+            # Evaporation from soil root zone storage
+            # =======================================
+            # If there is evaporation in excess of precipitation,
+            # then compute evaporation.
+            # Note: Evaporation is calculated using AET formula from
+            # Table 2 of USGS SIR 20155143 (see reference [2] in
+            # module docstring)
+            if precip_for_evaporation > 0:
+
+                self.evaporation[j] = (
+                        precip_for_evaporation *
+                        (self.root_zone_storage[j] / self.root_zone_storage_max)**self.et_exponent
+                )
+
+                # If the precipitation available for evapotranspiration is
+                # greater than the soil root zone storage amount, then
+                # assign all the water in the soil root zone storage to the
+                # precipitation available for evapotranspiration
+                if self.evaporation[j] > self.root_zone_storage[j]:
+                    self.evaporation[j] = self.root_zone_storage[j]
+
+                # Calculate the amount of water in the soil root zone
+                # storage by removing the amount available for
+                # evapotranspiration
+                # note: soil root zone storage will be depleted (equal 0.0)
+                # if the condition above is true where the precipitation
+                # available for evapotranspiration is greater than the soil
+                # root zone storage amount
+
+                self.transpiration = self.transpiration + (self.evaporation[j] * self.twi_saturated_areas[j])
+                self.root_zone_storage[j] = (
+                    self.root_zone_storage[j] - self.evaporation[j]
+                )
 
-            self.flow_predicted_impervious[i] = self.flow_predicted_impervious_area
-            self.sub_flow[i] = self.flow_predicted_subsurface
-            self.overland_flow[i] = self.flow_predicted_overland
-            if self.option_karst:
-                self.karst_flow[i] = self.flow_predicted_karst
             else:
-                self.karst_flow[i] = 0
-
-            # Total flow
-            # ==========
-            # Calculate the total flow in a given timestep
-            # Equation 1 in Wolock, 1993
-
-            self.flow_predicted_total = (
-                self.flow_predicted_subsurface
-                + self.flow_predicted_overland
-                + self.return_flow
-                + self.flow_predicted_karst
-            )
+                self.evaporation[j] = 0
+                self.root_zone_storage[j] = (
+                                 self.root_zone_storage[j]
+                         )
+
+            # Overland flow
+            # =============
+            # If the excess precipitation is greater than zero, then
+            # calculate the predicted overland flow from the amount of
+            # excess precipitation and the saturated area for the current
+            # twi increment
+
+            if self.precip_excesses[j] > 0:
+                self.flow_predicted_overland = (
+                    self.flow_predicted_overland
+                    + (self.precip_excesses[j]  # this is saturation overland flow.
+                       * self.twi_saturated_areas[j])
+                )
 
-            # Channel routing
-            # ===============
-            # Calculate the flow delivered to the stream
-            # Note: self.flow_predicted_karst will be 0 unless
-            # the option for karst is set to True.
-            self.flow_predicted_stream = (
-                self.flow_predicted_total
-                * (1 - self.percent_riparian - self.impervious_area_fraction * self.eff_imp)
-                + self.flow_predicted_impervious_area * (self.impervious_area_fraction * self.eff_imp)
-            )
 
-            self.transpiration = (self.transpiration
-                                  * (1 - self.percent_riparian
-                                     - self.impervious_area_fraction * self.eff_imp))
 
-            if self.flow_predicted_stream < 0:
-                self.flow_predicted_stream = 0
+    def _update_twi_increments_vectorized(self, precip_for_evaporation):
+        """Update the soil zone storages and fluxes of all twi increments
+        at once for the current timestep, see update_twi_increments.
+        """
+        fluxes = update_twi_increments(
+            saturation_deficit_avg=self.saturation_deficit_avg,
+            root_zone_storage=self.root_zone_storage,
+            unsaturated_zone_storage=self.unsaturated_zone_storage,
+            precip_for_recharge=self.precip_for_recharge,
+            precip_for_evaporation=precip_for_evaporation,
+            et_exponent=self.et_exponent,
+            twi_offsets=self.twi_offsets,
+            twi_saturated_areas=self.twi_saturated_areas,
+            root_zone_storage_max=self.root_zone_storage_max,
+            gravity_drained_porosity=self.gravity_drained_porosity,
+            soil_depth_roots=self.soil_depth_roots,
+            macropore_fraction=self.macropore_fraction,
+            vertical_drainage_flux_initial=self.vertical_drainage_flux_initial,
+        )
 
-            self.riparian_storage = (
-                    self.riparian_storage - self.transpiration
-                    + self.flow_predicted_stream * self.lake_fraction
-                    + self.precip_available[i] * self.percent_riparian
-            )
+        self.saturation_deficit_local = fluxes["saturation_deficit_local"]
+        self.root_zone_storage = fluxes["root_zone_storage"]
+        self.unsaturated_zone_storage = fluxes["unsaturated_zone_storage"]
+        self.precip_excesses = fluxes["precip_excesses"]
+        self.evaporation = fluxes["evaporation"]
+        self.qroot = self.qroot + fluxes["qroot"]
+        self.return_flow = self.return_flow + fluxes["return_flow"]
+        self.sat_flow = self.sat_flow + fluxes["sat_flow"]
+        self.flow_predicted_vertical_drainage_flux = (
+            self.flow_predicted_vertical_drainage_flux
+            + fluxes["flow_predicted_vertical_drainage_flux"]
+        )
+        self.transpiration = self.transpiration + fluxes["transpiration"]
+        self.flow_predicted_overland = (
+            self.flow_predicted_overland + fluxes["flow_predicted_overland"]
+        )
 
-            if self.riparian_storage > 0:
-                self.q_riparian = self.riparian_storage / self.lake_delay
-                self.riparian_storage = self.riparian_storage - self.q_riparian
-                self.max_storage = 100000000
 
-                if self.riparian_storage > self.max_storage:
-                    self.q_riparian = self.q_riparian + self.riparian_storage - self.max_storage
-                    self.riparian_storage = self.max_storage
-                if self.q_riparian <= self.flow_predicted_stream * self.lake_fraction:
-                    self.adj_flow = (1 - self.lake_fraction) + self.q_riparian / self.flow_predicted_stream
-                else:
-                    self.adj_flow = 1
-                self.qsrip = self.q_riparian - self.flow_predicted_stream * self.lake_fraction # not sure what this does.
-            else:
-                self.q_riparian = 0
+def preprocess_forcing(precip_available,
+                       precip,
+                       temperatures,
+                       pet_hamon,
+                       grow_trigger,
+                       et_exp_grow,
+                       et_exp_dorm):
+    """Calculate the values of each timestep that only depend on the forcing
+    and not on the model state, so the timestep loop only does the work that
+    depends on the model state.
+
+    :return forcing: A dict of arrays of the precip_available, precip,
+                     temperatures and pet_hamon forcing and of each
+                     timestep's precip_for_evaporation, growing season,
+                     et_exponent and amc_precip
+    :rtype: dict
+    """
+    precip_available = np.asarray(precip_available, dtype=float)
+    temperatures = np.asarray(temperatures, dtype=float)
+
+    # If precip_available <= 0, either no precip or all precip evaporates,
+    # and the remaining pet is the precip for evaporation, unless frozen
+    precip_for_evaporation = np.where(
+        (precip_available <= 0) & (temperatures > 0), -1 * precip_available, 0.0
+    )
+
+    # Temperature > grow trigger means growth, otherwise dormant
+    growing = temperatures > grow_trigger
+    et_exponent = np.where(growing, et_exp_grow, et_exp_dorm)
+
+    # Precipitation added to the antecedent moisture conditions
+    amc_precip = np.where(precip_available <= 0, 0.0, precip_available)
+
+    return {
+        "precip_available": precip_available,
+        "precip": np.asarray(precip, dtype=float),
+        "temperatures": temperatures,
+        "pet_hamon": np.asarray(pet_hamon, dtype=float),
+        "precip_for_evaporation": precip_for_evaporation,
+        "growing": growing,
+        "et_exponent": et_exponent,
+        "amc_precip": amc_precip,
+    }
+
+
+def update_twi_increments(saturation_deficit_avg,
+                          root_zone_storage,
+                          unsaturated_zone_storage,
+                          precip_for_recharge,
+                          precip_for_evaporation,
+                          et_exponent,
+                          twi_offsets,
+                          twi_saturated_areas,
+                          root_zone_storage_max,
+                          gravity_drained_porosity,
+                          soil_depth_roots,
+                          macropore_fraction,
+                          vertical_drainage_flux_initial):
+    """Update the soil zone storages and fluxes of all twi increments at once
+    for one timestep.
+
+    Array version of Topmodel._update_twi_increments_loop, where each
+    conditional branch of the loop is applied to the twi increments that meet
+    the condition using masks. The twi increments are along the last axis of
+    the storages, so that the storages of several models can be updated
+    together by passing storages of shape (num_members, num_twi_increments)
+    and parameters of shape (num_members, 1).
+
+    The twi offsets are the local saturation deficit of each twi increment
+    relative to the watershed average storage deficit,
+    scaling_parameter * (twi_mean * twi_adj - twi_values).
+
+    :return fluxes: A dict of the updated saturation_deficit_local,
+                    root_zone_storage, unsaturated_zone_storage,
+                    precip_excesses and evaporation of each twi increment
+                    and the qroot, return_flow, sat_flow,
+                    flow_predicted_vertical_drainage_flux, transpiration and
+                    flow_predicted_overland summed over the twi increments
+    :rtype: dict
+    """
+    # Local saturation/storage/drainage deficit
+    # =========================================
+    saturation_deficit_local = saturation_deficit_avg + twi_offsets
+
+    soil_root_deficit = (root_zone_storage_max - root_zone_storage) * twi_saturated_areas
+    saturation_excess = ((gravity_drained_porosity * soil_depth_roots)
+                         - saturation_deficit_local) * twi_saturated_areas
+
+    # Saturation excess is added to qroot, see
+    # Topmodel._update_twi_increments_loop
+    qroot = np.where(
+        saturation_excess < soil_root_deficit,
+        saturation_excess,
+        np.where(root_zone_storage == root_zone_storage_max, soil_root_deficit, 0)
+    )
+    qroot = np.sum(np.where(saturation_excess > 0, qroot, 0), axis=-1)
+
+    # Overly saturated increments produce return flow and their local
+    # saturation deficit is set to zero
+    saturated = saturation_deficit_local < 0
+    return_flow = -np.sum(
+        np.where(saturated, saturation_deficit_local * twi_saturated_areas, 0), axis=-1
+    )
+    saturation_deficit_local = np.where(saturated, 0, saturation_deficit_local)
+
+    drained = unsaturated_zone_storage > saturation_deficit_local
+    root_zone_storage = np.where(
+        drained,
+        root_zone_storage + (unsaturated_zone_storage - saturation_deficit_local),
+        root_zone_storage
+    )
+    unsaturated_zone_storage = np.where(drained, saturation_deficit_local, unsaturated_zone_storage)
+
+    # Precipitation
+    # =============
+    precip_excesses = np.zeros(np.shape(root_zone_storage))
+    sat_flow = np.zeros(np.shape(root_zone_storage)[:-1])
+    raining = np.asarray(precip_for_recharge > 0)
+    if raining.any():
+        precip_excess = (
+            precip_for_recharge
+            - (saturation_deficit_local - unsaturated_zone_storage)
+            - (root_zone_storage_max - root_zone_storage)
+        )
+        precip_excesses = np.where(raining, precip_excesses + precip_excess, precip_excesses)
+        precip_excess = np.where(precip_excess < 0, 0, precip_excess)
 
-            self.flow_predicted_stream = (
-                self.flow_predicted_stream * (1 - self.lake_fraction)
-                + self.q_riparian
-            )
+        recharged = raining & ~(np.abs(precip_excess - precip_for_recharge) <= 1E-20)
+        recharge = precip_for_recharge - precip_excess
 
-            # Adjust the flow delivered to the stream by the
-            # channel travel time
-            self.flow_predicted_stream = (
-                self.flow_predicted_stream / 1 # self.channel_travel_time
-            )
+        root_zone_storage_recharged = (
+            root_zone_storage + (1.0 - macropore_fraction) * recharge
+        )
+        unsaturated_zone_storage_recharged = (
+            unsaturated_zone_storage + macropore_fraction * recharge
+        )
 
-            # Final predicted flow
-            # ====================
-            # Append the flow delivered to the stream to the final flow
-            # predicted array
-            self.flow_predicted[i] = self.flow_predicted_stream
-
-            # Saving variables of interest
-            # ============================
-            self.root_zone_avg[i] = np.sum(self.root_zone_storages[i]) / self.num_twi_increments
-            self.q_root[i] = self.qroot
-            self.saturation_deficit_avgs[i] = self.saturation_deficit_avg
-            if self.precip_available[i] > 0:
-                self.evaporation_actual[i] = self.pet_hamon[i]
-            else:
-                if self.precip[i] > 0:
-                    self.evaporation_actual[i] = self.evaporations[i][0] + self.precip[i]
-                else:
-                    self.evaporation_actual[i] = self.evaporations[i][0]
+        # Root zone storage over the maximum spills into the unsaturated
+        # zone, otherwise the unsaturated zone over the local saturation
+        # deficit spills into the root zone
+        overfilled = root_zone_storage_recharged > root_zone_storage_max
+        unsaturated_zone_storage_recharged = np.where(
+            overfilled,
+            unsaturated_zone_storage_recharged
+            + (root_zone_storage_recharged - root_zone_storage_max),
+            unsaturated_zone_storage_recharged
+        )
+        root_zone_storage_recharged = np.where(
+            overfilled, root_zone_storage_max, root_zone_storage_recharged
+        )
 
-        # Post processing
-        # ===============
-        # If option_randomize_daily_to_hourly is True, then convert back from
-        # hourly to daily.
-        self.drop_first = 8760
+        drained = ~overfilled & (unsaturated_zone_storage_recharged > saturation_deficit_local)
+        root_zone_storage_recharged = np.where(
+            drained,
+            root_zone_storage_recharged
+            + (unsaturated_zone_storage_recharged - saturation_deficit_local),
+            root_zone_storage_recharged
+        )
+        unsaturated_zone_storage_recharged = np.where(
+            drained, saturation_deficit_local, unsaturated_zone_storage_recharged
+        )
 
-        if self.option_randomize_daily_to_hourly:
-            self.flow_predicted = (
-                hydrocalcs.sum_hourly_to_daily(self.flow_predicted[self.drop_first:], minmax=self.option_min_max)
-            )
-            self.overland_flow = (
-                hydrocalcs.sum_hourly_to_daily(self.overland_flow[self.drop_first:])
-            )
-            self.flow_predicted_impervious = (
-                hydrocalcs.sum_hourly_to_daily(self.flow_predicted_impervious[self.drop_first:])
-                * self.impervious_area_fraction * self.eff_imp
-            )
-            self.saturation_deficit_avgs = (
-                hydrocalcs.bind_hourly_to_daily(self.saturation_deficit_avgs[self.drop_first:])
-            )
-            self.saturation_deficit_locals = (
-                hydrocalcs.bind_hourly_to_daily(self.saturation_deficit_locals[self.drop_first:])
-            )
-            self.unsaturated_zone_storages = (
-                hydrocalcs.sum_hourly_to_daily(self.unsaturated_zone_storages[self.drop_first:])
-            )
-            self.precip_excesses_op = (
-                hydrocalcs.sum_hourly_to_daily(self.precip_excesses_op[self.drop_first:])
-            )
-            self.root_zone_storages = (
-                hydrocalcs.bind_hourly_to_daily(self.root_zone_storages[self.drop_first:])
-            )
-            self.evaporations = (
-                hydrocalcs.sum_hourly_to_daily(self.evaporations[self.drop_first:])
-            )
-            self.pex_flow = (
-                hydrocalcs.sum_hourly_to_daily(self.pex_flow[self.drop_first:])
-            )
-            self.infiltration_array = (
-                hydrocalcs.sum_hourly_to_daily(self.infiltration_array[self.drop_first:])
-            )
-            self.infiltration_excess = (
-                hydrocalcs.sum_hourly_to_daily(self.infiltration_excess[self.drop_first:])
-            )
-            self.evaporation_actual = (
-                    hydrocalcs.sum_hourly_to_daily(self.evaporation_actual[self.drop_first:])
-            )
-            self.root_zone_avg = (
-                hydrocalcs.bind_hourly_to_daily(self.root_zone_avg[self.drop_first:])
-            )
-            self.q_root = (
-                hydrocalcs.sum_hourly_to_daily(self.q_root[self.drop_first:])
-            )
-            self.sub_flow = (
-                hydrocalcs.sum_hourly_to_daily(self.sub_flow[self.drop_first:])
-            )
-            self.return_flow_totals = (
-                hydrocalcs.sum_hourly_to_daily(self.return_flow_totals[self.drop_first:])
-            )
-            self.karst_flow = (
-                hydrocalcs.sum_hourly_to_daily(self.karst_flow[self.drop_first:])
-            )
\ No newline at end of file
+        overfilled = root_zone_storage_recharged > root_zone_storage_max
+        precip_excesses = np.where(
+            recharged & overfilled,
+            (root_zone_storage_recharged - root_zone_storage_max) * twi_saturated_areas,
+            precip_excesses
+        )
+        root_zone_storage_recharged = np.where(
+            overfilled, root_zone_storage_max, root_zone_storage_recharged
+        )
+
+        root_zone_storage = np.where(recharged, root_zone_storage_recharged, root_zone_storage)
+        unsaturated_zone_storage = np.where(
+            recharged, unsaturated_zone_storage_recharged, unsaturated_zone_storage
+        )
+
+        sat_flow = np.sum(precip_excesses, axis=-1)
+
+    # Drainage from unsaturated zone storage
+    # ======================================
+    # Equation 23 in Wolock, 1993, limited to the soil water available
+    # for drainage
+    unsaturated = saturation_deficit_local > 0
+    vertical_drainage_flux = np.where(
+        unsaturated,
+        vertical_drainage_flux_initial
+        * (unsaturated_zone_storage / np.where(unsaturated, saturation_deficit_local, 1)),
+        0
+    )
+    vertical_drainage_flux = np.where(
+        unsaturated & (vertical_drainage_flux > unsaturated_zone_storage),
+        unsaturated_zone_storage,
+        vertical_drainage_flux
+    )
+    unsaturated_zone_storage = unsaturated_zone_storage - vertical_drainage_flux
+    flow_predicted_vertical_drainage_flux = np.sum(
+        vertical_drainage_flux * twi_saturated_areas, axis=-1
+    )
+
+    # Evaporation from soil root zone storage
+    # =======================================
+    evaporating = np.asarray(precip_for_evaporation > 0)
+    if evaporating.any():
+        evaporation = np.where(
+            evaporating,
+            precip_for_evaporation
+            * (root_zone_storage / root_zone_storage_max)**et_exponent,
+            0
+        )
+        evaporation = np.where(evaporation > root_zone_storage, root_zone_storage, evaporation)
+        root_zone_storage = root_zone_storage - evaporation
+    else:
+        evaporation = np.zeros(np.shape(root_zone_storage))
+    transpiration = np.sum(evaporation * twi_saturated_areas, axis=-1)
+
+    # Overland flow
+    # =============
+    flow_predicted_overland = np.sum(
+        np.where(precip_excesses > 0, precip_excesses * twi_saturated_areas, 0), axis=-1
+    )
+
+    fluxes = {
+        "saturation_deficit_local": saturation_deficit_local,
+        "root_zone_storage": root_zone_storage,
+        "unsaturated_zone_storage": unsaturated_zone_storage,
+        "precip_excesses": precip_excesses,
+        "evaporation": evaporation,
+        "qroot": qroot,
+        "return_flow": return_flow,
+        "sat_flow": sat_flow,
+        "flow_predicted_vertical_drainage_flux": flow_predicted_vertical_drainage_flux,
+        "transpiration": transpiration,
+        "flow_predicted_overland": flow_predicted_overland,
+    }
+
+    return fluxes
@@ -0,0 +1,272 @@
+"""Generalized likelihood uncertainty estimation (GLUE) of the flow predicted.
+
+Parameter sets of the parameters of a calibration bounds file (*.csv), see
+calibration.read_bounds, are drawn with Latin hypercube sampling and run
+through the same process pool as the calibration, see
+calibration.run_trial. Parameter sets with a Nash-Sutcliffe efficiency
+greater than the behavioral threshold are kept, with the likelihood weight
+
+    L = (E - threshold) / (1 - threshold)
+
+and their flow predicted is added to a sketch.QuantileSketch of each day
+right away, from which the weighted percentile bands of the flow predicted
+are estimated. Runs that can not reach the threshold are stopped early with
+a metrics.NashSutcliffeBound. Only the sketch and the flows of one batch of
+samples are kept, so memory does not depend on the number of samples, and
+the behavioral parameter sets are written to a file as they are found.
+With option_distribution_record, the samples can also be spread over several
+realizations of the random rain distribution, each with its own seed
+spawned from the random_seed option, see hydrocalcs.seed_sequences.
+
+Reference:
+
+Beven, K. and Binley, A., 1992, The future of distributed models: Model
+calibration and uncertainty prediction, Hydrological Processes, 6(3),
+279-298.
+
+:authors: 2019 by Alexander Headman, Jeremiah Lant, see AUTHORS
+:license: CC0 1.0, see LICENSE file for details
+"""
+
+import contextlib
+import csv
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import PurePath
+
+import numpy as np
+import pandas as pd
+
+from . import calibration
+from . import metrics
+from .sketch import QuantileSketch
+
+
+def uncertainty(configfile,
+                boundsfile,
+                num_samples=10000,
+                threshold=0.5,
+                percentiles=(5, 50, 95),
+                batch_size=1000,
+                workers=1,
+                seed=None,
+                behavioral_filename=None,
+                relative_accuracy=0.01,
+                num_realizations=1):
+    """Estimate the percentile bands of the flow predicted of the
+    behavioral parameter sets of a Latin hypercube sample.
+
+    :param configfile: The file path to the model config file
+    :type configfile: string
+    :param boundsfile: The file path to the calibration bounds file
+    :type boundsfile: string
+    :param num_samples: Number of parameter sets drawn
+    :type num_samples: int
+    :param threshold: Nash-Sutcliffe efficiency a behavioral parameter set
+                      must exceed
+    :type threshold: float
+    :param percentiles: Percentiles of the bands, between 0 and 100
+    :type percentiles: tuple
+    :param batch_size: Number of parameter sets of each Latin hypercube
+                       sample, whose flows are kept at the same time
+    :type batch_size: int
+    :param workers: Number of processes running parameter sets in parallel
+    :type workers: int
+    :param seed: Seed of the samples, by default the random_seed option
+    :type seed: int
+    :param behavioral_filename: The file path of the csv file the
+                                behavioral parameter sets are written to,
+                                none are written if None
+    :type behavioral_filename: string
+    :param relative_accuracy: Relative accuracy of the percentile bands
+    :type relative_accuracy: float
+    :param num_realizations: Number of realizations of the rain
+                             distribution, sample k is run with realization
+                             k modulo num_realizations, see
+                             main.get_topmodel_arguments. With 1, every
+                             sample is run with the random_seed option.
+    :type num_realizations: int
+    :return uncertainty_data: A dict of the percentile bands, of shape
+                              num_percentiles x num_days, their dates and
+                              the number of samples, behavioral and aborted
+                              parameter sets
+    :rtype: dict
+    """
+    if not threshold < 1:
+        raise ValueError(
+            "Incorrect behavioral threshold: {}\n"
+            "Threshold must be less than 1.".format(threshold)
+        )
+    if num_realizations < 1:
+        raise ValueError(
+            "Incorrect number of realizations: {}\n"
+            "Number of realizations must be at least 1.".format(num_realizations)
+        )
+
+    inputs = calibration.initialize_worker(configfile, boundsfile, "nash_sutcliffe")
+    bounds = inputs["bounds"]
+    config_data = inputs["config_data"]
+    if seed is None:
+        seed = config_data["Options"].getint("random_seed", fallback=10)
+    rng = np.random.default_rng(seed)
+    lower = np.array([minimum for _, minimum, _ in bounds.values()])
+    upper = np.array([maximum for _, _, maximum in bounds.values()])
+
+    uncertainty_data = {
+        "percentiles": tuple(percentiles),
+        "num_samples": num_samples,
+        "num_behavioral": 0,
+        "num_aborted": 0,
+    }
+    sketch = None
+
+    with _open_behavioral_file(behavioral_filename, bounds) as writer:
+        pool = None
+        if workers > 1:
+            pool = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=calibration.initialize_worker,
+                initargs=(configfile, boundsfile, "nash_sutcliffe"),
+            )
+        try:
+            for start in range(0, num_samples, batch_size):
+                size = min(batch_size, num_samples - start)
+                samples = lower + latin_hypercube(rng, size, len(bounds)) * (upper - lower)
+                realizations = [
+                    k % num_realizations if num_realizations > 1 else None
+                    for k in range(start, start + size)
+                ]
+                results = (pool.map if pool else map)(
+                    evaluate_sample, samples, [threshold] * size, realizations
+                )
+
+                # Flows and likelihood weights of the behavioral members
+                flows = []
+                weights = []
+                for values, realization, (value, flow, aborted) in zip(samples, realizations, results):
+                    uncertainty_data["num_aborted"] += aborted
+                    if flow is None:
+                        continue
+                    flows.append(flow)
+                    weights.append((value - threshold) / (1 - threshold))
+                    if writer is not None:
+                        writer.writerow([*values, value, "" if realization is None else realization])
+
+                if not flows:
+                    continue
+                if sketch is None:
+                    sketch = QuantileSketch(num_series=len(flows[0]),
+                                            relative_accuracy=relative_accuracy)
+                sketch.update(np.column_stack(flows), weights=np.array(weights))
+                uncertainty_data["num_behavioral"] += len(flows)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    timeseries = inputs["timeseries"]
+    if sketch is None:
+        uncertainty_data["bands"] = None
+        uncertainty_data["dates"] = None
+    else:
+        uncertainty_data["bands"] = sketch.quantiles(np.asarray(percentiles) / 100).T
+        uncertainty_data["dates"] = timeseries.index[-sketch.num_series:]
+
+    return uncertainty_data
+
+
+def latin_hypercube(rng, num_samples, num_parameters):
+    """Draw a Latin hypercube sample in the unit hypercube. Each parameter
+    has exactly one value in each of num_samples intervals of equal width,
+    in random order.
+
+    :param rng: Random number generator
+    :type rng: numpy.random.Generator
+    :param num_samples: Number of samples
+    :type num_samples: int
+    :param num_parameters: Number of parameters
+    :type num_parameters: int
+    :return samples: Samples of shape num_samples x num_parameters
+    :rtype: numpy.ndarray
+    """
+    intervals = np.argsort(rng.random((num_parameters, num_samples)), axis=1).T
+
+    return (intervals + rng.random((num_samples, num_parameters))) / num_samples
+
+
+def evaluate_sample(values, threshold, realization=None):
+    """Run Topmodel with a sampled parameter set, stopping the run once its
+    Nash-Sutcliffe efficiency can not exceed the threshold. Runs in a
+    process initialized with calibration.initialize_worker.
+
+    :param values: Values of the parameters, in the order of the bounds file
+    :type values: numpy.ndarray
+    :param threshold: Behavioral Nash-Sutcliffe efficiency threshold
+    :type threshold: float
+    :param realization: Realization of the rain distribution, see
+                        main.get_topmodel_arguments
+    :type realization: int
+    :return: Tuple of the Nash-Sutcliffe efficiency, or its upper bound if
+             the run was aborted, the daily flow predicted if behavioral,
+             otherwise None, and whether the run was aborted
+    :rtype: tuple
+    """
+    flow_predicted, observed, objective_bound = calibration.run_trial(
+        values, threshold, realization
+    )
+    if objective_bound.exceeded:
+        return objective_bound.nash_sutcliffe_max, None, True
+
+    value = metrics.goodness_of_fit(observed, flow_predicted)["nash_sutcliffe"][0]
+    if not value > threshold:
+        return value, None, False
+
+    return value, np.asarray(flow_predicted, dtype=float), False
+
+
+def write_uncertainty_csv(uncertainty_data, filename):
+    """Write the percentile bands of the flow predicted to a csv file.
+
+    :param uncertainty_data: A dict of uncertainty results from uncertainty
+    :type uncertainty_data: dict
+    :param filename: The file path of the csv file
+    :type filename: string
+    """
+    columns = [
+        "flow_predicted_p{:g} (mm/day)".format(percentile)
+        for percentile in uncertainty_data["percentiles"]
+    ]
+    bands_df = pd.DataFrame(uncertainty_data["bands"].T,
+                            index=uncertainty_data["dates"],
+                            columns=columns)
+    bands_df.to_csv(filename, float_format="%.4f")
+
+
+def get_uncertainty_filenames(config_data):
+    """Get the file paths of the uncertainty bands and behavioral parameter
+    sets output files.
+
+    :param config_data: A ConfigParser object that behaves much like a dictionary.
+    :type config_data: ConfigParser
+    :rtype: tuple
+    """
+    output_dir = config_data["Outputs"]["output_dir"]
+
+    return (
+        PurePath(output_dir, config_data["Outputs"].get(
+            "output_filename_uncertainty", fallback="uncertainty.csv")),
+        PurePath(output_dir, config_data["Outputs"].get(
+            "output_filename_behavioral", fallback="behavioral.csv")),
+    )
+
+
+@contextlib.contextmanager
+def _open_behavioral_file(filename, bounds):
+    """Context manager of the csv writer of the behavioral parameter sets,
+    None if there is no file."""
+    if filename is None:
+        yield None
+        return
+
+    with open(filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([*bounds, "nash_sutcliffe", "realization"])
+        yield writer